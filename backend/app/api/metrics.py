@@ -0,0 +1,19 @@
+"""
+运行指标API路由
+以Prometheus文本格式导出当前worker进程的指标
+"""
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..metrics import REGISTRY
+
+router = APIRouter()
+
+
+@router.get("", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """
+    指标端点 - 多worker部署时每个进程的指标相互独立，需按实例分别抓取
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,30 @@
+"""
+快速JSON响应
+路由直接返回ORJSONResponse时，FastAPI不会再按response_model校验和jsonable_encoder转换，
+DAO读出的模型由orjson直接序列化为字节；response_model仍保留用于生成接口文档
+"""
+
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse as _ORJSONResponse
+from pydantic import BaseModel
+
+
+def _default(obj: Any) -> Any:
+    """orjson无法直接序列化的对象：Pydantic模型取字段字典，嵌套模型会再次回调"""
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONResponse(_ORJSONResponse):
+    """
+    支持Pydantic模型的orjson响应
+
+    UTC时间输出为"Z"后缀，与Pydantic的JSON序列化结果保持一致
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
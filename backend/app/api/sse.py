@@ -0,0 +1,491 @@
+"""
+SSE流式输出
+把模型输出的细碎文本片段按时间窗口或字节数合并成较少的SSE事件，按固定间隔检查客户端是否断开；
+生成在后台进行并缓存在有界环形缓冲区中，断线的客户端可以凭Last-Event-ID续传
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from fastapi import Request
+
+from ..metrics import CHAT_TURNS, SSE_ACTIVE_STREAMS, SSE_CHUNKS, SSE_CLIENT_DISCONNECTS, SSE_EVENTS, SSE_STREAMS
+from ..services.conversation_writer import ConversationSaveError
+from ..services.llm_service import LLMOverloadedError, LLMServiceError
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 合并文本片段的时间窗口(秒)
+SSE_COALESCE_INTERVAL = float(os.environ.get("SSE_COALESCE_INTERVAL", "0.03"))
+# 合并后单个事件达到该字节数时立即发送
+SSE_COALESCE_BYTES = int(os.environ.get("SSE_COALESCE_BYTES", "256"))
+# 检查客户端是否断开的间隔(秒)
+SSE_DISCONNECT_CHECK_INTERVAL = float(os.environ.get("SSE_DISCONNECT_CHECK_INTERVAL", "1.0"))
+# 已从上游读取但尚未发送的文本片段上限，超过后暂停读取上游
+SSE_BUFFER_CHUNKS = int(os.environ.get("SSE_BUFFER_CHUNKS", "256"))
+# 每次生成缓存的事件数上限，用于断线续传
+SSE_REPLAY_BUFFER_EVENTS = int(os.environ.get("SSE_REPLAY_BUFFER_EVENTS", "1024"))
+# 所有连接断开后继续生成等待重连的时间(秒)，超时后取消生成
+SSE_RESUME_GRACE = float(os.environ.get("SSE_RESUME_GRACE", "30"))
+# 生成结束后缓冲区保留的时间(秒)
+SSE_RESUME_RETENTION = float(os.environ.get("SSE_RESUME_RETENTION", "60"))
+
+# 上游结束标记
+_END = object()
+
+
+class EventsEvictedError(LookupError):
+    """订阅者需要的事件已被环形缓冲区覆盖"""
+
+
+class ErrorMessage(str):
+    """生成出错时写入缓冲区的错误信息，作为error类型的SSE事件发送，不与回复文本混在一起"""
+
+
+class _Failure:
+    """上游抛出的异常，交给消费方重新抛出"""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def coalesce(
+    chunks: AsyncIterator[str],
+    interval: float = SSE_COALESCE_INTERVAL,
+    max_bytes: int = SSE_COALESCE_BYTES,
+    buffer_chunks: int = SSE_BUFFER_CHUNKS
+) -> AsyncGenerator[str, None]:
+    """
+    合并文本片段
+
+    第一个片段立即输出，不增加首字延迟；之后每个输出从收到的第一个片段开始计时，
+    窗口结束或累计达到max_bytes时输出。上游由后台任务读入有界队列，
+    消费方跟不上时队列写满，后台任务随之停止读取上游，内存占用有上限。
+    对话接口中消费方是Generation的后台任务，客户端读取的快慢不影响这里（见Generation）。
+
+    Args:
+        chunks: 上游文本片段
+        interval: 合并时间窗口(秒)
+        max_bytes: 单次输出的字节数上限，达到后立即输出
+        buffer_chunks: 队列中最多缓存的片段数
+
+    Returns:
+        合并后的文本
+    """
+    queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=buffer_chunks)
+
+    async def pump() -> None:
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await queue.put(chunk)
+            await queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_Failure(e))
+
+    loop = asyncio.get_running_loop()
+    producer = asyncio.ensure_future(pump())
+    first = True
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            if first:
+                first = False
+                yield item
+                continue
+
+            parts: List[str] = [item]
+            size = len(item.encode("utf-8"))
+            deadline = loop.time() + interval
+            tail: Any = None
+            while size < max_bytes:
+                if queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = queue.get_nowait()
+                if item is _END or isinstance(item, _Failure):
+                    tail = item
+                    break
+                parts.append(item)
+                size += len(item.encode("utf-8"))
+
+            yield "".join(parts)
+            if tail is _END:
+                return
+            if tail is not None:
+                raise tail.error
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+
+class DisconnectMonitor:
+    """按固定间隔检查客户端是否断开，避免每个事件都去读取一次receive通道"""
+
+    def __init__(self, request: Request, interval: float = SSE_DISCONNECT_CHECK_INTERVAL):
+        self.request = request
+        self.interval = interval
+        self._next_check = 0.0
+
+    async def disconnected(self) -> bool:
+        """距离上次检查超过间隔时才真正检查"""
+        now = asyncio.get_running_loop().time()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.interval
+        return await self.request.is_disconnected()
+
+
+class Generation:
+    """
+    一次模型回复的生成过程
+
+    生成在后台任务中进行，与客户端连接解耦：合并后的事件按顺序号写入有界环形缓冲区，
+    订阅者（SSE连接）从指定顺序号之后读取，连接断开后用Last-Event-ID重连即可从缓冲区续传，
+    不需要重新调用模型。没有订阅者超过宽限期时取消生成，已生成的部分按中断处理。
+    生成出错时写入一个错误事件（ErrorMessage），随后同样以[DONE]结束。
+    客户端读取过慢时不反压生成，缓冲区写满后覆盖最早的事件，内存占用不超过capacity个事件；
+    需要的事件已被覆盖的订阅者收到错误事件后结束。
+    """
+
+    def __init__(self, response_id: int, turn_key: str, endpoint: str, capacity: int, grace: float):
+        self.id = uuid.uuid4().hex[:16]
+        self.response_id = response_id
+        self.turn_key = turn_key
+        self.endpoint = endpoint
+        self.grace = grace
+        self.done = False
+        self._events: Deque[Tuple[int, str]] = deque(maxlen=capacity)
+        self._next_seq = 1
+        self._updated = asyncio.Event()
+        self._subscribers = 0
+        self._task: Optional[asyncio.Task] = None
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+
+    def start(
+        self,
+        make_chunks: Callable[[], AsyncIterator[str]],
+        lock: asyncio.Lock,
+        on_finish: Callable[["Generation"], None]
+    ) -> None:
+        """
+        开始在后台生成，获得lock后才创建并读取文本片段，同一回答的轮次依次进行；
+        订阅前即开始宽限期计时，一直没有连接订阅（包括排队期间）时同样会被取消
+        """
+        self._task = asyncio.ensure_future(self._run(make_chunks, lock))
+        self._task.add_done_callback(lambda _: on_finish(self))
+        self._arm_abandon_timer()
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """生成结束（包括被取消）后调用callback"""
+        self._task.add_done_callback(lambda _: callback())
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.id}:{seq}"
+
+    def can_resume_from(self, seq: int) -> bool:
+        """顺序号之后的事件是否仍全部在缓冲区中"""
+        first_seq = self._events[0][0] if self._events else self._next_seq
+        return first_seq - 1 <= seq < self._next_seq
+
+    async def subscribe(self, after_seq: int = 0) -> AsyncGenerator[Tuple[int, str], None]:
+        """
+        读取顺序号大于after_seq的事件，生成结束后返回
+
+        Args:
+            after_seq: 客户端已收到的最后一个事件的顺序号
+
+        Returns:
+            (顺序号, 事件数据)
+        """
+        self._attach()
+        try:
+            seq = after_seq
+            while True:
+                updated = self._updated
+                if seq + 1 < self._next_seq:
+                    if not self.can_resume_from(seq):
+                        raise EventsEvictedError("客户端读取过慢，缓冲区中的事件已被覆盖")
+                    first_seq = self._events[0][0]
+                    for event_seq, data in list(islice(self._events, seq + 1 - first_seq, None)):
+                        seq = event_seq
+                        yield event_seq, data
+                    continue
+                if self.done:
+                    return
+                await updated.wait()
+        finally:
+            self._detach()
+
+    def _append(self, data: str) -> None:
+        self._events.append((self._next_seq, data))
+        self._next_seq += 1
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def _run(self, make_chunks: Callable[[], AsyncIterator[str]], lock: asyncio.Lock) -> None:
+        chunk_count = 0
+        event_count = 0
+
+        async def counted() -> AsyncGenerator[str, None]:
+            nonlocal chunk_count
+            async for chunk in make_chunks():
+                chunk_count += 1
+                yield chunk
+
+        try:
+            async with lock:
+                async for text in coalesce(counted()):
+                    event_count += 1
+                    self._append(text)
+            logger.info(f"流式响应完成，共{chunk_count}个文本片段，合并为{event_count}个事件")
+            # 完成标记同样进入缓冲区，续传的客户端也能收到
+            self._append("[DONE]")
+        except asyncio.CancelledError:
+            logger.info(f"生成已取消: response_id={self.response_id}, generation={self.id}")
+            raise
+        except (LLMServiceError, LLMOverloadedError, ConversationSaveError) as e:
+            logger.error(f"流式响应出错: {str(e)}")
+            self._append(ErrorMessage(str(e)))
+            self._append("[DONE]")
+        except Exception as e:
+            logger.error(f"流式响应出错: {str(e)}")
+            self._append(ErrorMessage(f"服务器错误: {str(e)}"))
+            self._append("[DONE]")
+        finally:
+            SSE_CHUNKS.inc(chunk_count, endpoint=self.endpoint)
+            SSE_EVENTS.inc(event_count, endpoint=self.endpoint)
+            self.done = True
+            self._disarm_abandon_timer()
+            updated, self._updated = self._updated, asyncio.Event()
+            updated.set()
+
+    def _attach(self) -> None:
+        self._subscribers += 1
+        self._disarm_abandon_timer()
+
+    def _detach(self) -> None:
+        self._subscribers -= 1
+        if self._subscribers == 0:
+            self._arm_abandon_timer()
+
+    def _arm_abandon_timer(self) -> None:
+        if self.done or self._subscribers or self._abandon_timer is not None:
+            return
+        self._abandon_timer = asyncio.get_running_loop().call_later(self.grace, self._abandon)
+
+    def _disarm_abandon_timer(self) -> None:
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+
+    def _abandon(self) -> None:
+        self._abandon_timer = None
+        if not self.done and self._task is not None:
+            logger.info(f"宽限期内客户端未重连，取消生成: response_id={self.response_id}, generation={self.id}")
+            self._task.cancel()
+
+
+class GenerationRegistry:
+    """
+    进程内的生成登记表，按回答做single-flight
+
+    同一回答有相同轮次（同一接口、同一消息）正在进行时，重复的请求（双击、重试、前端重新挂载）
+    直接订阅已有的生成，不再调用模型；不同的轮次按到达顺序排队，依次进行。
+    生成结束后仍保留一段时间供重连的客户端读取剩余事件，每个回答最多保留一个已结束的缓冲区。
+    """
+
+    def __init__(
+        self,
+        capacity: int = SSE_REPLAY_BUFFER_EVENTS,
+        grace: float = SSE_RESUME_GRACE,
+        retention: float = SSE_RESUME_RETENTION
+    ):
+        self.capacity = capacity
+        self.grace = grace
+        self.retention = retention
+        self._generations: Dict[str, Generation] = {}
+        self._in_flight: Dict[int, List[Generation]] = {}
+        self._finished: Dict[int, Generation] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def start(
+        self,
+        response_id: int,
+        turn_key: str,
+        make_chunks: Callable[[], AsyncIterator[str]],
+        endpoint: str
+    ) -> Tuple[Generation, bool]:
+        """
+        开始一次生成，相同轮次正在进行时返回已有的生成
+
+        Args:
+            response_id: 回答ID
+            turn_key: 轮次标识，相同标识的并发请求视为重复
+            make_chunks: 创建文本片段的函数，轮到该轮次时才调用
+            endpoint: 指标中的接口名称
+
+        Returns:
+            (生成对象, 是否为已有的生成)
+        """
+        existing = self.join(response_id, turn_key, endpoint)
+        if existing is not None:
+            return existing, True
+
+        in_flight = self._in_flight.setdefault(response_id, [])
+        if in_flight:
+            CHAT_TURNS.inc(endpoint=endpoint, outcome="queued")
+            logger.info(f"回答已有{len(in_flight)}轮对话在进行，排队等待: response_id={response_id}")
+        else:
+            CHAT_TURNS.inc(endpoint=endpoint, outcome="started")
+
+        generation = Generation(response_id, turn_key, endpoint, self.capacity, self.grace)
+        self._generations[generation.id] = generation
+        in_flight.append(generation)
+        lock = self._locks.setdefault(response_id, asyncio.Lock())
+        generation.start(make_chunks, lock, self._on_finish)
+        return generation, False
+
+    def join(self, response_id: int, turn_key: str, endpoint: str) -> Optional[Generation]:
+        """
+        查找同一回答中正在进行的相同轮次
+
+        Args:
+            response_id: 回答ID
+            turn_key: 轮次标识
+            endpoint: 指标中的接口名称
+
+        Returns:
+            正在进行的生成，没有时返回None
+        """
+        for generation in self._in_flight.get(response_id, ()):
+            if generation.turn_key == turn_key:
+                CHAT_TURNS.inc(endpoint=endpoint, outcome="joined")
+                logger.info(f"相同轮次正在进行，复用已有的生成: response_id={response_id}, generation={generation.id}")
+                return generation
+        return None
+
+    def is_idle(self, response_id: int) -> bool:
+        """回答没有进行中或排队中的轮次，新的生成会立即开始"""
+        return not self._in_flight.get(response_id)
+
+    def get(self, generation_id: str) -> Optional[Generation]:
+        return self._generations.get(generation_id)
+
+    def _on_finish(self, generation: Generation) -> None:
+        response_id = generation.response_id
+        in_flight = self._in_flight.get(response_id, [])
+        if generation in in_flight:
+            in_flight.remove(generation)
+        if not in_flight:
+            # 没有进行或排队中的轮次，锁不再有等待者
+            self._in_flight.pop(response_id, None)
+            self._locks.pop(response_id, None)
+
+        # 新一轮结束后，上一轮的缓冲区不再需要
+        previous = self._finished.get(response_id)
+        if previous is not None:
+            self._generations.pop(previous.id, None)
+        self._finished[response_id] = generation
+        asyncio.get_running_loop().call_later(self.retention, self._remove, generation)
+
+    def _remove(self, generation: Generation) -> None:
+        self._generations.pop(generation.id, None)
+        if self._finished.get(generation.response_id) is generation:
+            del self._finished[generation.response_id]
+
+
+def parse_last_event_id(value: str) -> Tuple[str, int]:
+    """
+    解析Last-Event-ID
+
+    Args:
+        value: "生成ID:顺序号"
+
+    Returns:
+        (生成ID, 顺序号)
+
+    Raises:
+        ValueError: 格式无效
+    """
+    generation_id, sep, seq = value.strip().rpartition(":")
+    if not sep or not generation_id:
+        raise ValueError(f"无效的Last-Event-ID: {value}")
+    return generation_id, int(seq)
+
+
+async def stream_events(
+    request: Request,
+    generation: Generation,
+    endpoint: str,
+    after_seq: int = 0
+) -> AsyncGenerator[Dict[str, str], None]:
+    """
+    把生成的事件作为SSE事件发送，每个事件携带"生成ID:顺序号"形式的id
+
+    连接断开只会结束本次订阅，生成继续在后台进行，客户端在宽限期内重连即可续传。
+    sse_starlette在收到http.disconnect时会取消生成器所在的任务，
+    这里的定时检查用于兜底，二者都不需要逐个事件检查连接状态。
+
+    Args:
+        request: 请求对象
+        generation: 生成对象
+        endpoint: 指标中的接口名称
+        after_seq: 从该顺序号之后开始发送，用于续传
+
+    Returns:
+        SSE事件字典
+    """
+    client_ip = request.client.host if request.client else "unknown"
+    monitor = DisconnectMonitor(request)
+    events = generation.subscribe(after_seq)
+    SSE_STREAMS.inc(endpoint=endpoint)
+    SSE_ACTIVE_STREAMS.inc(endpoint=endpoint)
+    try:
+        async for seq, data in events:
+            if await monitor.disconnected():
+                SSE_CLIENT_DISCONNECTS.inc(endpoint=endpoint)
+                logger.warning(f"客户端断开连接，IP: {client_ip}")
+                return
+            if isinstance(data, ErrorMessage):
+                yield {"id": generation.event_id(seq), "event": "error", "data": data}
+            else:
+                yield {"id": generation.event_id(seq), "data": data}
+
+    except asyncio.CancelledError:
+        # 客户端断开时sse_starlette会取消生成器所在的任务
+        SSE_CLIENT_DISCONNECTS.inc(endpoint=endpoint)
+        raise
+    except EventsEvictedError as e:
+        logger.warning(f"{str(e)}: generation={generation.id}")
+        # 与生成出错时一样作为error事件发送，随后结束本次响应，被覆盖的事件无法续传
+        yield {"event": "error", "data": "连接过慢，部分内容已丢失，请刷新对话"}
+        yield {"data": "[DONE]"}
+    finally:
+        SSE_ACTIVE_STREAMS.dec(endpoint=endpoint)
+        # 退出订阅，最后一个订阅者离开时开始宽限期计时
+        await events.aclose()
+
+
+# 进程内共享的生成登记表
+generation_registry = GenerationRegistry()
@@ -5,18 +5,27 @@
 
 from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from ..concurrency import gather_with_timeouts
 from ..services.survey_service import SurveyService, SurveyResponseService
+from ..services.conversation_context import conversation_context_cache
+from ..services.export_service import SurveyExportService
+from .responses import ORJSONResponse
+from ..database import InvalidCursorError
 from ..database.schemas import (
     Survey, SurveyCreate, SurveyUpdate,
-    SurveyQuestion, SurveyQuestionCreate, SurveyQuestionUpdate,
+    SurveyQuestion, SurveyQuestionCreate, SurveyQuestionUpdate, SurveyQuestionOrderUpdate,
     SurveyResponse, SurveyResponseCreate,
-    SurveyWithQuestions, SurveyResponseWithConversations
+    SurveyWithQuestions, SurveyResponseWithConversations, SurveyResponseStats
 )
 
 router = APIRouter()
 
+# 游标分页的下一页游标响应头
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 
 # 问卷API
 @router.post("/", response_model=Survey, status_code=201)
@@ -29,11 +38,35 @@ async def create_survey(survey: SurveyCreate):
 async def list_surveys(
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="分页游标，取上一页响应头X-Next-Cursor的值"),
+    keyset: bool = Query(False, description="第一页即使用游标分页"),
     status: Optional[str] = Query(None, description="问卷状态过滤"),
     user_id: Optional[str] = Query(None, description="用户ID过滤")
 ):
-    """获取问卷列表，支持分页和过滤"""
-    return await SurveyService.get_all_surveys(limit, offset, status, user_id)
+    """
+    获取问卷列表，支持分页和过滤
+    
+    默认使用偏移分页；传入cursor或keyset=true时使用游标分页，按(created_at, id)倒序稳定排序，
+    下一页游标通过X-Next-Cursor响应头返回
+    """
+    if cursor or keyset:
+        try:
+            surveys, next_cursor = await SurveyService.get_surveys_page(limit, cursor, status, user_id, raw=True)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+        return ORJSONResponse(surveys, headers=headers)
+    return ORJSONResponse(await SurveyService.get_all_surveys(limit, offset, status, user_id, raw=True))
+
+
+@router.get("/stats", response_model=List[SurveyResponseStats])
+async def list_survey_stats(
+    survey_ids: Optional[List[int]] = Query(None, max_length=500, description="问卷ID列表")
+):
+    """批量获取多个问卷的回答统计，供仪表盘一次性查询"""
+    if not survey_ids:
+        raise HTTPException(status_code=400, detail="缺少survey_ids参数")
+    return await SurveyResponseService.get_surveys_stats(survey_ids)
 
 
 @router.get("/{survey_id}", response_model=Survey)
@@ -51,7 +84,55 @@ async def get_survey_with_questions(survey_id: int = Path(..., ge=1, description
     survey = await SurveyService.get_survey_with_questions(survey_id)
     if not survey:
         raise HTTPException(status_code=404, detail="问卷不存在")
-    return survey
+    return ORJSONResponse(survey)
+
+
+@router.get("/{survey_id}/stats", response_model=SurveyResponseStats)
+async def get_survey_stats(survey_id: int = Path(..., ge=1, description="问卷ID")):
+    """获取问卷的回答统计：回答总数、各状态数量、完成率和平均对话轮数"""
+    return await SurveyResponseService.get_survey_stats(survey_id)
+
+
+@router.get("/{survey_id}/responses", response_model=List[SurveyResponse])
+async def list_survey_responses(
+    survey_id: int = Path(..., ge=1, description="问卷ID"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="分页游标，取上一页响应头X-Next-Cursor的值"),
+    status: Optional[str] = Query(None, description="回答状态过滤")
+):
+    """按(created_at, id)倒序游标分页获取问卷的回答，下一页游标通过X-Next-Cursor响应头返回"""
+    try:
+        responses, next_cursor = await SurveyResponseService.get_responses_page(
+            survey_id, limit, cursor, status, raw=True
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return ORJSONResponse(responses, headers=headers)
+
+
+@router.get("/{survey_id}/export")
+async def export_survey_transcripts(
+    survey_id: int = Path(..., ge=1, description="问卷ID"),
+    format: str = Query("ndjson", regex="^(ndjson|csv)$", description="导出格式: ndjson 或 csv"),
+    status: Optional[str] = Query(None, description="回答状态过滤")
+):
+    """
+    流式导出问卷的全部回答及对话记录
+    
+    NDJSON每行一个回答及其按顺序排列的对话；CSV每行一条对话消息
+    """
+    survey = await SurveyService.get_survey(survey_id)
+    if not survey:
+        raise HTTPException(status_code=404, detail="问卷不存在")
+    
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"survey_{survey_id}_transcripts.{format}"
+    return StreamingResponse(
+        SurveyExportService.stream_export(survey_id, format, status),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @router.patch("/{survey_id}", response_model=Survey)
@@ -72,6 +153,7 @@ async def delete_survey(survey_id: int = Path(..., ge=1, description="问卷ID")
     success = await SurveyService.delete_survey(survey_id)
     if not success:
         raise HTTPException(status_code=404, detail="问卷不存在")
+    conversation_context_cache.invalidate_survey(survey_id)
     return None
 
 
@@ -90,7 +172,24 @@ async def add_question(
     # 创建问题
     question_data = question.dict()
     question_data['survey_id'] = survey_id
-    return await SurveyService.add_question_to_survey(survey_id, question_data)
+    created = await SurveyService.add_question_to_survey(survey_id, question_data)
+    # 问题变更后，该问卷下缓存的对话上下文需要重新构建提示词
+    conversation_context_cache.invalidate_survey(survey_id)
+    return created
+
+
+@router.put("/{survey_id}/questions/order", response_model=List[SurveyQuestion])
+async def reorder_questions(
+    order_update: SurveyQuestionOrderUpdate,
+    survey_id: int = Path(..., ge=1, description="问卷ID")
+):
+    """按给定的问题ID顺序重新排列问卷的全部问题"""
+    try:
+        questions = await SurveyService.reorder_survey_questions(survey_id, order_update.question_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    conversation_context_cache.invalidate_survey(survey_id)
+    return questions
 
 
 @router.patch("/{survey_id}/questions/{question_id}", response_model=SurveyQuestion)
@@ -104,6 +203,7 @@ async def update_question(
     question = await SurveyService.update_question(question_id, question_update.dict(exclude_unset=True))
     if not question:
         raise HTTPException(status_code=404, detail="问题不存在")
+    conversation_context_cache.invalidate_survey(survey_id)
     return question
 
 
@@ -116,6 +216,7 @@ async def delete_question(
     success = await SurveyService.delete_question(question_id)
     if not success:
         raise HTTPException(status_code=404, detail="问题不存在")
+    conversation_context_cache.invalidate_survey(survey_id)
     return None
 
 
@@ -125,30 +226,21 @@ async def get_survey_demo(survey_id: int = Path(..., ge=1, description="问卷ID
     """
     演示接口: 获取问卷详细信息，包括问卷基本信息、问题列表以及回答概况
     """
-    # 获取问卷及问题
-    survey = await SurveyService.get_survey_with_questions(survey_id)
+    # 问卷及问题、回答统计（数据库聚合）互不依赖，并发读取
+    survey, stats = await gather_with_timeouts(
+        SurveyService.get_survey_with_questions(survey_id),
+        SurveyResponseService.get_survey_stats(survey_id)
+    )
     if not survey:
         raise HTTPException(status_code=404, detail="问卷不存在")
     
-    # 获取该问卷的回答数量统计
-    responses = await SurveyResponseService.get_responses_by_survey(survey_id)
-    
-    # 统计回答状态
-    status_counts = {}
-    for resp in responses:
-        status = resp.status or "unknown"
-        if status in status_counts:
-            status_counts[status] += 1
-        else:
-            status_counts[status] = 1
-    
     # 构建返回结果
     result = {
-        "survey": survey.dict(),
+        "survey": survey,
         "response_stats": {
-            "total_responses": len(responses),
-            "status_counts": status_counts
+            "total_responses": stats.total_responses,
+            "status_counts": stats.status_counts
         }
     }
     
-    return result 
\ No newline at end of file
+    return ORJSONResponse(result) 
\ No newline at end of file
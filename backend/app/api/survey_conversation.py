@@ -3,14 +3,18 @@
 提供问卷对话相关的HTTP接口，支持SSE流式响应
 """
 
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+from typing import Any, AsyncIterator, Callable, Dict, Optional
 from fastapi import APIRouter, HTTPException, Body, Request
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 
+from ..services.llm_service import LLMOverloadedError, LLMPermit, llm_scheduler
 from ..services.survey_conversation_service import SurveyConversationService
-from ..database.dao import SurveyResponseDAO
+from ..services.turn_lease import turn_lease
+from ..metrics import SSE_RESUMES
+from .sse import generation_registry, parse_last_event_id, stream_events
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -39,54 +43,40 @@ async def chat_with_llm(request: Request, conv_request: ConversationRequest = Bo
       - response_id: 问卷回答的ID
       - message: 用户消息（首次对话可为空）
     
+    请求头:
+      - Last-Event-ID: 断线重连时携带收到的最后一个事件ID，从缓冲区续传而不重新生成
+    
     返回:
       - 流式SSE响应，包含LLM生成的文本片段
     """
     logger.info(f"接收对话请求: response_id={conv_request.response_id}, 消息长度={len(conv_request.message) if conv_request.message else 0}")
     
-    # 验证response_id
-    response = await SurveyResponseDAO.get_by_id(conv_request.response_id)
-    if not response:
+    # 断线重连：从缓冲区续传，不重新调用模型
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        return resume_stream(request, conv_request.response_id, last_event_id, endpoint="chat")
+    
+    # 验证response_id，同时加载并缓存对话上下文
+    context = await survey_conversation_service.get_conversation_context(conv_request.response_id)
+    if not context:
         logger.error(f"无效的回答ID: {conv_request.response_id}")
         raise HTTPException(status_code=404, detail="无效的回答ID")
     
-    logger.info(f"找到有效的回答记录，survey_id={response.survey_id}")
+    logger.info(f"找到有效的回答记录，survey_id={context.survey_id}")
     
-    # 创建客户端断开连接检测函数
-    disconnect = request.is_disconnected
     client_ip = request.client.host if request.client else "unknown"
     logger.info(f"创建SSE连接，客户端IP: {client_ip}")
     
-    # 创建SSE流式响应
-    async def event_generator():
-        chunk_count = 0
-        try:
-            # 使用安全的生成器包装器
-            async for text_chunk in safe_generator(
-                survey_conversation_service.process_conversation(
-                    conv_request.response_id, conv_request.message
-                )
-            ):
-                chunk_count += 1
-                if chunk_count % 20 == 0:  # 每20个片段记录一次日志
-                    logger.debug(f"已发送{chunk_count}个文本片段")
-                    
-                if await disconnect():
-                    logger.warning(f"客户端断开连接，IP: {client_ip}")
-                    break
-                yield {
-                    "data": text_chunk
-                }
-            
-            logger.info(f"流式响应完成，共发送{chunk_count}个文本片段")
-            # 发送完成标记
-            yield {"data": "[DONE]"}
-            
-        except Exception as e:
-            logger.error(f"流式响应出错: {str(e)}")
-            yield {"data": f"服务器错误: {str(e)}"}
-    
-    return EventSourceResponse(event_generator())
+    # 在后台生成并以SSE返回，LLM繁忙时在开始流之前拒绝
+    return await start_turn(
+        request,
+        conv_request.response_id,
+        make_turn_key("chat", conv_request.message or ""),
+        lambda permit: survey_conversation_service.process_conversation(
+            conv_request.response_id, conv_request.message, permit
+        ),
+        endpoint="chat"
+    )
 
 
 @router.post("/first_chat", status_code=200)
@@ -98,62 +88,147 @@ async def first_chat_with_llm(request: Request, conv_request: FirstConversationR
       - response_id: 问卷回答的ID
       - initial_message: 初始用户消息，默认为"开始问卷"
     
+    请求头:
+      - Last-Event-ID: 断线重连时携带收到的最后一个事件ID，从缓冲区续传而不重新生成
+    
     返回:
       - 流式SSE响应，包含LLM生成的文本片段
     """
     logger.info(f"接收首次对话请求: response_id={conv_request.response_id}")
     
-    # 验证response_id
-    response = await SurveyResponseDAO.get_by_id(conv_request.response_id)
-    if not response:
+    # 断线重连：从缓冲区续传，不重新调用模型
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        return resume_stream(request, conv_request.response_id, last_event_id, endpoint="first_chat")
+    
+    # 验证response_id，同时加载并缓存对话上下文
+    context = await survey_conversation_service.get_conversation_context(conv_request.response_id)
+    if not context:
         logger.error(f"无效的回答ID: {conv_request.response_id}")
         raise HTTPException(status_code=404, detail="无效的回答ID")
     
-    logger.info(f"找到有效的回答记录，survey_id={response.survey_id}")
+    logger.info(f"找到有效的回答记录，survey_id={context.survey_id}")
     
-    # 创建客户端断开连接检测函数
-    disconnect = request.is_disconnected
     client_ip = request.client.host if request.client else "unknown"
     logger.info(f"创建SSE连接，客户端IP: {client_ip}")
     
-    # 创建SSE流式响应
-    async def event_generator():
-        chunk_count = 0
+    # 在后台生成并以SSE返回，LLM繁忙时在开始流之前拒绝
+    return await start_turn(
+        request,
+        conv_request.response_id,
+        make_turn_key("first_chat", ""),
+        lambda permit: survey_conversation_service.process_first_conversation(
+            conv_request.response_id, permit
+        ),
+        endpoint="first_chat"
+    )
+
+
+async def start_turn(
+    request: Request,
+    response_id: int,
+    turn_key: str,
+    make_stream: Callable[[Optional[LLMPermit]], AsyncIterator[str]],
+    endpoint: str
+) -> EventSourceResponse:
+    """
+    开始一轮对话并返回SSE响应
+    
+    在后台生成，SSE连接只是订阅者，断线后可凭Last-Event-ID续传；同一回答相同的并发请求共用一次生成，
+    不同的轮次依次进行。回答空闲时新的生成会立即开始，在开始SSE响应之前向调度器获取LLM调用许可，
+    繁忙时直接返回429/503；需要排队等待上一轮（或其他worker上的租约）时，排队期间不占用许可，
+    轮到本轮后再获取，此时的繁忙错误作为SSE错误事件发送。
+    
+    Args:
+        request: 请求对象
+        response_id: 回答ID
+        turn_key: 轮次标识
+        make_stream: 接收LLM调用许可、返回本轮文本片段的函数，许可为None时轮到本轮后自行获取
+        endpoint: 接口名称
+        
+    Returns:
+        SSE流式响应
+        
+    Raises:
+        HTTPException: LLM调度队列已满(429)或排队超时(503)
+    """
+    generation = generation_registry.join(response_id, turn_key, endpoint)
+    if generation is None:
+        model_id = survey_conversation_service.llm_model_id
+        permit: Optional[LLMPermit] = None
         try:
-            # 使用安全的生成器包装器
-            async for text_chunk in safe_generator(
-                survey_conversation_service.process_first_conversation(
-                    conv_request.response_id
-                )
-            ):
-                chunk_count += 1
-                if chunk_count % 20 == 0:  # 每20个片段记录一次日志
-                    logger.debug(f"已发送{chunk_count}个文本片段")
-                    
-                if await disconnect():
-                    logger.warning(f"客户端断开连接，IP: {client_ip}")
-                    break
-                yield {
-                    "data": text_chunk
-                }
-            
-            logger.info(f"流式响应完成，共发送{chunk_count}个文本片段")
-            # 发送完成标记
-            yield {"data": "[DONE]"}
-            
-        except Exception as e:
-            logger.error(f"流式响应出错: {str(e)}")
-            yield {"data": f"服务器错误: {str(e)}"}
-    
-    return EventSourceResponse(event_generator())
-
-
-async def safe_generator(generator):
-    """安全地包装生成器，处理异常并继续生成"""
+            if generation_registry.is_idle(response_id) and not turn_lease.enabled:
+                permit = await llm_scheduler.acquire(model_id)
+                if not generation_registry.is_idle(response_id):
+                    # 等待许可期间本回答开始了另一轮，本轮需要排队：先归还，轮到本轮后再获取
+                    permit.release()
+                    permit = None
+            else:
+                llm_scheduler.check_queue(model_id)
+        except LLMOverloadedError as e:
+            raise HTTPException(
+                status_code=e.status_code,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        
+        generation, joined = generation_registry.start(
+            response_id,
+            turn_key,
+            lambda: turn_lease.run_exclusive(response_id, turn_key, make_stream(permit)),
+            endpoint=endpoint
+        )
+        if permit is not None:
+            if joined:
+                permit.release()
+            else:
+                # 模型调用结束时许可已归还；生成在调用模型之前结束（被取消等）时在此归还
+                generation.add_done_callback(permit.release)
+    
+    return EventSourceResponse(stream_events(request, generation, endpoint=endpoint))
+
+
+def make_turn_key(endpoint: str, message: str) -> str:
+    """
+    生成轮次标识，同一接口、同一消息的请求视为同一轮
+    
+    Args:
+        endpoint: 接口名称
+        message: 用户消息
+        
+    Returns:
+        轮次标识（摘要，不含消息原文）
+    """
+    return hashlib.sha256(f"{endpoint}\n{message}".encode("utf-8")).hexdigest()[:32]
+
+
+def resume_stream(request: Request, response_id: int, last_event_id: str, endpoint: str) -> EventSourceResponse:
+    """
+    从生成缓冲区续传断线前未收到的事件
+    
+    Args:
+        request: 请求对象
+        response_id: 回答ID
+        last_event_id: 客户端收到的最后一个事件ID
+        endpoint: 指标中的接口名称
+        
+    Returns:
+        SSE流式响应
+        
+    Raises:
+        HTTPException: 事件ID无效，或生成已过期、不在本进程中
+    """
     try:
-        async for item in generator:
-            yield item
-    except Exception as e:
-        logger.error(f"生成器发生错误: {str(e)}")
-        yield f"[错误] {str(e)}"
-        # 不传递异常，允许流继续 
\ No newline at end of file
+        generation_id, seq = parse_last_event_id(last_event_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的Last-Event-ID")
+    
+    generation = generation_registry.get(generation_id)
+    if generation is None or generation.response_id != response_id or not generation.can_resume_from(seq):
+        SSE_RESUMES.inc(endpoint=endpoint, outcome="expired")
+        logger.warning(f"无法续传: response_id={response_id}, Last-Event-ID={last_event_id}")
+        raise HTTPException(status_code=410, detail="生成已结束或已过期，请重新加载对话记录")
+    
+    SSE_RESUMES.inc(endpoint=endpoint, outcome="resumed")
+    logger.info(f"断线续传: response_id={response_id}, generation={generation_id}, 从第{seq + 1}个事件开始")
+    return EventSourceResponse(stream_events(request, generation, endpoint=endpoint, after_seq=seq))
@@ -1,11 +1,21 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, HTTPException, Query, Path
 
-from ..database import query_table, get_by_id, get_related_data
+from ..database import query_table, query_table_page, get_by_id, InvalidCursorError
+from ..database.embedding import parse_include, to_many_relations
 from ..database.schemas import TableQueryResponse
+from .responses import ORJSONResponse
 
 router = APIRouter()
 
+
+def _parse_include(table: str, include: Optional[str]) -> List[str]:
+    """解析include参数，不支持的关联返回400"""
+    try:
+        return parse_include(table, include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 VALID_TABLES = ["cu_survey", "cu_survey_questions", "cu_survey_responses", "cu_survey_response_conversations"]
 
 
@@ -22,23 +32,42 @@ async def get_table_data(
     table: str = Path(..., title="表名"),
     select: str = Query("*", title="要选择的字段，用逗号分隔"),
     limit: int = Query(100, ge=1, le=1000, title="返回记录数量限制"),
-    offset: int = Query(0, ge=0, title="跳过的记录数量")
+    offset: int = Query(0, ge=0, title="跳过的记录数量"),
+    cursor: Optional[str] = Query(None, title="分页游标，取上一页返回的next_cursor"),
+    keyset: bool = Query(False, title="第一页即使用游标分页"),
+    order_by: str = Query("id", regex="^(id|created_at)$", title="游标分页的排序键"),
+    desc: bool = Query(False, title="游标分页是否降序"),
+    include: Optional[str] = Query(None, title="要嵌入的关联数据，逗号分隔，如 questions,responses")
 ) -> TableQueryResponse:
     """
     获取指定表的数据
+    
+    默认使用偏移分页；传入cursor或keyset=true时使用游标分页，按order_by稳定排序并返回next_cursor。
+    include中的关联数据嵌套在每条记录中一并返回
     """
     if table not in VALID_TABLES:
         raise HTTPException(status_code=404, detail=f"表 '{table}' 不存在")
+    embeds = _parse_include(table, include)
+    
+    if cursor or keyset:
+        try:
+            data, next_cursor = await query_table_page(
+                table, select, limit=limit, cursor=cursor, order_by=order_by, desc=desc, include=embeds
+            )
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return ORJSONResponse({"data": data, "count": len(data), "next_cursor": next_cursor})
     
-    data = await query_table(table, select, limit=limit, offset=offset)
-    return TableQueryResponse(data=data, count=len(data))
+    data = await query_table(table, select, limit=limit, offset=offset, include=embeds)
+    return ORJSONResponse({"data": data, "count": len(data)})
 
 
 @router.get("/{table}/{id}", response_model=Dict[str, Any])
 async def get_record_by_id(
     table: str = Path(..., title="表名"),
     id: int = Path(..., title="记录ID"),
-    select: str = Query("*", title="要选择的字段，用逗号分隔")
+    select: str = Query("*", title="要选择的字段，用逗号分隔"),
+    include: Optional[str] = Query(None, title="要嵌入的关联数据，逗号分隔")
 ) -> Dict[str, Any]:
     """
     通过ID获取表中的特定记录
@@ -46,7 +75,7 @@ async def get_record_by_id(
     if table not in VALID_TABLES:
         raise HTTPException(status_code=404, detail=f"表 '{table}' 不存在")
     
-    record = await get_by_id(table, id, select)
+    record = await get_by_id(table, id, select, _parse_include(table, include))
     if not record:
         raise HTTPException(status_code=404, detail=f"ID为 {id} 的记录不存在")
     
@@ -64,25 +93,11 @@ async def get_record_with_related_data(
     if table not in VALID_TABLES:
         raise HTTPException(status_code=404, detail=f"表 '{table}' 不存在")
     
-    record = await get_by_id(table, id)
+    # 所有一对多关联通过嵌入查询与记录一次取回
+    relations = to_many_relations(table)
+    record = await get_by_id(table, id, include=relations)
     if not record:
         raise HTTPException(status_code=404, detail=f"ID为 {id} 的记录不存在")
     
-    result = {"main_record": record, "related_records": {}}
-    
-    # 根据表名确定关联
-    if table == "cu_survey":
-        # 问卷关联的问题
-        questions = await get_related_data("cu_survey_questions", "survey_id", id)
-        result["related_records"]["questions"] = questions
-        
-        # 问卷关联的回复
-        responses = await get_related_data("cu_survey_responses", "survey_id", id)
-        result["related_records"]["responses"] = responses
-        
-    elif table == "cu_survey_responses":
-        # 回复关联的对话
-        conversations = await get_related_data("cu_survey_response_conversations", "survey_response_id", id)
-        result["related_records"]["conversations"] = conversations
-    
-    return result 
\ No newline at end of file
+    related_records = {name: record.pop(name, None) or [] for name in relations}
+    return ORJSONResponse({"main_record": record, "related_records": related_records})
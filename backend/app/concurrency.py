@@ -0,0 +1,98 @@
+"""
+并发编排工具
+把互不依赖的异步调用并发执行，总耗时取决于最慢的一个而不是所有调用之和；
+每个调用可以单独设置超时，任一调用失败时取消其余调用
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, List, Optional, Sequence
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+async def gather_with_timeouts(
+    *aws: Awaitable[Any],
+    timeout: Optional[float] = None,
+    timeouts: Optional[Sequence[Optional[float]]] = None,
+    return_exceptions: bool = False,
+    limit: Optional[int] = None
+) -> List[Any]:
+    """
+    并发执行多个可等待对象，按传入顺序返回结果
+
+    与asyncio.gather不同，某个调用失败或超时时会立即取消其余仍在执行的调用并等待它们结束，
+    不会在后台留下继续访问数据库的任务；调用方被取消时同样取消全部调用。
+
+    Args:
+        *aws: 协程或其他可等待对象
+        timeout: 每个调用的默认超时(秒)，None表示不限
+        timeouts: 按位置覆盖每个调用的超时，元素为None时使用timeout
+        return_exceptions: 为True时异常作为结果返回，不取消其他调用
+        limit: 同时执行的调用数上限，None表示不限；超时从调用真正开始执行时计算
+
+    Returns:
+        结果列表
+
+    Raises:
+        asyncio.TimeoutError: 某个调用超时（return_exceptions为False时）
+        Exception: 失败调用的异常，同时有多个调用失败时取传入位置最靠前的一个（return_exceptions为False时）
+    """
+    if timeouts is not None and len(timeouts) != len(aws):
+        raise ValueError("timeouts的长度必须与调用数量一致")
+    if not aws:
+        return []
+
+    semaphore = asyncio.Semaphore(limit) if limit is not None else None
+    tasks = []
+    for i, aw in enumerate(aws):
+        seconds = timeouts[i] if timeouts is not None and timeouts[i] is not None else timeout
+        if semaphore is not None:
+            tasks.append(asyncio.ensure_future(_run_limited(semaphore, aw, seconds)))
+        else:
+            tasks.append(asyncio.ensure_future(asyncio.wait_for(aw, seconds) if seconds is not None else aw))
+
+    if return_exceptions:
+        try:
+            return list(await asyncio.gather(*tasks, return_exceptions=True))
+        except asyncio.CancelledError:
+            await _cancel_all(tasks)
+            raise
+
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except asyncio.CancelledError:
+        await _cancel_all(tasks)
+        raise
+
+    for index, task in enumerate(tasks):
+        if task in done and not task.cancelled() and task.exception() is not None:
+            if pending:
+                logger.debug(f"第{index + 1}个并发调用失败，取消其余{len(pending)}个调用")
+            await _cancel_all(pending)
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+async def _run_limited(semaphore: asyncio.Semaphore, aw: Awaitable[Any], seconds: Optional[float]) -> Any:
+    """获得信号量后再执行调用"""
+    try:
+        await semaphore.acquire()
+    except asyncio.CancelledError:
+        # 排队时被取消，调用从未开始，关闭协程避免"never awaited"警告
+        if asyncio.iscoroutine(aw):
+            aw.close()
+        raise
+    try:
+        return await (asyncio.wait_for(aw, seconds) if seconds is not None else aw)
+    finally:
+        semaphore.release()
+
+
+async def _cancel_all(tasks) -> None:
+    """取消任务并等待它们结束"""
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -4,7 +4,7 @@
 """
 
 # 配置
-from .config import get_supabase
+from .config import get_supabase, set_supabase, close_supabase
 
 # DAO类
 from .dao import (
@@ -15,15 +15,19 @@ from .dao import (
 )
 
 # 工具函数
-from .dao.utils import format_timestamp
+from .dao.utils import format_timestamp, format_timestamps, TimestampFormatError
 from .utils import (
     test_supabase_connection, 
     get_database_tables_info,
     query_table,
+    query_table_page,
     get_by_id,
     get_related_data
 )
 
+# 游标分页
+from .pagination import InvalidCursorError
+
 # 模型
 from .schemas import (
     # 基础模型
@@ -55,6 +59,8 @@ from .schemas import (
 __all__ = [
     # 配置
     'get_supabase',
+    'set_supabase',
+    'close_supabase',
     
     # DAO类
     'SurveyDAO',
@@ -64,11 +70,15 @@ __all__ = [
     
     # 工具函数
     'format_timestamp',
+    'format_timestamps',
+    'TimestampFormatError',
     'test_supabase_connection',
     'get_database_tables_info',
     'query_table',
+    'query_table_page',
     'get_by_id',
     'get_related_data',
+    'InvalidCursorError',
     
     # 模型 - 所有模型都通过schemas模块导出
     # 基础模型
@@ -0,0 +1,316 @@
+"""
+异步PostgREST客户端
+基于共享的httpx.AsyncClient连接池访问Supabase REST接口，
+查询构造方式与supabase-py保持一致，但所有请求都不会阻塞事件循环
+"""
+
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class APIError(Exception):
+    """PostgREST返回的错误"""
+
+    def __init__(self, error: Dict[str, Any], status_code: Optional[int] = None):
+        self.message = error.get("message")
+        self.code = error.get("code")
+        self.details = error.get("details")
+        self.hint = error.get("hint")
+        self.status_code = status_code
+        super().__init__(self.message or str(error))
+
+
+class APIResponse:
+    """PostgREST响应"""
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _format_value(value: Any) -> str:
+    """将过滤值转换为PostgREST查询参数格式"""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _parse_count(content_range: Optional[str]) -> Optional[int]:
+    """从Content-Range头中解析总数，格式如 0-9/100"""
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.split("/")[-1]
+    return int(total) if total.isdigit() else None
+
+
+class AsyncQueryBuilder:
+    """异步查询构造器，链式调用后通过 await execute() 发送请求"""
+
+    def __init__(self, http: httpx.AsyncClient, path: str):
+        self._http = http
+        self._path = path
+        self._method = "GET"
+        self._params: List[Tuple[str, str]] = []
+        self._headers: Dict[str, str] = {}
+        self._prefer: List[str] = []
+        self._json: Any = None
+
+    # 操作
+
+    def select(self, columns: str = "*", count: Optional[str] = None, head: bool = False) -> "AsyncQueryBuilder":
+        """
+        查询字段
+
+        Args:
+            columns: 要选择的字段，支持PostgREST嵌入语法
+            count: 计数方式，如 "exact"、"planned"、"estimated"
+            head: 为True时发送HEAD请求，只返回计数不返回记录
+        """
+        self._params.append(("select", columns))
+        if count:
+            self._prefer.append(f"count={count}")
+        if head:
+            self._method = "HEAD"
+        return self
+
+    def insert(
+        self,
+        data: Union[Dict[str, Any], List[Dict[str, Any]]],
+        upsert: bool = False,
+        on_conflict: Optional[str] = None,
+        ignore_duplicates: bool = False
+    ) -> "AsyncQueryBuilder":
+        """插入一条或多条记录，返回插入后的记录；ignore_duplicates时跳过冲突的行，只返回新插入的行"""
+        self._method = "POST"
+        self._json = data
+        self._prefer.append("return=representation")
+        if ignore_duplicates:
+            self._prefer.append("resolution=ignore-duplicates")
+        elif upsert:
+            self._prefer.append("resolution=merge-duplicates")
+        if on_conflict:
+            self._params.append(("on_conflict", on_conflict))
+        if isinstance(data, list) and data:
+            # 批量插入时显式声明列，避免各行字段不一致
+            columns = sorted({key for row in data for key in row})
+            self._params.append(("columns", ",".join(columns)))
+        return self
+
+    def upsert(
+        self,
+        data: Union[Dict[str, Any], List[Dict[str, Any]]],
+        on_conflict: Optional[str] = None,
+        ignore_duplicates: bool = False
+    ) -> "AsyncQueryBuilder":
+        """插入或更新记录，ignore_duplicates为True时冲突的行保持不变"""
+        return self.insert(data, upsert=True, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+    def update(self, data: Dict[str, Any]) -> "AsyncQueryBuilder":
+        """更新记录，返回更新后的记录"""
+        self._method = "PATCH"
+        self._json = data
+        self._prefer.append("return=representation")
+        return self
+
+    def delete(self) -> "AsyncQueryBuilder":
+        """删除记录，返回被删除的记录"""
+        self._method = "DELETE"
+        self._prefer.append("return=representation")
+        return self
+
+    # 过滤条件
+
+    def filter(self, column: str, operator: str, value: Any) -> "AsyncQueryBuilder":
+        """通用过滤条件"""
+        self._params.append((column, f"{operator}.{_format_value(value)}"))
+        return self
+
+    def eq(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        return self.filter(column, "eq", value)
+
+    def neq(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        return self.filter(column, "neq", value)
+
+    def gt(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        return self.filter(column, "gt", value)
+
+    def gte(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        return self.filter(column, "gte", value)
+
+    def lt(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        return self.filter(column, "lt", value)
+
+    def lte(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        return self.filter(column, "lte", value)
+
+    def is_(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        return self.filter(column, "is", value)
+
+    def in_(self, column: str, values: List[Any]) -> "AsyncQueryBuilder":
+        joined = ",".join(_format_value(v) for v in values)
+        self._params.append((column, f"in.({joined})"))
+        return self
+
+    def or_(self, filters: str, foreign_table: Optional[str] = None) -> "AsyncQueryBuilder":
+        """OR条件，filters使用PostgREST语法，如 "status.eq.a,status.eq.b" """
+        key = f"{foreign_table}.or" if foreign_table else "or"
+        self._params.append((key, f"({filters})"))
+        return self
+
+    # 排序与分页
+
+    def order(
+        self,
+        column: str,
+        desc: bool = False,
+        nullsfirst: Optional[bool] = None,
+        foreign_table: Optional[str] = None
+    ) -> "AsyncQueryBuilder":
+        """排序，多次调用会按调用顺序组合排序字段"""
+        value = f"{column}.{'desc' if desc else 'asc'}"
+        if nullsfirst is not None:
+            value += ".nullsfirst" if nullsfirst else ".nullslast"
+        key = f"{foreign_table}.order" if foreign_table else "order"
+        for i, (k, v) in enumerate(self._params):
+            if k == key:
+                self._params[i] = (k, f"{v},{value}")
+                return self
+        self._params.append((key, value))
+        return self
+
+    def limit(self, size: int, foreign_table: Optional[str] = None) -> "AsyncQueryBuilder":
+        key = f"{foreign_table}.limit" if foreign_table else "limit"
+        self._params.append((key, str(size)))
+        return self
+
+    def offset(self, size: int, foreign_table: Optional[str] = None) -> "AsyncQueryBuilder":
+        key = f"{foreign_table}.offset" if foreign_table else "offset"
+        self._params.append((key, str(size)))
+        return self
+
+    def range(self, start: int, end: int) -> "AsyncQueryBuilder":
+        """按闭区间[start, end]分页"""
+        return self.offset(start).limit(end - start + 1)
+
+    # 执行
+
+    async def execute(self) -> APIResponse:
+        """
+        发送请求
+
+        Returns:
+            APIResponse，data为返回的记录列表，count为请求计数时的总数
+
+        Raises:
+            APIError: PostgREST返回错误时
+        """
+        headers = dict(self._headers)
+        if self._prefer:
+            headers["Prefer"] = ",".join(self._prefer)
+
+        response = await self._http.request(
+            self._method,
+            self._path,
+            params=self._params,
+            headers=headers,
+            content=json.dumps(self._json, default=str) if self._json is not None else None
+        )
+
+        if response.status_code >= 400:
+            try:
+                error = response.json()
+            except ValueError:
+                error = {"message": response.text}
+            if not isinstance(error, dict):
+                error = {"message": str(error)}
+            raise APIError(error, response.status_code)
+
+        data = response.json() if response.content else []
+        return APIResponse(data=data, count=_parse_count(response.headers.get("content-range")))
+
+
+class AsyncSupabaseClient:
+    """
+    异步Supabase REST客户端
+    所有DAO共享一个实例，从而共享同一个keep-alive连接池
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        http2: bool = True,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        """
+        初始化客户端
+
+        Args:
+            url: Supabase项目URL，或PostgREST服务根地址
+            key: Supabase API Key
+            max_connections: 连接池最大连接数
+            max_keepalive_connections: 保持空闲的最大连接数
+            keepalive_expiry: 空闲连接保持时间(秒)
+            timeout: 读写及等待连接池的超时时间(秒)
+            connect_timeout: 建立连接的超时时间(秒)
+            http2: 是否启用HTTP/2
+            transport: 自定义传输层，用于测试时接入本地PostgREST替身
+        """
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装h2，HTTP/2不可用，回退到HTTP/1.1")
+                http2 = False
+
+        base_url = url.rstrip("/")
+        if not base_url.endswith("/rest/v1"):
+            base_url = f"{base_url}/rest/v1"
+
+        self.rest_url = base_url
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            http2=http2,
+            transport=transport
+        )
+
+    def table(self, table_name: str) -> AsyncQueryBuilder:
+        """对指定表构造查询"""
+        return AsyncQueryBuilder(self.http, f"/{table_name}")
+
+    from_ = table
+
+    def rpc(self, function_name: str, params: Optional[Dict[str, Any]] = None) -> AsyncQueryBuilder:
+        """调用数据库函数"""
+        builder = AsyncQueryBuilder(self.http, f"/rpc/{function_name}")
+        builder._method = "POST"
+        builder._json = params or {}
+        return builder
+
+    async def aclose(self) -> None:
+        """关闭连接池"""
+        await self.http.aclose()
@@ -1,6 +1,8 @@
 import os
+from typing import Optional
 from dotenv import load_dotenv
-from supabase import create_client, Client
+
+from .async_client import AsyncSupabaseClient
 
 # 加载环境变量
 load_dotenv()
@@ -9,19 +11,55 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-# 创建Supabase客户端
-supabase: Client = None
-if SUPABASE_URL and SUPABASE_KEY:
+# 连接池配置
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "100"))
+SUPABASE_POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "true").lower() == "true"
+
+# 异步Supabase客户端，所有DAO共享同一个连接池；首次使用时创建，也可通过set_supabase替换
+supabase: Optional[AsyncSupabaseClient] = None
+
+
+def _create_supabase() -> Optional[AsyncSupabaseClient]:
+    """按环境变量创建Supabase客户端"""
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        print("警告：未配置Supabase URL或API Key")
+        return None
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        client = AsyncSupabaseClient(
+            SUPABASE_URL,
+            SUPABASE_KEY,
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_POOL_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+            timeout=SUPABASE_TIMEOUT,
+            connect_timeout=SUPABASE_CONNECT_TIMEOUT,
+            http2=SUPABASE_HTTP2
+        )
         print("Supabase客户端连接成功")
+        return client
     except Exception as e:
         print(f"Supabase客户端连接失败: {str(e)}")
-else:
-    print("警告：未配置Supabase URL或API Key")
+        return None
 
 # 获取Supabase客户端实例
-def get_supabase() -> Client:
+def get_supabase() -> AsyncSupabaseClient:
+    global supabase
+    if supabase is None:
+        supabase = _create_supabase()
     if supabase is None:
         raise Exception("Supabase客户端未初始化")
-    return supabase
\ No newline at end of file
+    return supabase
+
+# 替换Supabase客户端实例，用于基准测试等需要指向其他PostgREST服务的场景
+def set_supabase(client: Optional[AsyncSupabaseClient]) -> None:
+    global supabase
+    supabase = client
+
+# 关闭Supabase连接池
+async def close_supabase() -> None:
+    if supabase is not None:
+        await supabase.aclose()
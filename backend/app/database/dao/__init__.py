@@ -4,7 +4,7 @@
 """
 
 # 辅助函数
-from .utils import format_timestamp
+from .utils import format_timestamp, format_timestamps, project_rows
 
 # 问卷DAO
 from .survey_dao import SurveyDAO
@@ -21,6 +21,8 @@ from .survey_response_conversation_dao import SurveyResponseConversationDAO
 __all__ = [
     # 辅助函数
     'format_timestamp',
+    'format_timestamps',
+    'project_rows',
     
     # DAO类
     'SurveyDAO',
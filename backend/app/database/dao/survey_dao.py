@@ -2,14 +2,16 @@
 问卷数据访问对象
 """
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 from datetime import datetime
 
 from ..config import get_supabase
+from ..pagination import KEYSET_CREATED_AT, fetch_page
 from ..schemas import Survey, SurveyCreate, SurveyUpdate, SurveyWithQuestions, SurveyQuestion
-from .utils import format_timestamp
+from .utils import format_timestamp, format_timestamps, instrument_dao, project_rows
 
 
+@instrument_dao
 class SurveyDAO:
     """问卷数据访问对象"""
     
@@ -29,7 +31,7 @@ class SurveyDAO:
         data['created_at'] = datetime.now().isoformat()
         data['updated_at'] = data['created_at']
         
-        response = client.table('cu_survey').insert(data).execute()
+        response = await client.table('cu_survey').insert(data).execute()
         result = response.data[0]
         
         return Survey(**format_timestamp(result))
@@ -46,7 +48,7 @@ class SurveyDAO:
             问卷模型，如果不存在则返回None
         """
         client = get_supabase()
-        response = client.table('cu_survey').select('*').eq('id', survey_id).execute()
+        response = await client.table('cu_survey').select('*').eq('id', survey_id).execute()
         
         if not response.data:
             return None
@@ -58,8 +60,9 @@ class SurveyDAO:
         limit: int = 100,
         offset: int = 0,
         status: Optional[str] = None,
-        user_id: Optional[str] = None
-    ) -> List[Survey]:
+        user_id: Optional[str] = None,
+        raw: bool = False
+    ) -> Union[List[Survey], List[Dict[str, Any]]]:
         """
         获取所有问卷，可按状态和用户ID筛选
         
@@ -68,6 +71,7 @@ class SurveyDAO:
             offset: 分页偏移量
             status: 问卷状态过滤
             user_id: 用户ID过滤
+            raw: 为True时返回按模型字段裁剪的字典，不构造Pydantic模型，供列表接口直接序列化
             
         Returns:
             问卷模型列表
@@ -80,8 +84,42 @@ class SurveyDAO:
         if user_id:
             query = query.eq('user_id', user_id)
             
-        response = query.execute()
-        return [Survey(**format_timestamp(item)) for item in response.data]
+        response = await query.execute()
+        rows = format_timestamps(response.data)
+        return project_rows(Survey, rows) if raw else [Survey(**item) for item in rows]
+    
+    @staticmethod
+    async def get_page(
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        user_id: Optional[str] = None,
+        raw: bool = False
+    ) -> Tuple[Union[List[Survey], List[Dict[str, Any]]], Optional[str]]:
+        """
+        按(created_at, id)倒序游标分页获取问卷，可按状态和用户ID筛选
+        
+        Args:
+            limit: 每页数量
+            cursor: 上一页返回的游标，None表示第一页
+            status: 问卷状态过滤
+            user_id: 用户ID过滤
+            raw: 为True时返回按模型字段裁剪的字典，不构造Pydantic模型，供列表接口直接序列化
+            
+        Returns:
+            (问卷模型列表, 下一页游标)，没有下一页时游标为None
+        """
+        client = get_supabase()
+        query = client.table('cu_survey').select('*')
+        
+        if status:
+            query = query.eq('status', status)
+        if user_id:
+            query = query.eq('user_id', user_id)
+        
+        rows, next_cursor = await fetch_page(query, KEYSET_CREATED_AT, cursor, limit)
+        rows = format_timestamps(rows)
+        return (project_rows(Survey, rows) if raw else [Survey(**item) for item in rows]), next_cursor
     
     @staticmethod
     async def update(survey_id: int, survey_update: SurveyUpdate) -> Optional[Survey]:
@@ -99,7 +137,7 @@ class SurveyDAO:
         data = {k: v for k, v in survey_update.dict().items() if v is not None}
         data['updated_at'] = datetime.now().isoformat()
         
-        response = client.table('cu_survey').update(data).eq('id', survey_id).execute()
+        response = await client.table('cu_survey').update(data).eq('id', survey_id).execute()
         
         if not response.data:
             return None
@@ -118,7 +156,7 @@ class SurveyDAO:
             是否删除成功
         """
         client = get_supabase()
-        response = client.table('cu_survey').delete().eq('id', survey_id).execute()
+        response = await client.table('cu_survey').delete().eq('id', survey_id).execute()
         return len(response.data) > 0
     
     @staticmethod
@@ -134,18 +172,18 @@ class SurveyDAO:
         """
         client = get_supabase()
         
-        # 获取问卷
-        survey_response = client.table('cu_survey').select('*').eq('id', survey_id).execute()
-        if not survey_response.data:
+        # 通过嵌入查询一次取回问卷和问题
+        response = await client.table('cu_survey')\
+            .select('*,questions:cu_survey_questions(*)')\
+            .eq('id', survey_id)\
+            .order('question_order', foreign_table='questions')\
+            .execute()
+        if not response.data:
             return None
         
-        survey_data = format_timestamp(survey_response.data[0])
-        
-        # 获取问卷问题
-        questions_response = client.table('cu_survey_questions')\
-            .select('*').eq('survey_id', survey_id).order('question_order').execute()
-        
-        questions = [SurveyQuestion(**format_timestamp(q)) for q in questions_response.data]
+        survey_data = dict(response.data[0])
+        questions = [SurveyQuestion(**q) for q in format_timestamps(survey_data.pop('questions', None) or [])]
+        survey_data = format_timestamp(survey_data)
         
         # 创建包含问题的问卷
         return SurveyWithQuestions(**survey_data, questions=questions) 
\ No newline at end of file
@@ -2,14 +2,31 @@
 问卷问题数据访问对象
 """
 
+import logging
+import time
 from typing import List, Optional
 from datetime import datetime
 
+from ...concurrency import gather_with_timeouts
+from ..async_client import APIError
 from ..config import get_supabase
 from ..schemas import SurveyQuestion, SurveyQuestionCreate, SurveyQuestionUpdate
-from .utils import format_timestamp
+from .utils import format_timestamp, format_timestamps, instrument_dao
 
+logger = logging.getLogger(__name__)
 
+# PostgreSQL/PostgREST错误码
+INVALID_PARAMETER_VALUE = "22023"
+FUNCTION_NOT_FOUND = "PGRST202"
+
+# 发现reorder_survey_questions未部署后，间隔多久(秒)再次尝试调用，以便迁移执行后恢复使用
+REORDER_RPC_RETRY_INTERVAL = 300.0
+
+# 下次尝试调用reorder_survey_questions的时间(time.monotonic)，0表示总是调用
+_reorder_rpc_retry_at = 0.0
+
+
+@instrument_dao
 class SurveyQuestionDAO:
     """问卷问题数据访问对象"""
     
@@ -29,7 +46,7 @@ class SurveyQuestionDAO:
         data['created_at'] = datetime.now().isoformat()
         data['updated_at'] = data['created_at']
         
-        response = client.table('cu_survey_questions').insert(data).execute()
+        response = await client.table('cu_survey_questions').insert(data).execute()
         result = response.data[0]
         
         return SurveyQuestion(**format_timestamp(result))
@@ -46,7 +63,7 @@ class SurveyQuestionDAO:
             问卷问题模型，如果不存在则返回None
         """
         client = get_supabase()
-        response = client.table('cu_survey_questions').select('*').eq('id', question_id).execute()
+        response = await client.table('cu_survey_questions').select('*').eq('id', question_id).execute()
         
         if not response.data:
             return None
@@ -65,10 +82,10 @@ class SurveyQuestionDAO:
             问卷问题模型列表
         """
         client = get_supabase()
-        response = client.table('cu_survey_questions')\
+        response = await client.table('cu_survey_questions')\
             .select('*').eq('survey_id', survey_id).order('question_order').execute()
         
-        return [SurveyQuestion(**format_timestamp(q)) for q in response.data]
+        return [SurveyQuestion(**q) for q in format_timestamps(response.data)]
     
     @staticmethod
     async def update(question_id: int, question_update: SurveyQuestionUpdate) -> Optional[SurveyQuestion]:
@@ -86,7 +103,7 @@ class SurveyQuestionDAO:
         data = {k: v for k, v in question_update.dict().items() if v is not None}
         data['updated_at'] = datetime.now().isoformat()
         
-        response = client.table('cu_survey_questions').update(data).eq('id', question_id).execute()
+        response = await client.table('cu_survey_questions').update(data).eq('id', question_id).execute()
         
         if not response.data:
             return None
@@ -105,7 +122,7 @@ class SurveyQuestionDAO:
             是否删除成功
         """
         client = get_supabase()
-        response = client.table('cu_survey_questions').delete().eq('id', question_id).execute()
+        response = await client.table('cu_survey_questions').delete().eq('id', question_id).execute()
         return len(response.data) > 0
     
     @staticmethod
@@ -113,22 +130,55 @@ class SurveyQuestionDAO:
         """
         重新排序问卷问题
         
+        优先调用reorder_survey_questions数据库函数，所有问题的顺序在一个事务中原子更新；
+        函数未部署时回退为并发逐行更新question_order，只写排序相关的字段，不会覆盖
+        期间对问题内容的修改，但中途失败会留下部分生效的顺序，需要部署migrations/003
+        才能保证原子性。回退后每隔REORDER_RPC_RETRY_INTERVAL秒重新尝试调用数据库函数
+        
         Args:
             survey_id: 问卷ID
-            question_ids: 问题ID列表，按新顺序排列
+            question_ids: 问题ID列表，按新顺序排列，必须恰好包含问卷的全部问题
             
         Returns:
-            更新后的问卷问题模型列表
+            按新顺序排列的问卷问题模型列表
+            
+        Raises:
+            ValueError: 问题ID列表与问卷问题不一致
         """
+        global _reorder_rpc_retry_at
+        
         client = get_supabase()
-        updated_questions = []
+        if time.monotonic() >= _reorder_rpc_retry_at:
+            try:
+                response = await client.rpc('reorder_survey_questions', {
+                    'p_survey_id': survey_id,
+                    'p_question_ids': question_ids
+                }).execute()
+                _reorder_rpc_retry_at = 0.0
+                return [SurveyQuestion(**q) for q in format_timestamps(response.data)]
+            except APIError as e:
+                if e.code == INVALID_PARAMETER_VALUE:
+                    raise ValueError(e.message)
+                if e.code != FUNCTION_NOT_FOUND:
+                    raise
+                _reorder_rpc_retry_at = time.monotonic() + REORDER_RPC_RETRY_INTERVAL
+                logger.warning(
+                    f"数据库函数reorder_survey_questions不存在，{REORDER_RPC_RETRY_INTERVAL:.0f}秒内回退为逐行更新方式重排问题"
+                )
         
-        for idx, question_id in enumerate(question_ids, start=1):
-            data = {'question_order': idx, 'updated_at': datetime.now().isoformat()}
-            response = client.table('cu_survey_questions')\
-                .update(data).eq('id', question_id).eq('survey_id', survey_id).execute()
-            
-            if response.data:
-                updated_questions.append(SurveyQuestion(**format_timestamp(response.data[0])))
+        response = await client.table('cu_survey_questions')\
+            .select('id').eq('survey_id', survey_id).execute()
+        existing = {q['id'] for q in response.data}
+        if len(set(question_ids)) != len(question_ids) or set(question_ids) != existing:
+            raise ValueError(f"问题ID列表与问卷问题不一致: survey_id={survey_id}")
         
-        return updated_questions 
\ No newline at end of file
+        now = datetime.now().isoformat()
+        responses = await gather_with_timeouts(*(
+            client.table('cu_survey_questions')
+                .update({'question_order': idx, 'updated_at': now})
+                .eq('id', question_id).eq('survey_id', survey_id)
+                .execute()
+            for idx, question_id in enumerate(question_ids, start=1)
+        ))
+        updated = sorted((q for r in responses for q in r.data), key=lambda q: q['question_order'])
+        return [SurveyQuestion(**q) for q in format_timestamps(updated)]
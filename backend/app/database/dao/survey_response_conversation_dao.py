@@ -2,17 +2,32 @@
 问卷回答对话数据访问对象
 """
 
-from typing import List, Dict, Any, Optional
+import logging
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
+from ..async_client import APIError
 from ..config import get_supabase
+from ..pagination import KEYSET_CONVERSATION, fetch_page
 from ..schemas import (
     SurveyResponseConversation, SurveyResponseConversationCreate,
     SurveyResponseConversationUpdate
 )
-from .utils import format_timestamp
+from .utils import format_timestamp, format_timestamps, instrument_dao
 
+logger = logging.getLogger(__name__)
 
+# client_message_id列或其唯一索引未部署时PostgREST/PostgreSQL返回的错误码
+CLIENT_MESSAGE_ID_MISSING = {"PGRST204", "42703", "42P10"}
+# 发现client_message_id未部署后，间隔多久(秒)再次尝试按它去重写入
+CLIENT_MESSAGE_ID_RETRY_INTERVAL = 300.0
+
+# 下次尝试按client_message_id去重写入的时间(time.monotonic)，0表示总是尝试
+_client_message_id_retry_at = 0.0
+
+
+@instrument_dao
 class SurveyResponseConversationDAO:
     """问卷回答对话数据访问对象"""
     
@@ -32,7 +47,7 @@ class SurveyResponseConversationDAO:
         data['created_at'] = datetime.now().isoformat()
         data['updated_at'] = data['created_at']
         
-        response = client.table('cu_survey_response_conversations').insert(data).execute()
+        response = await client.table('cu_survey_response_conversations').insert(data).execute()
         result = response.data[0]
         
         return SurveyResponseConversation(**format_timestamp(result))
@@ -49,7 +64,7 @@ class SurveyResponseConversationDAO:
             问卷回答对话模型，如果不存在则返回None
         """
         client = get_supabase()
-        response = client.table('cu_survey_response_conversations').select('*').eq('id', conversation_id).execute()
+        response = await client.table('cu_survey_response_conversations').select('*').eq('id', conversation_id).execute()
         
         if not response.data:
             return None
@@ -57,21 +72,72 @@ class SurveyResponseConversationDAO:
         return SurveyResponseConversation(**format_timestamp(response.data[0]))
     
     @staticmethod
-    async def get_by_response_id(response_id: int) -> List[SurveyResponseConversation]:
+    async def get_by_response_id(response_id: int, after_order: int = 0) -> List[SurveyResponseConversation]:
         """
         获取问卷回答的所有对话
         
         Args:
             response_id: 回答ID
+            after_order: 只返回顺序号大于该值的对话，默认返回全部
             
         Returns:
             问卷回答对话模型列表
         """
         client = get_supabase()
-        response = client.table('cu_survey_response_conversations')\
-            .select('*').eq('survey_response_id', response_id).order('conversation_order').execute()
+        query = client.table('cu_survey_response_conversations')\
+            .select('*').eq('survey_response_id', response_id).order('conversation_order')
+        
+        if after_order:
+            query = query.gt('conversation_order', after_order)
+        
+        response = await query.execute()
         
-        return [SurveyResponseConversation(**format_timestamp(c)) for c in response.data]
+        return [SurveyResponseConversation(**c) for c in format_timestamps(response.data)]
+    
+    @staticmethod
+    async def get_raw_page_by_response_ids(
+        response_ids: List[int],
+        limit: int = 1000,
+        cursor: Optional[str] = None,
+        select_fields: str = '*'
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按(回答ID, 对话顺序)游标分页读取多个回答的对话原始数据，用于批量导出
+        
+        Args:
+            response_ids: 回答ID列表
+            limit: 每页数量
+            cursor: 上一页返回的游标，None表示第一页
+            select_fields: 要选择的字段
+            
+        Returns:
+            (对话原始数据列表, 下一页游标)
+        """
+        client = get_supabase()
+        query = client.table('cu_survey_response_conversations')\
+            .select(select_fields).in_('survey_response_id', response_ids)
+        return await fetch_page(query, KEYSET_CONVERSATION, cursor, limit, desc=False)
+    
+    @staticmethod
+    async def get_max_order(response_id: int) -> int:
+        """
+        获取问卷回答当前最大的对话顺序号，只读取一行
+        
+        Args:
+            response_id: 回答ID
+            
+        Returns:
+            最大的conversation_order，没有对话时返回0
+        """
+        client = get_supabase()
+        response = await client.table('cu_survey_response_conversations')\
+            .select('conversation_order').eq('survey_response_id', response_id)\
+            .order('conversation_order', desc=True).limit(1).execute()
+        
+        if not response.data:
+            return 0
+        
+        return response.data[0]['conversation_order']
     
     @staticmethod
     async def update(
@@ -92,7 +158,7 @@ class SurveyResponseConversationDAO:
         data = {k: v for k, v in conversation_update.dict().items() if v is not None}
         data['updated_at'] = datetime.now().isoformat()
         
-        response = client.table('cu_survey_response_conversations').update(data).eq('id', conversation_id).execute()
+        response = await client.table('cu_survey_response_conversations').update(data).eq('id', conversation_id).execute()
         
         if not response.data:
             return None
@@ -111,7 +177,7 @@ class SurveyResponseConversationDAO:
             是否删除成功
         """
         client = get_supabase()
-        response = client.table('cu_survey_response_conversations').delete().eq('id', conversation_id).execute()
+        response = await client.table('cu_survey_response_conversations').delete().eq('id', conversation_id).execute()
         return len(response.data) > 0
     
     @staticmethod
@@ -129,7 +195,6 @@ class SurveyResponseConversationDAO:
         Returns:
             创建后的问卷回答对话模型列表
         """
-        client = get_supabase()
         now = datetime.now().isoformat()
         
         data_to_insert = []
@@ -139,10 +204,48 @@ class SurveyResponseConversationDAO:
                 'speaker_type': conv['speaker_type'],
                 'message_text': conv['message_text'],
                 'conversation_order': conv.get('conversation_order', i + 1),
-                'created_at': now,
-                'updated_at': now
+                'created_at': conv.get('created_at', now),
+                'updated_at': conv.get('created_at', now)
             })
         
-        response = client.table('cu_survey_response_conversations').insert(data_to_insert).execute()
+        return await SurveyResponseConversationDAO.insert_rows(data_to_insert)
+    
+    @staticmethod
+    async def insert_rows(rows: List[Dict[str, Any]]) -> List[SurveyResponseConversation]:
+        """
+        用一条INSERT写入多条对话，行可以属于不同的回答
+        
+        行中带有client_message_id时跳过该标识已存在的行，同一批消息重复写入不会产生重复记录；
+        client_message_id列未部署(migrations/007)时去掉该字段普通插入，
+        每隔CLIENT_MESSAGE_ID_RETRY_INTERVAL秒重新尝试去重写入
         
-        return [SurveyResponseConversation(**format_timestamp(c)) for c in response.data] 
\ No newline at end of file
+        Args:
+            rows: 对话行数据，需包含survey_response_id、speaker_type、message_text、
+                conversation_order、created_at和updated_at，可选client_message_id
+            
+        Returns:
+            本次新插入的问卷回答对话模型列表
+            
+        Raises:
+            APIError: 写入失败，顺序号冲突时code为23505
+        """
+        global _client_message_id_retry_at
+        
+        if not rows:
+            return []
+        client = get_supabase()
+        if any('client_message_id' in row for row in rows):
+            if time.monotonic() >= _client_message_id_retry_at:
+                try:
+                    response = await client.table('cu_survey_response_conversations')\
+                        .upsert(rows, on_conflict='client_message_id', ignore_duplicates=True).execute()
+                    return [SurveyResponseConversation(**c) for c in format_timestamps(response.data)]
+                except APIError as e:
+                    if e.code not in CLIENT_MESSAGE_ID_MISSING:
+                        raise
+                    _client_message_id_retry_at = time.monotonic() + CLIENT_MESSAGE_ID_RETRY_INTERVAL
+                    logger.warning(f"client_message_id列未部署，重试写入时可能产生重复消息: {e.message}")
+            rows = [{k: v for k, v in row.items() if k != 'client_message_id'} for row in rows]
+        response = await client.table('cu_survey_response_conversations').insert(rows).execute()
+        
+        return [SurveyResponseConversation(**c) for c in format_timestamps(response.data)]
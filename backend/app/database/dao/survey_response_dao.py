@@ -2,17 +2,38 @@
 问卷回答数据访问对象
 """
 
-from typing import List, Optional
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 from datetime import datetime
 
+from ...concurrency import gather_with_timeouts
+from ..async_client import APIError
 from ..config import get_supabase
+from ..pagination import KEYSET_CREATED_AT, KEYSET_ID, fetch_page
 from ..schemas import (
     SurveyResponse, SurveyResponseCreate, SurveyResponseUpdate,
-    SurveyResponseWithConversations, SurveyResponseConversation
+    SurveyResponseWithConversations, SurveyResponseConversation,
+    SurveyResponseStats
 )
-from .utils import format_timestamp
+from .utils import format_timestamp, format_timestamps, instrument_dao, project_rows
 
+logger = logging.getLogger(__name__)
 
+# PostgREST错误码：数据库函数不存在
+FUNCTION_NOT_FOUND = "PGRST202"
+# 回退统计方式分别计数的回答状态，其余非空状态合计为other
+STATS_FALLBACK_STATUSES = ("pending", "completed")
+# 回退统计方式同时进行的计数查询数上限，避免一次统计大量问卷时压垮PostgREST
+STATS_FALLBACK_CONCURRENCY = 16
+# 发现survey_response_stats未部署后，间隔多久(秒)再次尝试调用，以便迁移执行后恢复使用
+STATS_RPC_RETRY_INTERVAL = 300.0
+
+# 下次尝试调用survey_response_stats的时间(time.monotonic)，0表示总是调用
+_stats_rpc_retry_at = 0.0
+
+
+@instrument_dao
 class SurveyResponseDAO:
     """问卷回答数据访问对象"""
     
@@ -32,7 +53,7 @@ class SurveyResponseDAO:
         data['created_at'] = datetime.now().isoformat()
         data['updated_at'] = data['created_at']
         
-        supabase_response = client.table('cu_survey_responses').insert(data).execute()
+        supabase_response = await client.table('cu_survey_responses').insert(data).execute()
         result = supabase_response.data[0]
         
         return SurveyResponse(**format_timestamp(result))
@@ -49,7 +70,7 @@ class SurveyResponseDAO:
             问卷回答模型，如果不存在则返回None
         """
         client = get_supabase()
-        response = client.table('cu_survey_responses').select('*').eq('id', response_id).execute()
+        response = await client.table('cu_survey_responses').select('*').eq('id', response_id).execute()
         
         if not response.data:
             return None
@@ -61,8 +82,9 @@ class SurveyResponseDAO:
         survey_id: int,
         limit: int = 100,
         offset: int = 0,
-        status: Optional[str] = None
-    ) -> List[SurveyResponse]:
+        status: Optional[str] = None,
+        raw: bool = False
+    ) -> Union[List[SurveyResponse], List[Dict[str, Any]]]:
         """
         获取问卷的所有回答
         
@@ -71,6 +93,7 @@ class SurveyResponseDAO:
             limit: 返回记录数量限制
             offset: 分页偏移量
             status: 回答状态过滤
+            raw: 为True时返回按模型字段裁剪的字典，不构造Pydantic模型，供列表接口直接序列化
             
         Returns:
             问卷回答模型列表
@@ -82,8 +105,146 @@ class SurveyResponseDAO:
         if status:
             query = query.eq('status', status)
             
-        response = query.execute()
-        return [SurveyResponse(**format_timestamp(r)) for r in response.data]
+        response = await query.execute()
+        rows = format_timestamps(response.data)
+        return project_rows(SurveyResponse, rows) if raw else [SurveyResponse(**r) for r in rows]
+    
+    @staticmethod
+    async def get_page_by_survey_id(
+        survey_id: int,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        raw: bool = False
+    ) -> Tuple[Union[List[SurveyResponse], List[Dict[str, Any]]], Optional[str]]:
+        """
+        按(created_at, id)倒序游标分页获取问卷的回答
+        
+        Args:
+            survey_id: 问卷ID
+            limit: 每页数量
+            cursor: 上一页返回的游标，None表示第一页
+            status: 回答状态过滤
+            raw: 为True时返回按模型字段裁剪的字典，不构造Pydantic模型，供列表接口直接序列化
+            
+        Returns:
+            (问卷回答模型列表, 下一页游标)，没有下一页时游标为None
+        """
+        client = get_supabase()
+        query = client.table('cu_survey_responses').select('*').eq('survey_id', survey_id)
+        
+        if status:
+            query = query.eq('status', status)
+        
+        rows, next_cursor = await fetch_page(query, KEYSET_CREATED_AT, cursor, limit)
+        rows = format_timestamps(rows)
+        return (project_rows(SurveyResponse, rows) if raw else [SurveyResponse(**r) for r in rows]), next_cursor
+    
+    @staticmethod
+    async def get_raw_page_by_survey_id(
+        survey_id: int,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按ID升序游标分页读取问卷回答的原始数据，用于批量导出
+        
+        Args:
+            survey_id: 问卷ID
+            limit: 每页数量
+            cursor: 上一页返回的游标，None表示第一页
+            status: 回答状态过滤
+            
+        Returns:
+            (回答原始数据列表, 下一页游标)
+        """
+        client = get_supabase()
+        query = client.table('cu_survey_responses').select('*').eq('survey_id', survey_id)
+        
+        if status:
+            query = query.eq('status', status)
+        
+        return await fetch_page(query, KEYSET_ID, cursor, limit, desc=False)
+    
+    @staticmethod
+    async def get_stats(survey_ids: List[int]) -> Dict[int, SurveyResponseStats]:
+        """
+        在数据库中分组聚合多个问卷的回答统计
+        
+        优先调用survey_response_stats数据库函数；函数未部署时回退为按状态发送HEAD计数请求，
+        每个问卷的每种状态一个请求、不传回记录，此时不提供平均对话轮数，
+        STATS_FALLBACK_STATUSES以外的状态合计为other，同时进行的请求不超过STATS_FALLBACK_CONCURRENCY个。
+        回退后每隔STATS_RPC_RETRY_INTERVAL秒重新尝试调用数据库函数
+        
+        Args:
+            survey_ids: 问卷ID列表
+            
+        Returns:
+            问卷ID到统计结果的映射，没有回答的问卷返回全零统计
+        """
+        global _stats_rpc_retry_at
+        
+        client = get_supabase()
+        stats = {survey_id: SurveyResponseStats(survey_id=survey_id) for survey_id in survey_ids}
+        if not survey_ids:
+            return stats
+        
+        if time.monotonic() >= _stats_rpc_retry_at:
+            try:
+                response = await client.rpc('survey_response_stats', {'p_survey_ids': survey_ids}).execute()
+                _stats_rpc_retry_at = 0.0
+                for row in response.data:
+                    total = row['total_responses'] or 0
+                    completed = row['completed_responses'] or 0
+                    stats[row['survey_id']] = SurveyResponseStats(
+                        survey_id=row['survey_id'],
+                        total_responses=total,
+                        status_counts=row['status_counts'] or {},
+                        completed_responses=completed,
+                        completion_rate=completed / total if total else 0.0,
+                        avg_turns=float(row['avg_turns']) if row['avg_turns'] is not None else None
+                    )
+                return stats
+            except APIError as e:
+                if e.code != FUNCTION_NOT_FOUND:
+                    raise
+                _stats_rpc_retry_at = time.monotonic() + STATS_RPC_RETRY_INTERVAL
+                logger.warning(
+                    f"数据库函数survey_response_stats不存在，{STATS_RPC_RETRY_INTERVAL:.0f}秒内回退为按状态计数"
+                )
+        
+        def count(survey_id: int, status: Optional[str]):
+            """status为None时计数全部回答，为unknown时计数状态为空的回答"""
+            query = client.table('cu_survey_responses')\
+                .select('id', count='exact', head=True).eq('survey_id', survey_id)
+            if status == 'unknown':
+                query = query.is_('status', 'null')
+            elif status is not None:
+                query = query.eq('status', status)
+            return query.execute()
+        
+        keys = [None, *STATS_FALLBACK_STATUSES, 'unknown']
+        responses = await gather_with_timeouts(
+            *(count(survey_id, key) for survey_id in survey_ids for key in keys),
+            limit=STATS_FALLBACK_CONCURRENCY
+        )
+        for i, survey_id in enumerate(survey_ids):
+            counts = [r.count or 0 for r in responses[i * len(keys):(i + 1) * len(keys)]]
+            total = counts[0]
+            status_counts = {key: n for key, n in zip(keys[1:], counts[1:]) if n}
+            other = total - sum(status_counts.values())
+            if other > 0:
+                status_counts['other'] = other
+            completed = status_counts.get('completed', 0)
+            stats[survey_id] = SurveyResponseStats(
+                survey_id=survey_id,
+                total_responses=total,
+                status_counts=status_counts,
+                completed_responses=completed,
+                completion_rate=completed / total if total else 0.0
+            )
+        return stats
     
     @staticmethod
     async def update(response_id: int, response_update: SurveyResponseUpdate) -> Optional[SurveyResponse]:
@@ -101,13 +262,38 @@ class SurveyResponseDAO:
         data = {k: v for k, v in response_update.dict().items() if v is not None}
         data['updated_at'] = datetime.now().isoformat()
         
-        response = client.table('cu_survey_responses').update(data).eq('id', response_id).execute()
+        response = await client.table('cu_survey_responses').update(data).eq('id', response_id).execute()
         
         if not response.data:
             return None
             
         return SurveyResponse(**format_timestamp(response.data[0]))
     
+    @staticmethod
+    async def update_summary(response_id: int, summary: str, through_order: int) -> bool:
+        """
+        更新问卷回答的对话滚动摘要
+        
+        Args:
+            response_id: 回答ID
+            summary: 摘要内容
+            through_order: 摘要覆盖到的最大对话顺序号
+            
+        Returns:
+            是否更新成功
+        """
+        client = get_supabase()
+        data = {
+            'conversation_summary': summary,
+            'summary_through_order': through_order,
+            'updated_at': datetime.now().isoformat()
+        }
+        
+        # 只允许摘要向前推进，避免并发的旧摘要覆盖新摘要
+        response = await client.table('cu_survey_responses').update(data)\
+            .eq('id', response_id).lt('summary_through_order', through_order).execute()
+        return len(response.data) > 0
+    
     @staticmethod
     async def delete(response_id: int) -> bool:
         """
@@ -120,7 +306,7 @@ class SurveyResponseDAO:
             是否删除成功
         """
         client = get_supabase()
-        response = client.table('cu_survey_responses').delete().eq('id', response_id).execute()
+        response = await client.table('cu_survey_responses').delete().eq('id', response_id).execute()
         return len(response.data) > 0
     
     @staticmethod
@@ -136,18 +322,67 @@ class SurveyResponseDAO:
         """
         client = get_supabase()
         
-        # 获取问卷回答
-        response_data = client.table('cu_survey_responses').select('*').eq('id', response_id).execute()
+        # 通过嵌入查询一次取回回答和对话
+        response_data = await client.table('cu_survey_responses')\
+            .select('*,conversations:cu_survey_response_conversations(*)')\
+            .eq('id', response_id)\
+            .order('conversation_order', foreign_table='conversations')\
+            .execute()
         if not response_data.data:
             return None
         
-        survey_response = format_timestamp(response_data.data[0])
+        survey_response = dict(response_data.data[0])
+        conversations = [
+            SurveyResponseConversation(**c)
+            for c in format_timestamps(survey_response.pop('conversations', None) or [])
+        ]
+        survey_response = format_timestamp(survey_response)
         
-        # 获取对话记录
-        conversations_response = client.table('cu_survey_response_conversations')\
-            .select('*').eq('survey_response_id', response_id).order('conversation_order').execute()
+        # 创建包含对话的问卷回答
+        return SurveyResponseWithConversations(**survey_response, conversations=conversations)
+    
+    @staticmethod
+    async def acquire_turn_lease(
+        response_id: int,
+        holder: str,
+        turn_key: str,
+        ttl_seconds: int
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        获取或续约回答的对话轮次租约（需要migrations/006_response_turn_leases.sql）
         
-        conversations = [SurveyResponseConversation(**format_timestamp(c)) for c in conversations_response.data]
+        Args:
+            response_id: 回答ID
+            holder: 持有者标识
+            turn_key: 本轮对话的标识，用于识别其他worker上的重复请求
+            ttl_seconds: 租约有效期(秒)
+            
+        Returns:
+            (是否获得租约, 当前持有者的轮次标识)
+        """
+        client = get_supabase()
+        response = await client.rpc('acquire_response_turn_lease', {
+            'p_response_id': response_id,
+            'p_holder': holder,
+            'p_turn_key': turn_key,
+            'p_ttl_seconds': ttl_seconds
+        }).execute()
+        if not response.data:
+            return False, None
+        row = response.data[0]
+        return bool(row['acquired']), row['current_turn_key']
+    
+    @staticmethod
+    async def release_turn_lease(response_id: int, holder: str) -> None:
+        """
+        释放自己持有的对话轮次租约
         
-        # 创建包含对话的问卷回答
-        return SurveyResponseWithConversations(**survey_response, conversations=conversations) 
\ No newline at end of file
+        Args:
+            response_id: 回答ID
+            holder: 持有者标识
+        """
+        client = get_supabase()
+        await client.rpc('release_response_turn_lease', {
+            'p_response_id': response_id,
+            'p_holder': holder
+        }).execute()
@@ -2,70 +2,218 @@
 DAO辅助工具函数
 """
 
-from typing import Dict, Any
-from datetime import datetime
+import asyncio
+import functools
+import logging
+import os
+import re
+import time
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Type, TypeVar
+from datetime import datetime, timedelta, timezone
 
+from pydantic import BaseModel
 
-def format_timestamp(data: Dict[str, Any]) -> Dict[str, Any]:
+from ...metrics import DB_QUERY_DURATION, DB_QUERY_ERRORS
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 严格模式下无法解析的时间戳直接报错，而不是用当前时间代替
+TIMESTAMP_STRICT = os.environ.get("TIMESTAMP_STRICT", "false").lower() == "true"
+
+# 需要转换的时间戳字段
+TIMESTAMP_FIELDS = ("created_at", "updated_at")
+
+T = TypeVar("T")
+M = TypeVar("M", bound=BaseModel)
+
+
+def instrument_dao(cls: Type[T]) -> Type[T]:
+    """
+    DAO类装饰器：记录每个异步静态方法的耗时和出错次数
+
+    Args:
+        cls: DAO类
+
+    Returns:
+        原DAO类，其异步静态方法已被包装
+    """
+    for name, attr in list(vars(cls).items()):
+        if not isinstance(attr, staticmethod) or name.startswith("_"):
+            continue
+        func = attr.__func__
+        if not asyncio.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, staticmethod(_timed(func, cls.__name__, name)))
+    return cls
+
+
+def _timed(func, dao: str, method: str):
+    """包装DAO方法，记录耗时和异常"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.inc(dao=dao, method=method)
+            raise
+        finally:
+            DB_QUERY_DURATION.observe(time.perf_counter() - start, dao=dao, method=method)
+    return wrapper
+
+
+class TimestampFormatError(ValueError):
+    """时间戳无法解析"""
+
+    def __init__(self, errors: List[Tuple[int, str, Any]]):
+        self.errors = errors
+        index, field, value = errors[0]
+        super().__init__(f"无法解析{len(errors)}个时间戳，第一个: 第{index}行 {field}={value!r}")
+
+
+# PostgREST返回的timestamptz，如 2024-01-01T12:34:56.123456+00:00
+_TIMESTAMP_PATTERN = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?(Z|[+-]\d{2}(?::?\d{2})?)?"
+)
+# 时区偏移字符串 -> tzinfo，PostgREST通常只会返回少数几种偏移
+_TIMEZONES: Dict[Optional[str], Optional[timezone]] = {None: None, "Z": timezone.utc, "+00:00": timezone.utc}
+
+
+def _timezone(offset: Optional[str]) -> Optional[timezone]:
+    tz = _TIMEZONES.get(offset)
+    if tz is None and offset is not None:
+        digits = offset[1:].replace(":", "")
+        delta = timedelta(hours=int(digits[:2]), minutes=int(digits[2:4] or 0))
+        tz = timezone(-delta if offset[0] == "-" else delta)
+        _TIMEZONES[offset] = tz
+    return tz
+
+
+def parse_timestamp(value: str) -> datetime:
+    """
+    解析PostgREST返回的ISO格式时间戳
+
+    常见的"6位微秒+00:00"格式直接交给fromisoformat，其余格式（Z后缀、
+    不足或超过6位的小数、其他时区偏移）用预编译的正则解析，超过6位的小数截断
+
+    Args:
+        value: 时间戳字符串
+
+    Returns:
+        datetime对象
+
+    Raises:
+        ValueError: 格式无法识别
+    """
+    if len(value) == 32 and value[19] == "." and value[26] == "+":
+        return datetime.fromisoformat(value)
+    match = _TIMESTAMP_PATTERN.fullmatch(value)
+    if match is None:
+        raise ValueError(f"无效的时间戳: {value!r}")
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    microsecond = int(fraction[:6].ljust(6, "0")) if fraction else 0
+    return datetime(
+        int(year), int(month), int(day), int(hour), int(minute), int(second),
+        microsecond, _timezone(offset)
+    )
+
+
+def format_timestamps(
+    rows: Iterable[Dict[str, Any]],
+    strict: Optional[bool] = None,
+    fields: Tuple[str, ...] = TIMESTAMP_FIELDS
+) -> List[Dict[str, Any]]:
+    """
+    批量将行中的字符串时间戳转换为datetime对象（原地修改）
+
+    Args:
+        rows: 数据字典列表
+        strict: 是否严格模式，None时使用TIMESTAMP_STRICT配置。严格模式下有无法解析的值时
+            抛出TimestampFormatError；否则记录警告并用当前时间代替
+        fields: 需要转换的字段
+
+    Returns:
+        处理后的数据字典列表
+
+    Raises:
+        TimestampFormatError: 严格模式下存在无法解析的时间戳
+    """
+    rows = rows if isinstance(rows, list) else list(rows)
+    errors: List[Tuple[int, str, Any]] = []
+    fromisoformat = datetime.fromisoformat
+    # created_at和updated_at经常相同，复用上一次的解析结果
+    last_value, last_parsed = None, None
+    for index, row in enumerate(rows):
+        for field in fields:
+            value = row.get(field)
+            if not value:
+                continue
+            if value.__class__ is not str:
+                if not isinstance(value, datetime):
+                    errors.append((index, field, value))
+                continue
+            if value == last_value:
+                row[field] = last_parsed
+                continue
+            try:
+                if len(value) == 32 and value[19] == "." and value[26] == "+":
+                    parsed = fromisoformat(value)
+                else:
+                    parsed = parse_timestamp(value)
+            except ValueError:
+                errors.append((index, field, value))
+                continue
+            row[field] = last_parsed = parsed
+            last_value = value
+
+    if errors:
+        if strict if strict is not None else TIMESTAMP_STRICT:
+            raise TimestampFormatError(errors)
+        logger.warning(f"{len(errors)}个时间戳解析失败，已使用当前时间代替，第一个: {errors[0][1]}={errors[0][2]!r}")
+        now = datetime.now()
+        for index, field, _ in errors:
+            rows[index][field] = now
+    return rows
+
+
+def format_timestamp(data: Dict[str, Any], strict: Optional[bool] = None) -> Dict[str, Any]:
     """
     将字符串时间戳转换为datetime对象
     
     Args:
         data: 包含时间戳字段的数据字典
+        strict: 是否严格模式，见format_timestamps
         
     Returns:
         处理后的数据字典，时间戳已转换为datetime对象
     """
-    if 'created_at' in data and data['created_at']:
-        try:
-            # 处理各种ISO格式的日期时间字符串
-            timestamp = data['created_at']
-            # 确保有时区信息
-            if 'Z' in timestamp:
-                timestamp = timestamp.replace('Z', '+00:00')
-            # 确保微秒格式正确
-            if '.' in timestamp and '+' in timestamp:
-                parts = timestamp.split('+')
-                time_part = parts[0]
-                zone_part = '+' + parts[1]
-                # 如果微秒部分长度超过6，截断它
-                if '.' in time_part:
-                    time_parts = time_part.split('.')
-                    if len(time_parts[1]) > 6:
-                        time_parts[1] = time_parts[1][:6]
-                    time_part = '.'.join(time_parts)
-                timestamp = time_part + zone_part
-            data['created_at'] = datetime.fromisoformat(timestamp)
-        except Exception as e:
-            # 如果解析失败，记录错误但不中断程序
-            print(f"解析created_at时间戳出错: {e}, 原始值: {data['created_at']}")
-            # 使用当前时间作为备用
-            data['created_at'] = datetime.now()
-    
-    if 'updated_at' in data and data['updated_at']:
-        try:
-            # 处理各种ISO格式的日期时间字符串
-            timestamp = data['updated_at']
-            # 确保有时区信息
-            if 'Z' in timestamp:
-                timestamp = timestamp.replace('Z', '+00:00')
-            # 确保微秒格式正确
-            if '.' in timestamp and '+' in timestamp:
-                parts = timestamp.split('+')
-                time_part = parts[0]
-                zone_part = '+' + parts[1]
-                # 如果微秒部分长度超过6，截断它
-                if '.' in time_part:
-                    time_parts = time_part.split('.')
-                    if len(time_parts[1]) > 6:
-                        time_parts[1] = time_parts[1][:6]
-                    time_part = '.'.join(time_parts)
-                timestamp = time_part + zone_part
-            data['updated_at'] = datetime.fromisoformat(timestamp)
-        except Exception as e:
-            # 如果解析失败，记录错误但不中断程序
-            print(f"解析updated_at时间戳出错: {e}, 原始值: {data['updated_at']}")
-            # 使用当前时间作为备用
-            data['updated_at'] = datetime.now()
-    
-    return data 
\ No newline at end of file
+    return format_timestamps([data], strict)[0]
+
+
+
+@functools.lru_cache(maxsize=None)
+def _field_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    """模型字段及其默认值，必填字段默认为None"""
+    return {
+        name: None if field.is_required() else field.get_default(call_default_factory=True)
+        for name, field in model.model_fields.items()
+    }
+
+
+def project_rows(model: Type[BaseModel], rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    按模型字段裁剪数据库行，得到与模型JSON输出一致的字典
+
+    列表接口直接序列化这些字典，不再逐行构造和校验Pydantic模型；
+    调用前应先用format_timestamps转换时间戳。表中多出的列被丢弃，缺失的字段取模型默认值
+
+    Args:
+        model: 模型类
+        rows: 数据字典列表
+
+    Returns:
+        字典列表，字段顺序与模型一致
+    """
+    defaults = _field_defaults(model).items()
+    return [{name: row.get(name, default) for name, default in defaults} for row in rows]
@@ -0,0 +1,107 @@
+"""
+PostgREST嵌入查询
+在一次请求中通过外键关系把关联表的数据嵌套到主记录中，
+避免先查主表、再逐个查关联表的多次往返
+
+嵌入依赖数据库中的外键约束，见 migrations/005_embedding_foreign_keys.sql
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from .async_client import AsyncQueryBuilder
+
+# 嵌入的一对多关联最多返回的行数
+EMBED_LIMIT = 100
+
+# 表 -> {嵌入名: (关联表, 排序字段, 是否一对多)}
+RELATIONS: Dict[str, Dict[str, Tuple[str, Optional[str], bool]]] = {
+    "cu_survey": {
+        "questions": ("cu_survey_questions", "question_order", True),
+        "responses": ("cu_survey_responses", "id", True),
+    },
+    "cu_survey_questions": {
+        "survey": ("cu_survey", None, False),
+    },
+    "cu_survey_responses": {
+        "survey": ("cu_survey", None, False),
+        "conversations": ("cu_survey_response_conversations", "conversation_order", True),
+    },
+    "cu_survey_response_conversations": {
+        "response": ("cu_survey_responses", None, False),
+    },
+}
+
+
+def parse_include(table_name: str, include: Optional[str]) -> List[str]:
+    """
+    解析逗号分隔的嵌入名
+
+    Args:
+        table_name: 主表名
+        include: 逗号分隔的嵌入名，如 "questions,responses"
+
+    Returns:
+        去重后的嵌入名列表
+
+    Raises:
+        ValueError: 嵌入名不属于该表的关联
+    """
+    if not include:
+        return []
+    relations = RELATIONS.get(table_name, {})
+    names = list(dict.fromkeys(name.strip() for name in include.split(",") if name.strip()))
+    unknown = [name for name in names if name not in relations]
+    if unknown:
+        available = ", ".join(relations) or "无"
+        raise ValueError(f"表 '{table_name}' 不支持嵌入 {', '.join(unknown)}，可用: {available}")
+    return names
+
+
+def to_many_relations(table_name: str) -> List[str]:
+    """获取表的所有一对多关联名"""
+    return [name for name, (_, _, many) in RELATIONS.get(table_name, {}).items() if many]
+
+
+def embed_select(table_name: str, select_fields: str, names: List[str]) -> str:
+    """
+    在select字段后追加嵌入资源
+
+    Args:
+        table_name: 主表名
+        select_fields: 主表要选择的字段
+        names: 嵌入名列表
+
+    Returns:
+        PostgREST select表达式，如 "*,questions:cu_survey_questions(*)"
+    """
+    relations = RELATIONS[table_name] if names else {}
+    parts = [select_fields] + [f"{name}:{relations[name][0]}(*)" for name in names]
+    return ",".join(parts)
+
+
+def apply_embeds(
+    query: AsyncQueryBuilder,
+    table_name: str,
+    names: List[str],
+    limit: int = EMBED_LIMIT
+) -> AsyncQueryBuilder:
+    """
+    为一对多嵌入添加排序和数量限制
+
+    Args:
+        query: 已通过embed_select设置select的查询构造器
+        table_name: 主表名
+        names: 嵌入名列表
+        limit: 每个一对多嵌入最多返回的行数
+
+    Returns:
+        查询构造器
+    """
+    for name in names:
+        _, order_column, many = RELATIONS[table_name][name]
+        if not many:
+            continue
+        if order_column:
+            query = query.order(order_column, foreign_table=name)
+        query = query.limit(limit, foreign_table=name)
+    return query
@@ -0,0 +1,28 @@
+-- 同一个问卷回答内的对话顺序号必须唯一
+-- 多个worker并发写入时由数据库拒绝重复的顺序号，应用层收到冲突后重新分配
+
+-- 存量数据中已有重复的顺序号（并发写入时读取-加一产生），建唯一索引前先修复：
+-- 只处理存在重复的回答，按原顺序号、创建时间、id排序后重新编号为1..n，消息的先后顺序不变
+with duplicated as (
+    select survey_response_id
+    from cu_survey_response_conversations
+    group by survey_response_id
+    having count(*) <> count(distinct conversation_order)
+),
+renumbered as (
+    select c.id,
+           row_number() over (
+               partition by c.survey_response_id
+               order by c.conversation_order, c.created_at, c.id
+           ) as new_order
+    from cu_survey_response_conversations c
+    join duplicated d on d.survey_response_id = c.survey_response_id
+)
+update cu_survey_response_conversations c
+set conversation_order = r.new_order
+from renumbered r
+where c.id = r.id
+  and c.conversation_order is distinct from r.new_order;
+
+create unique index if not exists cu_survey_response_conversations_order_uq
+    on cu_survey_response_conversations (survey_response_id, conversation_order);
@@ -0,0 +1,5 @@
+-- 长对话的滚动摘要
+-- conversation_summary保存较早对话的摘要，summary_through_order记录已被摘要覆盖的最大对话顺序号
+alter table cu_survey_responses
+    add column if not exists conversation_summary text,
+    add column if not exists summary_through_order integer not null default 0;
@@ -0,0 +1,32 @@
+-- 批量重排问卷问题
+-- 在一个事务中按传入的ID顺序更新所有问题的question_order，并返回排序后的问题列表；
+-- ID列表必须恰好包含该问卷的全部问题，否则整体回滚
+create or replace function reorder_survey_questions(p_survey_id bigint, p_question_ids bigint[])
+returns setof cu_survey_questions
+language plpgsql
+as $$
+declare
+    v_expected integer;
+    v_distinct integer;
+begin
+    select count(*) into v_expected from cu_survey_questions where survey_id = p_survey_id;
+    select count(distinct id) into v_distinct
+        from cu_survey_questions
+        where survey_id = p_survey_id and id = any(p_question_ids);
+
+    if v_distinct <> v_expected or v_distinct <> coalesce(array_length(p_question_ids, 1), 0) then
+        raise exception '问题ID列表与问卷问题不一致: survey_id=%', p_survey_id
+            using errcode = '22023';
+    end if;
+
+    update cu_survey_questions q
+        set question_order = o.ord, updated_at = now()
+        from unnest(p_question_ids) with ordinality as o(id, ord)
+        where q.id = o.id and q.survey_id = p_survey_id;
+
+    return query
+        select * from cu_survey_questions
+        where survey_id = p_survey_id
+        order by question_order;
+end;
+$$;
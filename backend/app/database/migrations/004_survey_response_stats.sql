@@ -0,0 +1,50 @@
+-- 问卷回答统计
+-- 在数据库中按问卷分组聚合回答总数、各状态数量、已完成数量和平均对话轮数，
+-- 一次调用可以查询多个问卷，不需要把回答记录逐条传回应用
+create index if not exists cu_survey_responses_survey_status_idx
+    on cu_survey_responses (survey_id, status);
+
+-- avg_turns为受访者发言次数的平均值，只统计至少发言过一次的回答；没有回答的问卷不返回行
+create or replace function survey_response_stats(p_survey_ids bigint[])
+returns table (
+    survey_id bigint,
+    total_responses bigint,
+    status_counts jsonb,
+    completed_responses bigint,
+    avg_turns numeric
+)
+language sql
+stable
+as $$
+    with turns as (
+        select c.survey_response_id, count(*) as user_turns
+        from cu_survey_response_conversations c
+        join cu_survey_responses r on r.id = c.survey_response_id
+        where r.survey_id = any(p_survey_ids) and c.speaker_type = 'user'
+        group by c.survey_response_id
+    ),
+    per_status as (
+        select r.survey_id, coalesce(r.status, 'unknown') as status, count(*) as n
+        from cu_survey_responses r
+        where r.survey_id = any(p_survey_ids)
+        group by r.survey_id, coalesce(r.status, 'unknown')
+    ),
+    per_survey as (
+        select
+            r.survey_id,
+            count(*) as total_responses,
+            count(*) filter (where r.status = 'completed') as completed_responses,
+            avg(t.user_turns) as avg_turns
+        from cu_survey_responses r
+        left join turns t on t.survey_response_id = r.id
+        where r.survey_id = any(p_survey_ids)
+        group by r.survey_id
+    )
+    select
+        s.survey_id,
+        s.total_responses,
+        (select jsonb_object_agg(p.status, p.n) from per_status p where p.survey_id = s.survey_id),
+        s.completed_responses,
+        round(s.avg_turns, 2)
+    from per_survey s;
+$$;
@@ -0,0 +1,50 @@
+-- PostgREST嵌入查询依赖外键关系推断表之间的关联
+-- 已存在外键的列跳过，只为缺失的关联补充约束；
+-- 先以not valid创建，不在加约束时锁表扫描存量数据，随后单独校验；
+-- 存在历史孤儿行时校验失败只给出提示，约束保持not valid（仍约束新写入的数据），不影响迁移。
+-- 不设置on delete动作，删除父记录的行为与之前一致
+do $$
+declare
+    fk record;
+begin
+    for fk in
+        select * from (values
+            ('cu_survey_questions', 'survey_id', 'cu_survey'),
+            ('cu_survey_responses', 'survey_id', 'cu_survey'),
+            ('cu_survey_response_conversations', 'survey_response_id', 'cu_survey_responses')
+        ) as t(child_table, child_column, parent_table)
+    loop
+        if not exists (
+            select 1
+            from pg_constraint c
+            join pg_attribute a on a.attrelid = c.conrelid and a.attnum = any(c.conkey)
+            where c.contype = 'f'
+              and c.conrelid = fk.child_table::regclass
+              and c.confrelid = fk.parent_table::regclass
+              and a.attname = fk.child_column
+        ) then
+            execute format(
+                'alter table %I add constraint %I foreign key (%I) references %I (id) not valid',
+                fk.child_table, fk.child_table || '_' || fk.child_column || '_fkey',
+                fk.child_column, fk.parent_table
+            );
+            begin
+                execute format(
+                    'alter table %I validate constraint %I',
+                    fk.child_table, fk.child_table || '_' || fk.child_column || '_fkey'
+                );
+            exception when foreign_key_violation then
+                raise notice '%.% 存在没有对应 % 记录的行，外键保持not valid，清理后可再执行validate constraint',
+                    fk.child_table, fk.child_column, fk.parent_table;
+            end;
+        end if;
+    end loop;
+end;
+$$;
+
+-- 嵌入查询按外键过滤子表
+create index if not exists cu_survey_questions_survey_id_idx
+    on cu_survey_questions (survey_id, question_order);
+
+-- 通知PostgREST重新加载表关系
+notify pgrst, 'reload schema';
@@ -0,0 +1,46 @@
+-- 对话轮次租约
+-- 多个worker同时为同一回答生成回复时，用租约保证同一时间只有一轮对话在进行。
+-- PostgREST每个请求从连接池取连接，会话级advisory lock无法跨请求持有，
+-- 事务级advisory lock在RPC返回时即释放，所以用带过期时间的租约行代替：
+-- 持有者定期续约，进程崩溃后租约到期自动失效
+create table if not exists cu_response_turn_leases (
+    response_id bigint primary key references cu_survey_responses (id) on delete cascade,
+    holder text not null,
+    turn_key text not null,
+    expires_at timestamptz not null
+);
+
+-- 租约空闲、已过期或本就属于p_holder时获得（续约），返回是否获得以及当前持有者的轮次标识
+create or replace function acquire_response_turn_lease(
+    p_response_id bigint,
+    p_holder text,
+    p_turn_key text,
+    p_ttl_seconds integer
+)
+returns table (acquired boolean, current_turn_key text)
+language plpgsql
+as $$
+begin
+    insert into cu_response_turn_leases as l (response_id, holder, turn_key, expires_at)
+    values (p_response_id, p_holder, p_turn_key, now() + make_interval(secs => p_ttl_seconds))
+    on conflict (response_id) do update
+        set holder = excluded.holder,
+            turn_key = excluded.turn_key,
+            expires_at = excluded.expires_at
+        where l.expires_at < now() or l.holder = excluded.holder;
+
+    return query
+        select l.holder = p_holder, l.turn_key
+        from cu_response_turn_leases l
+        where l.response_id = p_response_id;
+end;
+$$;
+
+-- 只释放自己持有的租约
+create or replace function release_response_turn_lease(p_response_id bigint, p_holder text)
+returns void
+language sql
+as $$
+    delete from cu_response_turn_leases
+    where response_id = p_response_id and holder = p_holder;
+$$;
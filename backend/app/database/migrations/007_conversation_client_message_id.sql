@@ -0,0 +1,12 @@
+-- 对话消息的客户端标识
+-- 写后队列在入队时为每条消息生成client_message_id，写入时按它跳过已存在的行：
+-- 写入请求超时等结果不明确的失败后重试，已经提交的消息不会被再次插入。
+-- 唯一索引不能是部分索引，否则无法作为ON CONFLICT的冲突目标；历史数据为NULL，互不冲突
+alter table cu_survey_response_conversations
+    add column if not exists client_message_id uuid;
+
+create unique index if not exists cu_survey_response_conversations_client_message_id_uq
+    on cu_survey_response_conversations (client_message_id);
+
+-- 通知PostgREST重新加载表结构
+notify pgrst, 'reload schema';
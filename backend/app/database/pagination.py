@@ -0,0 +1,169 @@
+"""
+游标(keyset)分页
+按(created_at, id)或id排序，以上一页最后一行的排序键作为下一页的起点，
+深分页的查询成本不随页数增长，新插入的行也不会导致翻页时重复或遗漏
+
+游标对客户端是不透明的字符串：base64url编码的JSON，记录排序键和方向
+"""
+
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from .async_client import AsyncQueryBuilder
+
+# 支持的排序键
+KEYSET_ID = "id"
+KEYSET_CREATED_AT = "created_at"
+# 对话记录按所属回答和对话顺序排序
+KEYSET_CONVERSATION = "conversation"
+
+_KEY_COLUMNS = {
+    KEYSET_ID: ("id", ),
+    KEYSET_CREATED_AT: ("created_at", "id"),
+    KEYSET_CONVERSATION: ("survey_response_id", "conversation_order", "id"),
+}
+
+
+class InvalidCursorError(ValueError):
+    """游标无法解析或与当前查询的排序方式不匹配"""
+
+
+def encode_cursor(key: str, desc: bool, values: List[Any]) -> str:
+    """
+    编码游标
+
+    Args:
+        key: 排序键，如KEYSET_ID、KEYSET_CREATED_AT
+        desc: 是否降序
+        values: 上一页最后一行的排序键值
+
+    Returns:
+        游标字符串
+    """
+    raw = json.dumps({"k": key, "d": desc, "v": values}, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, key: str, desc: bool) -> List[Any]:
+    """
+    解码游标并校验排序方式
+
+    Args:
+        cursor: 游标字符串
+        key: 当前查询的排序键
+        desc: 当前查询是否降序
+
+    Returns:
+        排序键值
+
+    Raises:
+        InvalidCursorError: 游标无效
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        values = data["v"]
+    except Exception:
+        raise InvalidCursorError("无效的分页游标")
+    if data.get("k") != key or bool(data.get("d")) != desc or len(values) != len(_KEY_COLUMNS[key]):
+        raise InvalidCursorError("分页游标与当前排序方式不匹配")
+    return values
+
+
+def _quote(value: Any) -> str:
+    """PostgREST逻辑条件中的值加双引号，避免时间戳中的特殊字符被误解析"""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def apply_keyset(
+    query: AsyncQueryBuilder,
+    key: str,
+    cursor: Optional[str],
+    limit: int,
+    desc: bool = True
+) -> AsyncQueryBuilder:
+    """
+    为查询添加keyset排序、起点条件和limit
+
+    多取一行用于判断是否还有下一页
+
+    Args:
+        query: 查询构造器
+        key: 排序键
+        cursor: 上一页返回的游标，None表示第一页
+        limit: 每页数量
+        desc: 是否降序
+
+    Returns:
+        查询构造器
+    """
+    columns = _KEY_COLUMNS[key]
+    if cursor:
+        values = decode_cursor(cursor, key, desc)
+        op = "lt" if desc else "gt"
+        if len(columns) == 1:
+            query = query.filter(columns[0], op, values[0])
+        else:
+            # (a, b, c) < (x, y, z) 展开为 a<x or (a=x and b<y) or (a=x and b=y and c<z)
+            branches = []
+            for i, column in enumerate(columns):
+                conditions = [f"{c}.eq.{_quote(v)}" for c, v in zip(columns[:i], values[:i])]
+                conditions.append(f"{column}.{op}.{_quote(values[i])}")
+                branches.append(conditions[0] if i == 0 else f"and({','.join(conditions)})")
+            query = query.or_(",".join(branches))
+    for column in columns:
+        query = query.order(column, desc=desc)
+    return query.limit(limit + 1)
+
+
+def split_page(
+    rows: List[Dict[str, Any]],
+    key: str,
+    limit: int,
+    desc: bool = True
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    截取一页数据并生成下一页游标
+
+    需要在时间戳等字段被转换之前调用，以原始值生成游标
+
+    Args:
+        rows: apply_keyset查询返回的行（最多limit + 1行）
+        key: 排序键
+        limit: 每页数量
+        desc: 是否降序
+
+    Returns:
+        (本页数据, 下一页游标)，没有下一页时游标为None
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(key, desc, [last.get(column) for column in _KEY_COLUMNS[key]])
+
+
+async def fetch_page(
+    query: AsyncQueryBuilder,
+    key: str,
+    cursor: Optional[str],
+    limit: int,
+    desc: bool = True
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    执行keyset分页查询
+
+    Args:
+        query: 已设置select和过滤条件的查询构造器
+        key: 排序键
+        cursor: 上一页返回的游标，None表示第一页
+        limit: 每页数量
+        desc: 是否降序
+
+    Returns:
+        (本页数据, 下一页游标)
+    """
+    response = await apply_keyset(query, key, cursor, limit, desc).execute()
+    return split_page(response.data, key, limit, desc)
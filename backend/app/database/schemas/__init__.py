@@ -15,14 +15,15 @@ from .survey import (
 # 问卷问题相关模型
 from .survey_question import (
     SurveyQuestion, SurveyQuestionBase, 
-    SurveyQuestionCreate, SurveyQuestionUpdate
+    SurveyQuestionCreate, SurveyQuestionUpdate,
+    SurveyQuestionOrderUpdate
 )
 
 # 问卷回答相关模型
 from .survey_response import (
     SurveyResponse, SurveyResponseBase,
     SurveyResponseCreate, SurveyResponseUpdate,
-    SurveyResponseWithConversations
+    SurveyResponseWithConversations, SurveyResponseStats
 )
 
 # 问卷回答对话相关模型
@@ -49,11 +50,12 @@ __all__ = [
     # 问卷问题相关模型
     'SurveyQuestion', 'SurveyQuestionBase', 
     'SurveyQuestionCreate', 'SurveyQuestionUpdate',
+    'SurveyQuestionOrderUpdate',
     
     # 问卷回答相关模型
     'SurveyResponse', 'SurveyResponseBase',
     'SurveyResponseCreate', 'SurveyResponseUpdate',
-    'SurveyResponseWithConversations',
+    'SurveyResponseWithConversations', 'SurveyResponseStats',
     
     # 问卷回答对话相关模型
     'SurveyResponseConversation', 'SurveyResponseConversationBase',
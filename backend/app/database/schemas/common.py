@@ -19,6 +19,7 @@ class TableQueryResponse(BaseSchema):
     """表查询响应模型"""
     data: List[Dict[str, Any]]
     count: int
+    next_cursor: Optional[str] = None
 
 
 # 关系数据响应模型
@@ -2,7 +2,7 @@
 问卷问题相关数据模型
 """
 
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from pydantic import BaseModel
 
@@ -33,6 +33,11 @@ class SurveyQuestionUpdate(BaseModel):
     question_objectives: Optional[str] = None
 
 
+class SurveyQuestionOrderUpdate(BaseModel):
+    """重新排序问卷问题时使用的模型"""
+    question_ids: List[int]
+
+
 class SurveyQuestion(SurveyQuestionBase):
     """问卷问题完整模型，包含数据库返回的字段"""
     id: int
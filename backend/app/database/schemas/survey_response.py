@@ -2,7 +2,7 @@
 问卷回答相关数据模型
 """
 
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 from pydantic import BaseModel
 
@@ -31,6 +31,8 @@ class SurveyResponseUpdate(BaseModel):
 class SurveyResponse(SurveyResponseBase):
     """问卷回答完整模型，包含数据库返回的字段"""
     id: int
+    conversation_summary: Optional[str] = None
+    summary_through_order: Optional[int] = 0
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
@@ -40,4 +42,14 @@ class SurveyResponse(SurveyResponseBase):
 
 class SurveyResponseWithConversations(SurveyResponse):
     """包含对话列表的问卷回答模型"""
-    conversations: List[SurveyResponseConversation] = [] 
\ No newline at end of file
+    conversations: List[SurveyResponseConversation] = [] 
+
+
+class SurveyResponseStats(BaseModel):
+    """问卷回答统计"""
+    survey_id: int
+    total_responses: int = 0
+    status_counts: Dict[str, int] = {}
+    completed_responses: int = 0
+    completion_rate: float = 0.0
+    avg_turns: Optional[float] = None
@@ -1,5 +1,7 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from .config import get_supabase
+from .pagination import KEYSET_ID, InvalidCursorError, fetch_page
+from .embedding import apply_embeds, embed_select
 
 async def test_supabase_connection() -> bool:
     """
@@ -8,7 +10,7 @@ async def test_supabase_connection() -> bool:
     try:
         supabase = get_supabase()
         # 执行简单查询测试连接
-        response = supabase.table('cu_survey').select('id').limit(1).execute()
+        response = await supabase.table('cu_survey').select('id').limit(1).execute()
         return True
     except Exception as e:
         print(f"Supabase连接测试失败: {str(e)}")
@@ -27,7 +29,8 @@ async def get_database_tables_info() -> dict:
 async def query_table(table_name: str, select_fields: str = "*", 
                       filters: Dict[str, Any] = None, 
                       limit: int = 100, 
-                      offset: int = 0) -> List[Dict[str, Any]]:
+                      offset: int = 0,
+                      include: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """
     使用Supabase客户端查询数据
     
@@ -36,33 +39,82 @@ async def query_table(table_name: str, select_fields: str = "*",
     :param filters: 过滤条件
     :param limit: 限制返回的记录数
     :param offset: 跳过的记录数
+    :param include: 要嵌入的关联名，见 embedding.RELATIONS
     :return: 查询结果
     """
     try:
         supabase = get_supabase()
-        query = supabase.table(table_name).select(select_fields)
+        query = supabase.table(table_name).select(embed_select(table_name, select_fields, include or []))
+        query = apply_embeds(query, table_name, include or [])
         
         if filters:
             for key, value in filters.items():
                 query = query.eq(key, value)
         
-        result = query.limit(limit).offset(offset).execute()
+        result = await query.limit(limit).offset(offset).execute()
         return result.data
     except Exception as e:
         print(f"Supabase查询失败: {str(e)}")
         return []
 
 
-async def get_by_id(table_name: str, id: int, select_fields: str = "*") -> Optional[Dict[str, Any]]:
+async def query_table_page(table_name: str, select_fields: str = "*",
+                           filters: Dict[str, Any] = None,
+                           limit: int = 100,
+                           cursor: Optional[str] = None,
+                           order_by: str = KEYSET_ID,
+                           desc: bool = False,
+                           include: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    使用游标分页查询数据，排序稳定，深分页不会变慢
+    
+    :param table_name: 表名
+    :param select_fields: 要选择的字段，默认为 "*"，排序键字段会被自动加入
+    :param filters: 过滤条件
+    :param limit: 每页数量
+    :param cursor: 上一页返回的游标，None表示第一页
+    :param order_by: 排序键，"id" 或 "created_at"（按created_at, id排序）
+    :param desc: 是否降序
+    :param include: 要嵌入的关联名，见 embedding.RELATIONS
+    :return: (查询结果, 下一页游标)
+    :raises InvalidCursorError: 游标无效
+    """
+    if select_fields.strip() != "*":
+        fields = [f.strip() for f in select_fields.split(",")]
+        for key_field in ("id", order_by):
+            if key_field not in fields:
+                fields.append(key_field)
+        select_fields = ",".join(fields)
+    
+    try:
+        supabase = get_supabase()
+        query = supabase.table(table_name).select(embed_select(table_name, select_fields, include or []))
+        query = apply_embeds(query, table_name, include or [])
+        
+        if filters:
+            for key, value in filters.items():
+                query = query.eq(key, value)
+        
+        return await fetch_page(query, order_by, cursor, limit, desc)
+    except InvalidCursorError:
+        raise
+    except Exception as e:
+        print(f"Supabase查询失败: {str(e)}")
+        return [], None
+
+
+async def get_by_id(table_name: str, id: int, select_fields: str = "*",
+                    include: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
     """
     通过ID获取记录
     
     :param table_name: 表名
     :param id: 记录ID
     :param select_fields: 要选择的字段
+    :param include: 要嵌入的关联名，关联数据与记录在同一次请求中返回
     :return: 记录或None
     """
-    results = await query_table(table_name, select_fields, {"id": id}, 1, 0)
+    results = await query_table(table_name, select_fields, {"id": id}, 1, 0, include)
     return results[0] if results else None
 
 
@@ -0,0 +1,199 @@
+"""
+日志配置
+日志记录通过队列交给后台线程格式化和输出，请求处理线程只负责入队；
+热路径使用紧凑的结构化事件，完整载荷（提示词、请求体等）按采样率和长度上限记录
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Any, Callable, Dict, Optional, Union
+
+# 日志级别，可通过LOG_MODULE_LEVELS按模块覆盖，格式如 "app.services.llm_service=DEBUG,botocore=WARNING"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MODULE_LEVELS = os.environ.get("LOG_MODULE_LEVELS", "")
+# 输出格式: json 或 text
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# 日志队列容量，队列满时丢弃新日志而不是阻塞请求
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# 载荷采样率(0~1)，可通过LOG_PAYLOAD_MODULES按模块覆盖，格式同LOG_MODULE_LEVELS
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+LOG_PAYLOAD_MODULES = os.environ.get("LOG_PAYLOAD_MODULES", "")
+# 单条载荷最大字符数
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", "2000"))
+
+# 第三方库默认日志级别
+_LIBRARY_LEVELS = {
+    "boto3": "INFO",
+    "botocore": "INFO",
+    "urllib3": "INFO",
+    "httpx": "WARNING",
+    "httpcore": "WARNING",
+    "hpack": "WARNING",
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _parse_module_setting(value: str) -> Dict[str, str]:
+    """解析 "module=value,module=value" 格式的配置"""
+    result = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, setting = item.split("=", 1)
+            result[name.strip()] = setting.strip()
+    return result
+
+
+_payload_rates = {
+    name: float(rate) for name, rate in _parse_module_setting(LOG_PAYLOAD_MODULES).items()
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "event_fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式，事件字段以 key=value 形式附加在消息后"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "event_fields", None)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    非阻塞队列处理器
+
+    只在调用线程中合并消息参数，格式化和I/O都交给QueueListener所在的后台线程；
+    队列满时丢弃日志，不阻塞请求处理
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # 异常对象不能跨线程安全持有，在此处转换为文本
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def setup_logging() -> None:
+    """配置根日志器：队列处理器 + 后台输出线程，可重复调用"""
+    global _listener
+
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    levels = dict(_LIBRARY_LEVELS)
+    levels.update(_parse_module_setting(LOG_MODULE_LEVELS))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+
+def shutdown_logging() -> None:
+    """停止后台输出线程，输出队列中剩余的日志"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """
+    记录结构化事件
+
+    Args:
+        logger: 日志器
+        event: 事件名，如 "llm.stream.start"
+        level: 日志级别
+        **fields: 事件字段，应为简短的标量值
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"event_fields": fields})
+
+
+def _payload_rate(logger_name: str) -> float:
+    """获取日志器的载荷采样率，按模块名前缀匹配"""
+    name = logger_name
+    while name:
+        if name in _payload_rates:
+            return _payload_rates[name]
+        name = name.rpartition(".")[0]
+    return LOG_PAYLOAD_SAMPLE_RATE
+
+
+def log_payload(
+    logger: logging.Logger,
+    event: str,
+    payload: Union[Any, Callable[[], Any]],
+    **fields: Any
+) -> None:
+    """
+    按采样率记录完整载荷，超出长度上限的部分被截断
+
+    未被采样时不会序列化载荷；payload可以是返回载荷的函数，以便延迟构造
+
+    Args:
+        logger: 日志器
+        event: 事件名
+        payload: 载荷对象或返回载荷的函数
+        **fields: 事件字段
+    """
+    rate = _payload_rate(logger.name)
+    if rate <= 0 or not logger.isEnabledFor(logging.INFO) or random.random() >= rate:
+        return
+
+    if callable(payload):
+        payload = payload()
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+    truncated = len(text) > LOG_PAYLOAD_MAX_CHARS
+    fields["payload"] = text[:LOG_PAYLOAD_MAX_CHARS]
+    fields["payload_chars"] = len(text)
+    fields["payload_truncated"] = truncated
+    logger.info(event, extra={"event_fields": fields})
@@ -3,21 +3,14 @@ import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .api import api_router
+from .logging_config import setup_logging, shutdown_logging
 
-# 配置日志
-logging.basicConfig(
-    level=logging.DEBUG,  # 修改为DEBUG级别以显示更详细的日志
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # 输出到控制台
-    ]
-)
+# 配置日志：队列化、非阻塞输出，级别和载荷采样通过环境变量配置
+setup_logging()
 
-# 为了减少第三方库的噪音，单独设置一些库的日志级别
-logging.getLogger('boto3').setLevel(logging.INFO)
-logging.getLogger('botocore').setLevel(logging.INFO)
-logging.getLogger('urllib3').setLevel(logging.INFO)
+from .api import api_router
+from .database import close_supabase
+from .services.conversation_writer import conversation_writer
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +28,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # 游标分页的下一页游标
 )
 
 # 包含API路由
@@ -53,6 +47,12 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("应用关闭")
+    # 写完写后队列中剩余的对话消息
+    await conversation_writer.close()
+    # 关闭数据库连接池
+    await close_supabase()
+    # 输出剩余日志
+    shutdown_logging()
 
 # 根路由
 @app.get("/")
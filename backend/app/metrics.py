@@ -0,0 +1,294 @@
+"""
+运行指标
+进程内的Counter、Gauge、Histogram，按Prometheus文本格式导出
+"""
+
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# 默认直方图分桶(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    """转义标签值"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """格式化标签，如 {method="get",status="200"}"""
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """格式化数值"""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """指标基类"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值，也可以在导出时通过回调计算"""
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Dict[LabelValues, float]]] = None
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterable[str]:
+        values = dict(self._values)
+        if self._callback is not None:
+            values.update(self._callback())
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * len(self.buckets)
+            self._sums[key] = 0.0
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self._sums[key] += value
+
+    def samples(self) -> Iterable[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Timer:
+    """上下文管理器形式的计时器，退出时把耗时写入直方图"""
+
+    def __init__(self, histogram: Histogram, **labels: str):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标已注册: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Dict[LabelValues, float]]] = None
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """按Prometheus文本格式导出所有指标"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# 进程内共享的指标注册表
+REGISTRY = MetricsRegistry()
+
+# LLM指标
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds", "从发起LLM流式请求到收到第一个文本片段的时间",
+    ["model"], buckets=(0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 20.0)
+)
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "llm_tokens_per_second", "首个文本片段之后的输出速度(token/秒)",
+    ["model"], buckets=(5, 10, 20, 30, 40, 60, 80, 100, 150, 200, 300)
+)
+LLM_STREAM_DURATION = REGISTRY.histogram(
+    "llm_stream_duration_seconds", "LLM流式请求总耗时",
+    ["model"], buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+)
+LLM_REQUESTS = REGISTRY.counter("llm_requests_total", "LLM请求次数", ["model", "outcome"])
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM token用量", ["model", "kind"])
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    "llm_queue_wait_seconds", "LLM请求在调度队列中等待的时间",
+    ["model"], buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+)
+LLM_ADMISSIONS = REGISTRY.counter(
+    "llm_admissions_total", "LLM调度结果（admitted放行、rejected队列已满、timeout排队超时）", ["model", "outcome"]
+)
+
+# 数据库指标
+DB_QUERY_DURATION = REGISTRY.histogram(
+    "db_query_duration_seconds", "DAO方法耗时", ["dao", "method"]
+)
+DB_QUERY_ERRORS = REGISTRY.counter("db_query_errors_total", "DAO方法出错次数", ["dao", "method"])
+CONVERSATION_WRITE_BATCH_SIZE = REGISTRY.histogram(
+    "conversation_write_batch_size", "对话消息批量写入每批的消息数",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+CONVERSATION_WRITE_FAILURES = REGISTRY.counter(
+    "conversation_write_failures_total", "重试耗尽后放弃写入的对话消息数"
+)
+
+# SSE指标
+SSE_ACTIVE_STREAMS = REGISTRY.gauge("sse_active_streams", "进行中的SSE流数量", ["endpoint"])
+SSE_STREAMS = REGISTRY.counter("sse_streams_total", "已建立的SSE流数量", ["endpoint"])
+SSE_CLIENT_DISCONNECTS = REGISTRY.counter(
+    "sse_client_disconnects_total", "SSE流完成前客户端断开的次数", ["endpoint"]
+)
+SSE_EVENTS = REGISTRY.counter("sse_events_total", "发送的SSE事件数（合并后的帧）", ["endpoint"])
+SSE_CHUNKS = REGISTRY.counter("sse_chunks_total", "合并前收到的文本片段数", ["endpoint"])
+CHAT_TURNS = REGISTRY.counter(
+    "chat_turns_total", "对话轮次请求数，按新开始、排队和复用进行中的相同轮次区分", ["endpoint", "outcome"]
+)
+SSE_RESUMES = REGISTRY.counter(
+    "sse_resumes_total", "携带Last-Event-ID的重连请求数，按是否能从缓冲区续传区分", ["endpoint", "outcome"]
+)
+
+# 缓存指标，导出时从各缓存读取
+_cache_sources: Dict[str, Callable[[], Tuple[int, int]]] = {}
+
+
+def register_cache(name: str, stats: Callable[[], Tuple[int, int]]) -> None:
+    """
+    注册缓存的命中统计
+
+    Args:
+        name: 缓存名称
+        stats: 返回(命中次数, 未命中次数)的函数
+    """
+    _cache_sources[name] = stats
+
+
+def _cache_values(index: int) -> Dict[LabelValues, float]:
+    return {(name, ): float(stats()[index]) for name, stats in _cache_sources.items()}
+
+
+def _cache_hit_ratios() -> Dict[LabelValues, float]:
+    result = {}
+    for name, stats in _cache_sources.items():
+        hits, misses = stats()
+        total = hits + misses
+        result[(name, )] = hits / total if total else 0.0
+    return result
+
+
+REGISTRY.gauge("cache_hits", "缓存命中次数", ["cache"], callback=lambda: _cache_values(0))
+REGISTRY.gauge("cache_misses", "缓存未命中次数", ["cache"], callback=lambda: _cache_values(1))
+REGISTRY.gauge("cache_hit_ratio", "缓存命中率", ["cache"], callback=_cache_hit_ratios)
@@ -0,0 +1,154 @@
+"""
+对话上下文缓存
+按回答ID缓存问卷ID、问题列表、渲染好的提示词和对话历史，
+使每轮对话无需重复读取回答记录、问题列表和完整历史
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from ..metrics import register_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 最多缓存的对话数量
+CONVERSATION_CONTEXT_CACHE_SIZE = int(os.environ.get("CONVERSATION_CONTEXT_CACHE_SIZE", "5000"))
+# 缓存有效期(秒)，多worker部署时限制其他进程写入造成的历史不一致时间
+CONVERSATION_CONTEXT_TTL = float(os.environ.get("CONVERSATION_CONTEXT_TTL", "600"))
+
+
+class ConversationContext:
+    """单个问卷回答的对话上下文"""
+
+    def __init__(
+        self,
+        response_id: int,
+        survey_id: int,
+        questions: List[Dict[str, Any]],
+        prompt: str,
+        history: List[Dict[str, Any]],
+        conversation_summary: Optional[str] = None,
+        summary_through_order: int = 0
+    ):
+        self.response_id = response_id
+        self.survey_id = survey_id
+        self.questions = questions
+        self.prompt = prompt
+        self.history = history
+        self.conversation_summary = conversation_summary
+        self.summary_through_order = summary_through_order
+        self.loaded_at = time.monotonic()
+
+    @property
+    def has_messages(self) -> bool:
+        """是否已有对话（包括已折叠进摘要的对话）"""
+        return bool(self.history) or self.summary_through_order > 0
+
+    def append_message(self, speaker_type: str, message: str, conversation_order: int) -> None:
+        """追加一条已保存的消息到内存历史"""
+        role = "user" if speaker_type == "user" else "assistant"
+        self.history.append({"role": role, "content": message, "order": conversation_order})
+
+    def apply_summary(self, summary: str, through_order: int) -> None:
+        """更新滚动摘要，并从内存历史中移除已被摘要覆盖的消息"""
+        if through_order <= self.summary_through_order:
+            return
+        self.conversation_summary = summary
+        self.summary_through_order = through_order
+        self.history = [m for m in self.history if m.get("order", 0) > through_order]
+
+
+class ConversationContextCache:
+    """
+    对话上下文缓存
+
+    LRU淘汰，超过TTL的条目视为失效。问卷问题被修改时按问卷ID整体失效。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CONVERSATION_CONTEXT_CACHE_SIZE,
+        ttl_seconds: float = CONVERSATION_CONTEXT_TTL
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, ConversationContext]" = OrderedDict()
+        self._survey_index: Dict[int, Set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, response_id: int) -> Optional[ConversationContext]:
+        """
+        获取缓存的对话上下文
+
+        Args:
+            response_id: 回答ID
+
+        Returns:
+            对话上下文，未命中或已过期时返回None
+        """
+        context = self._entries.get(response_id)
+        if context is None or time.monotonic() - context.loaded_at > self.ttl_seconds:
+            if context is not None:
+                self.invalidate(response_id)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(response_id)
+        self.hits += 1
+        return context
+
+    def put(self, context: ConversationContext) -> None:
+        """放入对话上下文"""
+        self.invalidate(context.response_id)
+        self._entries[context.response_id] = context
+        self._survey_index.setdefault(context.survey_id, set()).add(context.response_id)
+
+        while len(self._entries) > self.max_entries:
+            response_id, evicted = self._entries.popitem(last=False)
+            self._unindex(response_id, evicted.survey_id)
+
+    def append_message(self, response_id: int, speaker_type: str, message: str, conversation_order: int) -> None:
+        """
+        向缓存的对话历史追加消息，未缓存时忽略
+
+        Args:
+            response_id: 回答ID
+            speaker_type: 发言者类型
+            message: 消息内容
+            conversation_order: 消息的对话顺序号
+        """
+        context = self._entries.get(response_id)
+        if context is not None:
+            context.append_message(speaker_type, message, conversation_order)
+
+    def invalidate(self, response_id: int) -> None:
+        """使单个回答的上下文失效"""
+        context = self._entries.pop(response_id, None)
+        if context is not None:
+            self._unindex(response_id, context.survey_id)
+
+    def invalidate_survey(self, survey_id: int) -> None:
+        """使某个问卷下所有回答的上下文失效，在问卷问题变更时调用"""
+        response_ids = self._survey_index.pop(survey_id, set())
+        for response_id in response_ids:
+            self._entries.pop(response_id, None)
+        if response_ids:
+            logger.info(f"问卷问题已变更，清除{len(response_ids)}个对话上下文缓存: survey_id={survey_id}")
+
+    def _unindex(self, response_id: int, survey_id: int) -> None:
+        """从问卷索引中移除回答"""
+        response_ids = self._survey_index.get(survey_id)
+        if response_ids is not None:
+            response_ids.discard(response_id)
+            if not response_ids:
+                del self._survey_index[survey_id]
+
+
+# 进程内共享的对话上下文缓存
+conversation_context_cache = ConversationContextCache()
+register_cache("conversation_context", lambda: (conversation_context_cache.hits, conversation_context_cache.misses))
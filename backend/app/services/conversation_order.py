@@ -0,0 +1,90 @@
+"""
+对话顺序号分配器
+在进程内为每个问卷回答缓存下一个conversation_order，保存消息时无需重新读取对话历史
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict
+
+from ..database.dao import SurveyResponseConversationDAO
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 最多缓存的回答数量，超出后淘汰最久未使用的计数器
+CONVERSATION_ORDER_CACHE_SIZE = int(os.environ.get("CONVERSATION_ORDER_CACHE_SIZE", "10000"))
+
+
+class ConversationOrderAllocator:
+    """
+    按回答ID分配对话顺序号
+
+    首次分配时从数据库读取当前最大顺序号（只读一行），之后在内存中递增。
+    同一回答的分配通过锁串行化，保证进程内不会分配出重复的顺序号；
+    跨进程的重复由数据库唯一索引兜底，冲突时调用reset重新从数据库同步。
+    """
+
+    def __init__(self, max_entries: int = CONVERSATION_ORDER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._next_orders: "OrderedDict[int, int]" = OrderedDict()
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    async def allocate(self, response_id: int) -> int:
+        """
+        分配下一个对话顺序号
+
+        Args:
+            response_id: 回答ID
+
+        Returns:
+            新的conversation_order
+        """
+        lock = self._locks.setdefault(response_id, asyncio.Lock())
+        async with lock:
+            next_order = self._next_orders.get(response_id)
+            if next_order is None:
+                next_order = await SurveyResponseConversationDAO.get_max_order(response_id) + 1
+                logger.debug(f"从数据库同步对话顺序号: response_id={response_id}, next_order={next_order}")
+
+            self._next_orders[response_id] = next_order + 1
+            self._next_orders.move_to_end(response_id)
+            self._evict()
+            return next_order
+
+    def seed(self, response_id: int, next_order: int) -> None:
+        """
+        已知下一个顺序号时（如刚从数据库加载了完整的对话历史）直接设置计数器，
+        首次分配时不再读取数据库；已有计数器时不覆盖
+
+        Args:
+            response_id: 回答ID
+            next_order: 下一个conversation_order
+        """
+        if response_id in self._next_orders:
+            return
+        self._next_orders[response_id] = next_order
+        self._evict()
+
+    def reset(self, response_id: int) -> None:
+        """
+        丢弃缓存的计数器，下次分配时重新从数据库同步
+
+        Args:
+            response_id: 回答ID
+        """
+        self._next_orders.pop(response_id, None)
+
+    def _evict(self) -> None:
+        """淘汰最久未使用的计数器"""
+        while len(self._next_orders) > self.max_entries:
+            response_id, _ = self._next_orders.popitem(last=False)
+            lock = self._locks.get(response_id)
+            if lock is not None and not lock.locked():
+                del self._locks[response_id]
+
+
+# 进程内共享的分配器实例
+conversation_order_allocator = ConversationOrderAllocator()
@@ -0,0 +1,322 @@
+"""
+对话消息写后(write-behind)持久化
+消息入队时立即分配顺序号并返回，后台任务把一段时间内的消息合并成一条INSERT批量写入，
+高峰期每轮对话不再各自触发数据库写入
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from ..database.async_client import APIError
+from ..database.dao import SurveyResponseConversationDAO
+from ..metrics import CONVERSATION_WRITE_BATCH_SIZE, CONVERSATION_WRITE_FAILURES, REGISTRY
+from .conversation_order import conversation_order_allocator
+from .conversation_context import conversation_context_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 每批最多写入的消息数
+CONVERSATION_WRITE_BATCH = int(os.environ.get("CONVERSATION_WRITE_BATCH", "200"))
+# 收到第一条消息后最多等待多久再写入(秒)，用于攒批
+CONVERSATION_WRITE_INTERVAL = float(os.environ.get("CONVERSATION_WRITE_INTERVAL", "0.05"))
+# 写入失败的最大重试次数
+CONVERSATION_WRITE_MAX_RETRIES = int(os.environ.get("CONVERSATION_WRITE_MAX_RETRIES", "5"))
+# 重试退避的初始间隔(秒)，每次翻倍
+CONVERSATION_WRITE_RETRY_BACKOFF = float(os.environ.get("CONVERSATION_WRITE_RETRY_BACKOFF", "0.2"))
+
+# PostgreSQL唯一约束冲突错误码
+UNIQUE_VIOLATION = "23505"
+
+
+class ConversationSaveError(Exception):
+    """本轮对话消息未能写入数据库，消息可以直接展示给用户"""
+
+
+class _PendingMessage:
+    """等待写入的消息"""
+
+    __slots__ = ("row", "future")
+
+    def __init__(self, row: Dict[str, Any], future: "asyncio.Future[None]"):
+        self.row = row
+        self.future = future
+
+    @property
+    def response_id(self) -> int:
+        return self.row["survey_response_id"]
+
+
+class ConversationWriter:
+    """
+    对话消息写后队列
+
+    enqueue在入队时通过顺序号分配器确定conversation_order，并生成client_message_id，
+    同一回答的消息顺序在入队时就已固定，与实际写入的先后无关。后台任务按入队顺序取出消息，
+    合并为一条INSERT写入；写入失败的批次在独立的任务中按指数退避重试，不阻塞其他批次的写入。
+    写入按client_message_id跳过已存在的行，
+    超时等结果不明确的失败后重试不会重复插入已提交的消息，因此顺序号唯一约束冲突只可能来自
+    其他进程写入的消息，此时为冲突回答重新分配顺序号后重写。重试耗尽放弃写入时，
+    丢弃相关回答缓存的对话上下文和顺序号计数器，之后从数据库重新同步，不会基于未保存的消息继续对话。
+    flush等待指定回答（或全部）已入队的消息写完，close在应用关闭时写完剩余消息。
+    """
+
+    def __init__(
+        self,
+        batch_size: int = CONVERSATION_WRITE_BATCH,
+        interval: float = CONVERSATION_WRITE_INTERVAL,
+        max_retries: int = CONVERSATION_WRITE_MAX_RETRIES,
+        retry_backoff: float = CONVERSATION_WRITE_RETRY_BACKOFF
+    ):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue: Deque[_PendingMessage] = deque()
+        self._unsaved: Dict[int, Set["asyncio.Future[None]"]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_now: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._retries: Set[asyncio.Task] = set()
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """尚未写入成功的消息数"""
+        return sum(len(futures) for futures in self._unsaved.values())
+
+    async def enqueue(self, response_id: int, speaker_type: str, message: str) -> int:
+        """
+        分配顺序号并把消息加入写入队列，同时追加到缓存的对话历史
+
+        Args:
+            response_id: 回答ID
+            speaker_type: 发言者类型
+            message: 消息内容
+
+        Returns:
+            消息的conversation_order
+        """
+        if self._closed:
+            raise RuntimeError("对话写入队列已关闭")
+
+        conversation_order = await conversation_order_allocator.allocate(response_id)
+        # 以入队时间作为消息时间，而不是实际写入时间
+        now = datetime.now(timezone.utc).isoformat()
+        row = {
+            "survey_response_id": response_id,
+            "speaker_type": speaker_type,
+            "message_text": message,
+            "conversation_order": conversation_order,
+            "client_message_id": str(uuid.uuid4()),
+            "created_at": now,
+            "updated_at": now
+        }
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._unsaved.setdefault(response_id, set()).add(future)
+        future.add_done_callback(lambda f: self._forget(response_id, f))
+        self._queue.append(_PendingMessage(row, future))
+
+        conversation_context_cache.append_message(response_id, speaker_type, message, conversation_order)
+        self._ensure_worker()
+        self._wakeup.set()
+        if len(self._queue) >= self.batch_size:
+            self._flush_now.set()
+        return conversation_order
+
+    async def flush(self, response_id: Optional[int] = None) -> bool:
+        """
+        立即写入并等待已入队的消息写完
+
+        Args:
+            response_id: 只等待该回答的消息，None表示等待全部
+
+        Returns:
+            消息是否全部写入成功
+        """
+        if response_id is None:
+            futures = [f for group in self._unsaved.values() for f in group]
+        else:
+            futures = list(self._unsaved.get(response_id, ()))
+        if not futures:
+            return True
+        self._flush_now.set()
+        results = await asyncio.gather(*[asyncio.shield(f) for f in futures], return_exceptions=True)
+        return not any(isinstance(r, BaseException) for r in results)
+
+    async def close(self) -> None:
+        """停止接收新消息，写完队列中剩余的消息并等待重试结束后停止后台任务"""
+        self._closed = True
+        if self._worker is None:
+            return
+        if self._queue:
+            logger.info(f"应用关闭，写入剩余的{len(self._queue)}条对话消息")
+        self._flush_now.set()
+        self._wakeup.set()
+        await self._worker
+        self._worker = None
+        while self._retries:
+            await asyncio.gather(*list(self._retries), return_exceptions=True)
+
+    def _forget(self, response_id: int, future: "asyncio.Future[None]") -> None:
+        futures = self._unsaved.get(response_id)
+        if futures is not None:
+            futures.discard(future)
+            if not futures:
+                del self._unsaved[response_id]
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._flush_now = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        """后台写入循环"""
+        while True:
+            if not self._queue:
+                if self._closed:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # 等待一小段时间攒批，队列满、有flush请求或正在关闭时立即写入
+            if not self._flush_now.is_set() and not self._closed:
+                try:
+                    await asyncio.wait_for(self._flush_now.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._flush_now.clear()
+
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logger.error(f"写入对话消息出现未处理的错误: {str(e)}")
+                self._fail(batch, e)
+
+    async def _write(self, batch: List[_PendingMessage], attempt: int = 0) -> None:
+        """
+        写入一批消息；顺序号冲突时立即重写，其他失败安排在后台退避重试
+
+        Args:
+            batch: 消息列表
+            attempt: 已失败的次数
+        """
+        while batch:
+            error: Optional[Exception] = None
+            try:
+                await SurveyResponseConversationDAO.insert_rows([m.row for m in batch])
+                CONVERSATION_WRITE_BATCH_SIZE.observe(len(batch))
+                self._succeed(batch)
+                return
+            except APIError as e:
+                if e.code == UNIQUE_VIOLATION:
+                    # 其他进程占用了顺序号，批量INSERT整体回滚；按回答分别写入，只为冲突的回答重新分配顺序号
+                    batch, error = await self._write_by_response(batch)
+                else:
+                    error = e
+            except Exception as e:
+                error = e
+
+            if not batch:
+                return
+            attempt += 1
+            if attempt > self.max_retries:
+                logger.error(f"写入{len(batch)}条对话消息失败，已重试{self.max_retries}次，放弃: {str(error)}")
+                CONVERSATION_WRITE_FAILURES.inc(len(batch))
+                self._fail(batch, error or RuntimeError("对话顺序号持续冲突"))
+                return
+            if error is not None:
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(f"写入{len(batch)}条对话消息失败，{delay:.1f}秒后第{attempt}次重试: {str(error)}")
+                task = asyncio.ensure_future(self._retry(batch, attempt, delay))
+                self._retries.add(task)
+                task.add_done_callback(self._retries.discard)
+                return
+
+    async def _retry(self, batch: List[_PendingMessage], attempt: int, delay: float) -> None:
+        """等待退避时间后重新写入失败的批次"""
+        await asyncio.sleep(delay)
+        try:
+            await self._write(batch, attempt)
+        except Exception as e:
+            logger.error(f"重试写入对话消息出现未处理的错误: {str(e)}")
+            self._fail(batch, e)
+
+    async def _write_by_response(
+        self,
+        batch: List[_PendingMessage]
+    ) -> Tuple[List[_PendingMessage], Optional[Exception]]:
+        """
+        按回答分别写入
+
+        Args:
+            batch: 消息列表
+
+        Returns:
+            (仍需写入的消息, 顺序号冲突以外的错误)
+        """
+        groups: Dict[int, List[_PendingMessage]] = {}
+        for message in batch:
+            groups.setdefault(message.response_id, []).append(message)
+
+        retry: List[_PendingMessage] = []
+        error: Optional[Exception] = None
+        for response_id, messages in groups.items():
+            try:
+                await SurveyResponseConversationDAO.insert_rows([m.row for m in messages])
+                CONVERSATION_WRITE_BATCH_SIZE.observe(len(messages))
+                self._succeed(messages)
+            except APIError as e:
+                if e.code == UNIQUE_VIOLATION:
+                    await self._reassign_orders(response_id, messages)
+                else:
+                    error = e
+                retry.extend(messages)
+            except Exception as e:
+                error = e
+                retry.extend(messages)
+        return retry, error
+
+    async def _reassign_orders(self, response_id: int, messages: List[_PendingMessage]) -> None:
+        """其他进程已占用顺序号，从数据库重新同步后按原顺序为该回答的未写入消息重新分配"""
+        logger.warning(f"对话顺序号冲突: response_id={response_id}，重新分配{len(messages)}条消息的顺序号")
+        conversation_order_allocator.reset(response_id)
+        # 内存中的对话历史也已过期
+        conversation_context_cache.invalidate(response_id)
+        queued = [m for m in self._queue if m.response_id == response_id]
+        for message in messages + queued:
+            message.row["conversation_order"] = await conversation_order_allocator.allocate(response_id)
+
+    @staticmethod
+    def _succeed(messages: List[_PendingMessage]) -> None:
+        for message in messages:
+            if not message.future.done():
+                message.future.set_result(None)
+
+    def _fail(self, messages: List[_PendingMessage], error: BaseException) -> None:
+        for message in messages:
+            if not message.future.done():
+                message.future.set_exception(error)
+                # 没有flush等待时避免"exception was never retrieved"警告
+                message.future.exception()
+        # 缓存的对话历史和顺序号计数器包含了未保存的消息，丢弃后从数据库重新同步
+        for response_id in {m.response_id for m in messages}:
+            conversation_order_allocator.reset(response_id)
+            conversation_context_cache.invalidate(response_id)
+            logger.warning(f"对话消息未能保存，丢弃缓存的对话上下文: response_id={response_id}")
+
+
+# 进程内共享的对话写入队列
+conversation_writer = ConversationWriter()
+REGISTRY.gauge(
+    "conversation_write_pending", "尚未写入数据库的对话消息数",
+    callback=lambda: {(): float(conversation_writer.pending)}
+)
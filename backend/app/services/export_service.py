@@ -0,0 +1,186 @@
+"""
+问卷访谈记录导出服务
+按游标分页从数据库分批读取回答及其对话，逐块编码为NDJSON或CSV写出，
+下一页数据在写出当前页时预取，内存占用只与页大小有关，与导出总量无关
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..database.dao import SurveyResponseDAO, SurveyResponseConversationDAO
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 每批读取的回答数量
+EXPORT_RESPONSE_PAGE_SIZE = int(os.environ.get("EXPORT_RESPONSE_PAGE_SIZE", "100"))
+# 每页读取的对话数量
+EXPORT_CONVERSATION_PAGE_SIZE = int(os.environ.get("EXPORT_CONVERSATION_PAGE_SIZE", "1000"))
+# 累积到该字节数后再写出一次
+EXPORT_CHUNK_BYTES = int(os.environ.get("EXPORT_CHUNK_BYTES", str(64 * 1024)))
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+# 导出的对话字段
+CONVERSATION_FIELDS = "id,survey_response_id,speaker_type,message_text,conversation_order,created_at"
+
+# CSV每行对应一条对话消息
+CSV_COLUMNS = [
+    "response_id", "respondent_identifier", "response_status", "response_created_at",
+    "conversation_order", "speaker_type", "message_text", "message_created_at"
+]
+
+# CSV导出中途出错时，错误行第一列的内容
+EXPORT_ERROR_MARKER = "#ERROR"
+
+Page = Tuple[List[Dict[str, Any]], Optional[str]]
+
+
+async def _prefetch_pages(fetch: Callable[[Optional[str]], Awaitable[Page]]) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """
+    依次产出分页结果，在调用方处理当前页时预取下一页
+
+    Args:
+        fetch: 接收游标、返回(本页数据, 下一页游标)的函数
+    """
+    task: Optional[asyncio.Future] = asyncio.ensure_future(fetch(None))
+    try:
+        while task is not None:
+            rows, cursor = await task
+            task = asyncio.ensure_future(fetch(cursor)) if cursor else None
+            yield rows
+    finally:
+        if task is not None:
+            task.cancel()
+
+
+class SurveyExportService:
+    """问卷访谈记录导出服务"""
+
+    @staticmethod
+    async def iter_transcripts(
+        survey_id: int,
+        status: Optional[str] = None
+    ) -> AsyncGenerator[Tuple[Dict[str, Any], List[Dict[str, Any]]], None]:
+        """
+        按回答ID顺序产出每个回答及其按对话顺序排列的对话
+
+        Args:
+            survey_id: 问卷ID
+            status: 回答状态过滤
+
+        Returns:
+            异步生成器，产出(回答原始数据, 对话原始数据列表)
+        """
+        response_pages = _prefetch_pages(
+            lambda cursor: SurveyResponseDAO.get_raw_page_by_survey_id(
+                survey_id, EXPORT_RESPONSE_PAGE_SIZE, cursor, status
+            )
+        )
+        try:
+            async for responses in response_pages:
+                if not responses:
+                    continue
+                response_ids = [r["id"] for r in responses]
+                conversations = _prefetch_pages(
+                    lambda cursor: SurveyResponseConversationDAO.get_raw_page_by_response_ids(
+                        response_ids, EXPORT_CONVERSATION_PAGE_SIZE, cursor, CONVERSATION_FIELDS
+                    )
+                )
+                try:
+                    # 回答和对话都按回答ID升序，归并即可得到每个回答的完整对话
+                    buffered: List[Dict[str, Any]] = []
+                    async for page in conversations:
+                        buffered.extend(page)
+                        while responses and buffered and buffered[-1]["survey_response_id"] != responses[0]["id"]:
+                            response = responses.pop(0)
+                            split = 0
+                            while split < len(buffered) and buffered[split]["survey_response_id"] == response["id"]:
+                                split += 1
+                            yield response, buffered[:split]
+                            buffered = buffered[split:]
+                    for response in responses:
+                        messages = [m for m in buffered if m["survey_response_id"] == response["id"]]
+                        yield response, messages
+                finally:
+                    await conversations.aclose()
+        finally:
+            await response_pages.aclose()
+
+    @staticmethod
+    async def stream_export(
+        survey_id: int,
+        export_format: str = "ndjson",
+        status: Optional[str] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        以NDJSON或CSV流式导出问卷的全部访谈记录
+
+        NDJSON每行一个回答及其对话列表；CSV每行一条对话消息，没有对话的回答输出一行空消息。
+        中途出错时写出错误标记（NDJSON为error对象，CSV为首列EXPORT_ERROR_MARKER的一行）后抛出异常，中止传输
+
+        Args:
+            survey_id: 问卷ID
+            export_format: 导出格式，ndjson或csv
+            status: 回答状态过滤
+
+        Returns:
+            异步生成器，产出编码后的数据块
+        """
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {export_format}")
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == "csv" else None
+        if writer is not None:
+            # 带BOM，便于Excel正确识别UTF-8编码的中文
+            buffer.write("\ufeff")
+            writer.writerow(CSV_COLUMNS)
+
+        response_count = 0
+        message_count = 0
+        logger.info(f"开始导出问卷访谈记录: survey_id={survey_id}, 格式={export_format}")
+        try:
+            async for response, messages in SurveyExportService.iter_transcripts(survey_id, status):
+                response_count += 1
+                message_count += len(messages)
+                if writer is None:
+                    buffer.write(json.dumps(
+                        {"response": response, "conversations": messages},
+                        ensure_ascii=False, default=str
+                    ))
+                    buffer.write("\n")
+                else:
+                    prefix = [
+                        response["id"], response.get("respondent_identifier"),
+                        response.get("status"), response.get("created_at")
+                    ]
+                    for message in messages or [{}]:
+                        writer.writerow(prefix + [
+                            message.get("conversation_order"), message.get("speaker_type"),
+                            message.get("message_text"), message.get("created_at")
+                        ])
+
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+        except Exception as e:
+            # 响应头已经发出：先在数据末尾写入错误标记，再向上抛出异常中止传输，
+            # 下载方看到的是失败的下载，而不是一个看起来完整、实际被截断的文件
+            logger.error(f"导出问卷访谈记录出错: survey_id={survey_id}, 已导出{response_count}个回答, 错误: {str(e)}")
+            if writer is None:
+                buffer.write(json.dumps({"error": f"导出中断: {str(e)}"}, ensure_ascii=False) + "\n")
+            else:
+                writer.writerow([EXPORT_ERROR_MARKER] + [""] * (len(CSV_COLUMNS) - 3) + [f"导出中断: {str(e)}", ""])
+            yield buffer.getvalue().encode("utf-8")
+            raise
+
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+        logger.info(f"问卷访谈记录导出完成: survey_id={survey_id}, 回答数={response_count}, 消息数={message_count}")
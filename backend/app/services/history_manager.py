@@ -0,0 +1,168 @@
+"""
+对话历史管理
+按token预算截取最近的对话发送给LLM，较早的对话折叠进滚动摘要并保存到数据库，
+使每轮请求的大小不随访谈长度增长
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..database.dao import SurveyResponseDAO
+from .conversation_context import ConversationContext
+from .llm_service import LLMProvider, llm_scheduler, model_id_of
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 发送给LLM的对话历史token预算
+LLM_HISTORY_TOKEN_BUDGET = int(os.environ.get("LLM_HISTORY_TOKEN_BUDGET", "6000"))
+# 无论预算如何都保留的最近消息数量
+LLM_HISTORY_MIN_RECENT_MESSAGES = int(os.environ.get("LLM_HISTORY_MIN_RECENT_MESSAGES", "4"))
+
+SUMMARY_PROMPT = """
+你负责为调查问卷访谈生成摘要。请根据已有摘要和新增的对话记录，输出一份更新后的完整摘要：
+
+1. 按问题顺序记录受访者对每个已提问问题的回答要点，保留具体事实和数字。
+2. 注明当前进行到第几个问题，以及是否有尚未回答完的问题。
+3. 只输出摘要本身，不要添加额外说明。
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数：中日韩字符按每字1个token，其余按每4个字符1个token
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    wide = sum(1 for ch in text if ord(ch) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _message_tokens(message: Dict[str, Any]) -> int:
+    """获取消息的token估算值，计算结果缓存在消息上"""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(message.get("content", "")) + 4
+        message["tokens"] = tokens
+    return tokens
+
+
+class HistoryManager:
+    """
+    对话历史管理器
+
+    build_window在请求前同步执行，只做截取，不访问数据库或LLM；
+    摘要在回复保存后于后台生成，不占用当前轮次的响应时间。
+    """
+
+    def __init__(
+        self,
+        llm_provider: LLMProvider,
+        token_budget: int = LLM_HISTORY_TOKEN_BUDGET,
+        min_recent_messages: int = LLM_HISTORY_MIN_RECENT_MESSAGES
+    ):
+        self.llm_provider = llm_provider
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self._summarizing: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _split(self, messages: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """从最新消息向前累计，返回(超出预算的较早消息, 预算内的最近消息)"""
+        total = 0
+        start = len(messages)
+        while start > 0:
+            tokens = _message_tokens(messages[start - 1])
+            kept = len(messages) - start
+            if kept >= self.min_recent_messages and total + tokens > budget:
+                break
+            total += tokens
+            start -= 1
+        return messages[:start], messages[start:]
+
+    def build_window(self, context: ConversationContext) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """
+        构建本轮发送给LLM的摘要和最近对话
+
+        Args:
+            context: 对话上下文
+
+        Returns:
+            (对话摘要, 预算内的最近对话)
+        """
+        unsummarized = [
+            m for m in context.history
+            if m.get("order", 0) > context.summary_through_order
+        ]
+        dropped, window = self._split(unsummarized, self.token_budget)
+        if dropped:
+            # 摘要尚未追上时丢弃最早的消息，保证请求大小有上限
+            logger.info(f"对话历史超出token预算，本轮省略{len(dropped)}条尚未摘要的消息: response_id={context.response_id}")
+        return context.conversation_summary, window
+
+    def schedule_summarization(self, context: ConversationContext) -> None:
+        """
+        未摘要的对话超出预算时，在后台把较早的对话折叠进摘要
+
+        Args:
+            context: 对话上下文
+        """
+        if context.response_id in self._summarizing:
+            return
+
+        unsummarized = [
+            m for m in context.history
+            if m.get("order", 0) > context.summary_through_order
+        ]
+        if sum(_message_tokens(m) for m in unsummarized) <= self.token_budget:
+            return
+
+        # 折叠到预算的一半，避免此后每一轮都触发摘要
+        older, _ = self._split(unsummarized, self.token_budget // 2)
+        if not older:
+            return
+
+        self._summarizing.add(context.response_id)
+        task = asyncio.create_task(self._summarize(context, older))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, context: ConversationContext, older: List[Dict[str, Any]]) -> None:
+        """生成新的滚动摘要，保存到数据库并更新内存上下文"""
+        response_id = context.response_id
+        try:
+            transcript = "\n".join(
+                f"{'受访者' if m['role'] == 'user' else '访谈者'}: {m['content']}" for m in older
+            )
+            content = f"已有摘要：\n{context.conversation_summary or '无'}\n\n新增对话：\n{transcript}"
+            # 摘要调用与对话共用调度器的并发额度
+            permit = await llm_scheduler.acquire(model_id_of(self.llm_provider))
+            throttled = False
+            try:
+                result = await self.llm_provider.generate(
+                    SUMMARY_PROMPT,
+                    [{"role": "user", "content": content}],
+                    max_tokens=1024,
+                    temperature=0
+                )
+                throttled = bool(result.metadata.get("throttled"))
+            finally:
+                permit.release(throttled=throttled)
+            if not result.text or result.text.startswith("错误:"):
+                logger.warning(f"生成对话摘要失败: response_id={response_id}, 结果: {result.text[:100]}")
+                return
+
+            through_order = older[-1]["order"]
+            await SurveyResponseDAO.update_summary(response_id, result.text, through_order)
+            context.apply_summary(result.text, through_order)
+            logger.info(f"对话摘要已更新: response_id={response_id}, 覆盖至order={through_order}, 摘要长度={len(result.text)}")
+        except Exception as e:
+            logger.error(f"生成对话摘要出错: response_id={response_id}, 错误: {str(e)}")
+        finally:
+            self._summarizing.discard(response_id)
@@ -7,14 +7,85 @@ import json
 import os
 import logging
 import asyncio
+import threading
+import time
+import concurrent.futures
 from abc import ABC, abstractmethod
-from typing import Dict, Any, AsyncGenerator, List, Optional
+from functools import partial
+from collections import deque
+from typing import Dict, Any, AsyncGenerator, Callable, Deque, Iterator, List, Optional, Tuple
 import boto3
+from botocore.config import Config
 from pydantic import BaseModel
 
+from ..logging_config import log_event, log_payload
+from ..metrics import (
+    LLM_ADMISSIONS, LLM_QUEUE_WAIT, LLM_REQUESTS, LLM_STREAM_DURATION, LLM_TIME_TO_FIRST_TOKEN,
+    LLM_TOKENS, LLM_TOKENS_PER_SECOND, REGISTRY
+)
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 流式调用相关配置
+# 每个进行中的流会占用一个工作线程，线程数决定单个worker可同时服务的流数量
+LLM_STREAM_MAX_WORKERS = int(os.environ.get("LLM_STREAM_MAX_WORKERS", "256"))
+# 工作线程与事件循环之间的有界队列大小，队列满时工作线程阻塞等待（背压）
+LLM_STREAM_QUEUE_SIZE = int(os.environ.get("LLM_STREAM_QUEUE_SIZE", "64"))
+
+# Bedrock阻塞调用专用线程池，避免阻塞事件循环或占满默认线程池
+_llm_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=LLM_STREAM_MAX_WORKERS,
+    thread_name_prefix="bedrock-llm"
+)
+
+# 调度相关配置
+# 单个worker同时进行的LLM调用数上限
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "64"))
+# 每个模型的并发上限，形如"model_a=32,model_b=8"，未配置的模型使用全局上限
+LLM_MODEL_CONCURRENCY = os.environ.get("LLM_MODEL_CONCURRENCY", "")
+# 排队等待的请求数上限，超过后立即拒绝
+LLM_QUEUE_MAX = int(os.environ.get("LLM_QUEUE_MAX", "256"))
+# 排队时间预算(秒)，超过后拒绝
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "10"))
+# 拒绝时建议客户端重试的间隔(秒)，作为Retry-After响应头
+LLM_RETRY_AFTER = int(os.environ.get("LLM_RETRY_AFTER", "5"))
+# 是否根据限流情况自适应调整每个模型的并发上限
+LLM_ADAPTIVE_CONCURRENCY = os.environ.get("LLM_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+# 自适应调整时并发上限的下限
+LLM_MIN_CONCURRENCY = int(os.environ.get("LLM_MIN_CONCURRENCY", "2"))
+# 被限流时并发上限乘以的系数
+LLM_ADAPTIVE_DECREASE = float(os.environ.get("LLM_ADAPTIVE_DECREASE", "0.7"))
+# 两次降低并发上限之间的最短间隔(秒)，同一波限流只降一次
+LLM_ADAPTIVE_COOLDOWN = float(os.environ.get("LLM_ADAPTIVE_COOLDOWN", "2"))
+# 视为限流或过载的Bedrock错误码
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException", "ModelNotReadyException"
+}
+
+# 是否启用Bedrock提示词缓存，只对LLM_PROMPT_CACHING_MODELS中的模型生效
+LLM_PROMPT_CACHING = os.environ.get("LLM_PROMPT_CACHING", "true").lower() == "true"
+# 支持Bedrock提示词缓存的模型，逗号分隔，模型ID包含其中任意一项时才发送cache_control
+# （不支持的模型，如默认的Claude 3 Sonnet，收到cache_control时Bedrock会拒绝请求）
+LLM_PROMPT_CACHING_MODELS = [
+    item.strip() for item in os.environ.get(
+        "LLM_PROMPT_CACHING_MODELS",
+        "claude-3-5-haiku,claude-3-7-sonnet,claude-sonnet-4,claude-opus-4,claude-haiku-4"
+    ).split(",") if item.strip()
+]
+# 对话历史为空或以assistant开头时补充的首条用户消息（Claude要求messages以user开头）
+CONVERSATION_START_MESSAGE = "开始问卷"
+
+# 流结束标记
+_STREAM_END = object()
+
+
+class _StreamFailure:
+    """工作线程中发生的异常，传回事件循环后重新抛出"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
 
 class LLMResponse(BaseModel):
     """LLM响应模型"""
@@ -22,6 +93,331 @@ class LLMResponse(BaseModel):
     metadata: Dict[str, Any] = {}
 
 
+def extract_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    提取token用量，包括提示词缓存的读写token数
+    
+    Args:
+        usage: Bedrock返回的usage字段
+        
+    Returns:
+        统一格式的token用量
+    """
+    usage = usage or {}
+    return {
+        "input_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "cache_creation_input_tokens": usage.get("cache_creation_input_tokens", 0) or 0,
+        "cache_read_input_tokens": usage.get("cache_read_input_tokens", 0) or 0
+    }
+
+
+def record_usage_metrics(model_id: str, usage: Dict[str, int]) -> None:
+    """
+    把token用量计入指标
+
+    Args:
+        model_id: 模型ID
+        usage: extract_usage返回的token用量
+    """
+    LLM_TOKENS.inc(usage["input_tokens"], model=model_id, kind="input")
+    LLM_TOKENS.inc(usage["output_tokens"], model=model_id, kind="output")
+    LLM_TOKENS.inc(usage["cache_creation_input_tokens"], model=model_id, kind="cache_creation")
+    LLM_TOKENS.inc(usage["cache_read_input_tokens"], model=model_id, kind="cache_read")
+
+
+class LLMOverloadedError(Exception):
+    """LLM调度队列已满或排队超时"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LLMServiceError(Exception):
+    """模型调用失败（包括流式输出中途出错），消息可以直接展示给用户"""
+
+    def __init__(self, message: str, throttled: bool = False):
+        super().__init__(message)
+        self.throttled = throttled
+
+
+class LLMPermit:
+    """LLM调用许可，调用结束后必须释放；重复释放无效"""
+
+    __slots__ = ("_scheduler", "model_id", "_released")
+
+    def __init__(self, scheduler: "LLMScheduler", model_id: str):
+        self._scheduler = scheduler
+        self.model_id = model_id
+        self._released = False
+
+    def release(self, throttled: bool = False) -> None:
+        """
+        释放许可
+
+        Args:
+            throttled: 本次调用是否被模型服务限流，用于调整并发上限
+        """
+        if self._released:
+            return
+        self._released = True
+        self._scheduler._release(self.model_id, throttled)
+
+
+class _ModelState:
+    """单个模型的并发状态"""
+
+    __slots__ = ("max_limit", "limit", "active", "last_decrease")
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.active = 0
+        self.last_decrease = 0.0
+
+
+class LLMScheduler:
+    """
+    LLM请求调度器
+
+    全局和每个模型分别限制并发调用数，超出时按到达顺序(FIFO)排队；同一模型的请求严格按序放行，
+    某个模型达到上限时不阻塞其他模型的请求。队列已满时立即拒绝(429)，排队超过时间预算时拒绝(503)，
+    调用方可以在开始SSE响应之前返回状态码，而不是在流中输出错误。
+    启用自适应时，每个模型的并发上限按AIMD调整：被限流时乘以LLM_ADAPTIVE_DECREASE（冷却期内只降一次），
+    每次成功调用增加1/上限（约每个上限数量的成功调用加1），不超过配置的上限。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        model_limits: Optional[Dict[str, int]] = None,
+        max_queue: int = LLM_QUEUE_MAX,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        adaptive: bool = LLM_ADAPTIVE_CONCURRENCY,
+        min_concurrency: int = LLM_MIN_CONCURRENCY
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits if model_limits is not None else _parse_model_limits(LLM_MODEL_CONCURRENCY)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_concurrency = min_concurrency
+        self._active = 0
+        self._models: Dict[str, _ModelState] = {}
+        self._waiters: Deque[Tuple[str, "asyncio.Future[LLMPermit]"]] = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def limit_of(self, model_id: str) -> int:
+        """模型当前的并发上限，自适应调整不会超过为模型配置的上限"""
+        state = self._model(model_id)
+        return min(state.max_limit, max(self.min_concurrency, int(state.limit)))
+
+    async def acquire(self, model_id: str) -> LLMPermit:
+        """
+        获取调用许可，需要时排队等待
+
+        Args:
+            model_id: 模型ID
+
+        Returns:
+            调用许可
+
+        Raises:
+            LLMOverloadedError: 队列已满或排队超时
+        """
+        if not self._waiters and self._has_capacity(model_id):
+            LLM_ADMISSIONS.inc(model=model_id, outcome="admitted")
+            LLM_QUEUE_WAIT.observe(0.0, model=model_id)
+            return self._grant(model_id)
+
+        self.check_queue(model_id)
+
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[LLMPermit]" = loop.create_future()
+        waiter = (model_id, future)
+        self._waiters.append(waiter)
+        self._dispatch()
+        start = loop.time()
+        timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        try:
+            permit = await future
+        except asyncio.CancelledError:
+            # 调用方已取消；许可若已发放则归还
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().release()
+            else:
+                self._discard(waiter)
+            raise
+        except LLMOverloadedError:
+            LLM_ADMISSIONS.inc(model=model_id, outcome="timeout")
+            logger.warning(f"LLM请求排队超过{self.queue_timeout}秒，拒绝请求: model={model_id}")
+            raise
+        finally:
+            timer.cancel()
+
+        LLM_ADMISSIONS.inc(model=model_id, outcome="admitted")
+        LLM_QUEUE_WAIT.observe(loop.time() - start, model=model_id)
+        return permit
+
+    def check_queue(self, model_id: str) -> None:
+        """
+        检查排队队列是否已满，供稍后才获取许可的调用方提前拒绝请求
+
+        Args:
+            model_id: 模型ID
+
+        Raises:
+            LLMOverloadedError: 队列已满
+        """
+        if len(self._waiters) >= self.max_queue:
+            LLM_ADMISSIONS.inc(model=model_id, outcome="rejected")
+            logger.warning(f"LLM调度队列已满({len(self._waiters)})，拒绝请求: model={model_id}")
+            raise LLMOverloadedError("LLM服务繁忙，请稍后重试", 429, LLM_RETRY_AFTER)
+
+    def _model(self, model_id: str) -> _ModelState:
+        state = self._models.get(model_id)
+        if state is None:
+            state = _ModelState(min(self.model_limits.get(model_id, self.max_concurrency), self.max_concurrency))
+            self._models[model_id] = state
+        return state
+
+    def _has_capacity(self, model_id: str) -> bool:
+        return self._active < self.max_concurrency and self._model(model_id).active < self.limit_of(model_id)
+
+    def _grant(self, model_id: str) -> LLMPermit:
+        self._active += 1
+        self._model(model_id).active += 1
+        return LLMPermit(self, model_id)
+
+    def _release(self, model_id: str, throttled: bool) -> None:
+        self._active -= 1
+        state = self._model(model_id)
+        state.active -= 1
+        if self.adaptive:
+            self._adjust(model_id, state, throttled)
+        self._dispatch()
+
+    def _adjust(self, model_id: str, state: _ModelState, throttled: bool) -> None:
+        """AIMD调整模型的并发上限"""
+        if throttled:
+            now = time.monotonic()
+            if now - state.last_decrease < LLM_ADAPTIVE_COOLDOWN:
+                return
+            state.last_decrease = now
+            state.limit = max(float(min(self.min_concurrency, state.max_limit)), state.limit * LLM_ADAPTIVE_DECREASE)
+            logger.warning(f"LLM调用被限流，降低并发上限: model={model_id}, limit={self.limit_of(model_id)}")
+        elif state.limit < state.max_limit:
+            state.limit = min(float(state.max_limit), state.limit + 1.0 / state.limit)
+
+    def _dispatch(self) -> None:
+        """按到达顺序放行排队的请求，达到上限的模型的请求继续排队"""
+        if not self._waiters:
+            return
+        remaining: Deque[Tuple[str, "asyncio.Future[LLMPermit]"]] = deque()
+        while self._waiters:
+            model_id, future = self._waiters.popleft()
+            if future.done():
+                continue
+            if self._has_capacity(model_id):
+                future.set_result(self._grant(model_id))
+            else:
+                remaining.append((model_id, future))
+        self._waiters = remaining
+
+    def _expire(self, waiter: Tuple[str, "asyncio.Future[LLMPermit]"]) -> None:
+        _, future = waiter
+        if not future.done():
+            self._discard(waiter)
+            future.set_exception(LLMOverloadedError("LLM服务繁忙，排队超时，请稍后重试", 503, LLM_RETRY_AFTER))
+
+    def _discard(self, waiter: Tuple[str, "asyncio.Future[LLMPermit]"]) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+def _parse_model_limits(value: str) -> Dict[str, int]:
+    """
+    解析每个模型的并发上限配置
+
+    Args:
+        value: 形如"model_a=32,model_b=8"的字符串
+
+    Returns:
+        模型ID到并发上限的映射
+    """
+    limits: Dict[str, int] = {}
+    for item in value.split(","):
+        model_id, sep, limit = item.strip().rpartition("=")
+        if sep and model_id:
+            limits[model_id.strip()] = int(limit)
+    return limits
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """
+    判断异常是否为模型服务的限流或过载错误（botocore ClientError及流中的EventStreamError）
+
+    Args:
+        error: 异常
+
+    Returns:
+        是否为限流错误
+    """
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def supports_prompt_caching(model_id: str) -> bool:
+    """
+    判断模型是否支持Bedrock提示词缓存
+
+    Args:
+        model_id: 模型ID或推理配置文件ID（如us.anthropic.claude-3-7-sonnet-...）
+
+    Returns:
+        是否支持
+    """
+    return any(item in model_id for item in LLM_PROMPT_CACHING_MODELS)
+
+
+def model_id_of(provider: "LLMProvider") -> str:
+    """
+    获取提供商的模型标识，用于调度和指标
+
+    Args:
+        provider: LLM提供商
+
+    Returns:
+        模型ID，提供商没有model_id时使用类名
+    """
+    return getattr(provider, "model_id", None) or type(provider).__name__
+
+
+# 进程内共享的LLM调度器
+llm_scheduler = LLMScheduler()
+REGISTRY.gauge(
+    "llm_inflight", "进行中的LLM调用数", ["model"],
+    callback=lambda: {(model_id,): float(state.active) for model_id, state in llm_scheduler._models.items()}
+)
+REGISTRY.gauge(
+    "llm_concurrency_limit", "LLM调用当前的并发上限（自适应调整后）", ["model"],
+    callback=lambda: {(model_id,): float(llm_scheduler.limit_of(model_id)) for model_id in list(llm_scheduler._models)}
+)
+REGISTRY.gauge(
+    "llm_queue_depth", "排队等待调用LLM的请求数",
+    callback=lambda: {(): float(llm_scheduler.queue_depth)}
+)
+
+
 class LLMProvider(ABC):
     """LLM提供商抽象基类"""
     
@@ -37,6 +433,9 @@ class LLMProvider(ABC):
             
         Returns:
             异步生成器，生成LLM响应的片段
+            
+        Raises:
+            LLMServiceError: 模型调用失败，或输出中途出错
         """
         pass
     
@@ -58,34 +457,23 @@ class LLMProvider(ABC):
 
 def log_llm_inputs(prompt: str, conversation_history: List[Dict[str, str]] = None, **kwargs) -> None:
     """
-    记录LLM调用的详细输入参数
+    记录LLM调用的输入参数：摘要信息总是记录，完整提示词和历史按采样率记录
     
     Args:
         prompt: 提示词
         conversation_history: 对话历史
         **kwargs: 其他参数
     """
-    # 打印详细的提示词内容
-    logger.info("================ LLM调用输入参数 ================")
-    logger.info(f"提示词长度: {len(prompt)} 字符")
-    logger.info(f"提示词内容:\n{prompt}")
-    
-    # 打印对话历史
-    if conversation_history:
-        logger.info(f"对话历史条数: {len(conversation_history)}")
-        for i, msg in enumerate(conversation_history):
-            role = msg.get('role', 'unknown')
-            content = msg.get('content', '')
-            content_preview = content[:150] + "..." if len(content) > 150 else content
-            logger.info(f"对话[{i}] - {role}: {content_preview}")
-    else:
-        logger.info("对话历史: 无")
-    
-    # 打印其他参数
-    if kwargs:
-        logger.info(f"其他参数: {kwargs}")
-    
-    logger.info("===================================================")
+    log_event(
+        logger, "llm.inputs",
+        prompt_chars=len(prompt),
+        history_messages=len(conversation_history) if conversation_history else 0,
+        params=",".join(sorted(kwargs))
+    )
+    log_payload(
+        logger, "llm.inputs.payload",
+        lambda: {"prompt": prompt, "history": conversation_history, "params": kwargs}
+    )
 
 
 class BedrockProvider(LLMProvider):
@@ -104,9 +492,11 @@ class BedrockProvider(LLMProvider):
         logger.info(f"初始化BedrockProvider: model_id={model_id}, region={region_name}")
         
         try:
+            # 连接池大小与线程池一致，避免并发流排队等待连接
             self.client = boto3.client(
                 service_name="bedrock-runtime",
-                region_name=region_name
+                region_name=region_name,
+                config=Config(max_pool_connections=LLM_STREAM_MAX_WORKERS)
             )
             logger.info("成功创建Bedrock客户端")
         except Exception as e:
@@ -120,49 +510,173 @@ class BedrockProvider(LLMProvider):
         Args:
             prompt: 提示词
             conversation_history: 对话历史
-            **kwargs: 其他参数
+            **kwargs: 其他参数，response_metadata为可选的字典，流结束后写入token用量，被限流时写入throttled
             
         Returns:
             异步生成器，生成LLM响应的片段
+            
+        Raises:
+            LLMServiceError: 模型调用失败，或输出中途出错
         """
-        history_count = len(conversation_history) if conversation_history else 0
-        logger.info(f"开始生成流式响应: prompt长度={len(prompt)}, 对话历史数量={history_count}")
+        response_metadata = kwargs.pop('response_metadata', None)
         
-        # 记录详细输入
+        # 记录输入摘要
         log_llm_inputs(prompt, conversation_history, **kwargs)
         
         # 准备请求负载
         request_body = self._prepare_request_body(prompt, conversation_history, **kwargs)
         
-        # 记录完整请求体
-        logger.info("完整请求体:")
-        logger.info(json.dumps(request_body, indent=2, ensure_ascii=False))
+        # 按采样率记录完整请求体
+        log_payload(logger, "llm.request_body", request_body, model_id=self.model_id)
         
+        start = time.perf_counter()
+        first_token_at = None
+        chunk_count = 0
+        usage: Dict[str, Any] = {}
+        stream = self._stream_in_executor(request_body, usage)
         try:
-            # 调用Bedrock流式API
-            logger.debug(f"调用Bedrock流式API: modelId={self.model_id}")
-            response = self.client.invoke_model_with_response_stream(
-                modelId=self.model_id,
-                body=json.dumps(request_body)
-            )
-            
-            # 处理流式响应
-            stream = response.get('body')
-            if stream:
-                logger.info("开始处理流式响应")
-                chunk_count = 0
-                async for event in self._process_stream(stream):
-                    chunk_count += 1
-                    yield event
-                logger.info(f"流式响应完成，共处理{chunk_count}个文本片段")
-            else:
-                logger.warning("Bedrock响应中没有'body'字段")
+            async for text in stream:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    LLM_TIME_TO_FIRST_TOKEN.observe(first_token_at - start, model=self.model_id)
+                chunk_count += 1
+                yield text
+            end = time.perf_counter()
+            usage = extract_usage(usage)
+            LLM_REQUESTS.inc(model=self.model_id, outcome="success")
+            LLM_STREAM_DURATION.observe(end - start, model=self.model_id)
+            record_usage_metrics(self.model_id, usage)
+            if first_token_at is not None and end > first_token_at and usage["output_tokens"]:
+                LLM_TOKENS_PER_SECOND.observe(usage["output_tokens"] / (end - first_token_at), model=self.model_id)
+            log_event(logger, "llm.stream.done", model_id=self.model_id, chunks=chunk_count, **usage)
+            if response_metadata is not None:
+                response_metadata["usage"] = usage
+        except (asyncio.CancelledError, GeneratorExit):
+            # 调用方提前停止（客户端断开），关闭stream时工作线程随之关闭Bedrock响应流
+            LLM_REQUESTS.inc(model=self.model_id, outcome="cancelled")
+            log_event(logger, "llm.stream.cancelled", model_id=self.model_id, chunks=chunk_count)
+            raise
         except Exception as e:
+            throttled = is_throttling_error(e)
+            LLM_REQUESTS.inc(model=self.model_id, outcome="throttled" if throttled else "error")
             logger.error(f"Bedrock流式API调用失败: {str(e)}")
-            yield f"LLM服务错误: {str(e)}"
+            if throttled and response_metadata is not None:
+                # 调用方据此反馈给调度器，降低该模型的并发上限
+                response_metadata["throttled"] = True
+            raise LLMServiceError(f"LLM服务错误: {str(e)}", throttled=throttled) from e
+        finally:
+            # async for提前退出时不会自动关闭内层生成器，需显式关闭以通知工作线程
+            await stream.aclose()
     
-    async def _process_stream(self, stream) -> AsyncGenerator[str, None]:
-        """处理Amazon Bedrock的流式响应"""
+    async def _stream_in_executor(self, request_body: Dict[str, Any], usage: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """
+        在专用线程池中调用Bedrock流式API并迭代EventStream，
+        通过有界异步队列把文本片段交还给事件循环
+        
+        Args:
+            request_body: 请求体
+            usage: 用于接收流中报告的token用量
+            
+        Returns:
+            异步生成器，生成LLM响应的片段
+        """
+        loop = asyncio.get_running_loop()
+        # 队列本身不限长，由slots限制其中未被取走的数据量：工作线程先占一个名额再通过
+        # call_soon_threadsafe投递，投递只会发生一次，不会因超时重试而重复放入同一片段
+        queue: asyncio.Queue = asyncio.Queue()
+        slots = threading.BoundedSemaphore(LLM_STREAM_QUEUE_SIZE)
+        cancelled = threading.Event()
+        # 工作线程打开的Bedrock响应流，消费者取消时直接关闭，不必等到下一个事件到达
+        opened: Dict[str, Any] = {}
+        
+        def put(item: Any) -> bool:
+            """在工作线程中把数据放入队列，队列满时阻塞；消费者已退出时返回False"""
+            while not cancelled.is_set():
+                if slots.acquire(timeout=0.5):
+                    try:
+                        loop.call_soon_threadsafe(queue.put_nowait, item)
+                    except RuntimeError:
+                        # 事件循环已关闭
+                        return False
+                    return True
+            return False
+        
+        def worker() -> None:
+            stream = None
+            completed = False
+            try:
+                if cancelled.is_set():
+                    return
+                logger.debug(f"调用Bedrock流式API: modelId={self.model_id}")
+                response = self.client.invoke_model_with_response_stream(
+                    modelId=self.model_id,
+                    body=json.dumps(request_body)
+                )
+                stream = response.get('body')
+                if not stream:
+                    logger.warning("Bedrock响应中没有'body'字段")
+                    return
+                opened["stream"] = stream
+                if cancelled.is_set():
+                    # 消费者在流打开之前已退出，未能替我们关闭
+                    return
+                for text in self._process_stream(stream, usage):
+                    if not put(text):
+                        logger.info("消费者已停止，结束流式读取")
+                        break
+                else:
+                    completed = True
+            except Exception as e:
+                if cancelled.is_set():
+                    # 消费者关闭响应流后读取会失败，属于预期情况
+                    logger.debug(f"消费者已停止，流式读取结束: {str(e)}")
+                else:
+                    put(_StreamFailure(e))
+            finally:
+                # 未读完的响应流必须关闭：断开连接后Bedrock停止生成，不再产生输出token，
+                # 连接也不会以未读完的状态留在连接池中；已被消费者取走关闭时不再重复关闭
+                if opened.pop("stream", None) is not None and not completed:
+                    self._close_stream(stream)
+                # 结束标记不占用名额，避免队列已满时工作线程无法退出
+                if not cancelled.is_set():
+                    try:
+                        loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+                    except RuntimeError:
+                        pass
+        
+        worker_future = loop.run_in_executor(_llm_executor, worker)
+        completed = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    completed = True
+                    break
+                slots.release()
+                if isinstance(item, _StreamFailure):
+                    completed = True
+                    raise item.error
+                yield item
+        finally:
+            # 通知工作线程停止，不等待其结束
+            cancelled.set()
+            stream = opened.pop("stream", None) if not completed else None
+            if stream is not None:
+                # 工作线程可能正阻塞在读取下一个事件上，直接关闭响应流使读取立即返回
+                self._close_stream(stream)
+            worker_future.add_done_callback(lambda f: f.exception())
+    
+    @staticmethod
+    def _close_stream(stream) -> None:
+        """关闭Bedrock响应流（工作线程或消费者取消时执行）"""
+        try:
+            stream.close()
+            logger.info("已关闭未读完的Bedrock响应流")
+        except Exception as e:
+            logger.warning(f"关闭Bedrock响应流出错: {str(e)}")
+    
+    def _process_stream(self, stream, usage: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """处理Amazon Bedrock的流式响应（在工作线程中执行，会阻塞），token用量写入usage"""
         try:
             event_count = 0
             for event in stream:
@@ -172,14 +686,21 @@ class BedrockProvider(LLMProvider):
                     
                 if 'chunk' in event:
                     chunk = json.loads(event['chunk']['bytes'].decode('utf-8'))
-                    if 'type' in chunk and chunk['type'] == 'content_block_delta':
-                        text = chunk['delta']['text']
+                    chunk_type = chunk.get('type')
+                    if chunk_type == 'content_block_delta':
+                        text = chunk['delta'].get('text')
                         if text:
                             yield text
+                    elif usage is not None and chunk_type == 'message_start':
+                        usage.update(chunk.get('message', {}).get('usage', {}))
+                    elif usage is not None and chunk_type == 'message_delta':
+                        usage.update(chunk.get('usage', {}))
             logger.debug(f"流处理完成，共处理{event_count}个事件")
         except Exception as e:
-            logger.error(f"处理流式响应出错: {str(e)}")
-            yield f"处理错误: {str(e)}"
+            # 流中途出错（包括被限流）时作为调用失败处理，由generate_stream转换为LLMServiceError
+            if not is_throttling_error(e):
+                logger.error(f"处理流式响应出错: {str(e)}")
+            raise
         
     async def generate(self, prompt: str, conversation_history: List[Dict[str, str]] = None, **kwargs) -> LLMResponse:
         """
@@ -193,27 +714,24 @@ class BedrockProvider(LLMProvider):
         Returns:
             LLM响应
         """
-        history_count = len(conversation_history) if conversation_history else 0
-        logger.info(f"开始生成响应: prompt长度={len(prompt)}, 对话历史数量={history_count}")
-        
-        # 记录详细输入
+        # 记录输入摘要
         log_llm_inputs(prompt, conversation_history, **kwargs)
         
         # 准备请求负载
         request_body = self._prepare_request_body(prompt, conversation_history, **kwargs)
         
+        # 按采样率记录完整请求体
+        log_payload(logger, "llm.request_body", request_body, model_id=self.model_id)
+        
         try:
-            # 调用Bedrock API
+            # 调用Bedrock API（调用和读取响应体都会阻塞，放到线程池中执行）
             logger.debug(f"调用Bedrock API: modelId={self.model_id}")
-            response = self.client.invoke_model(
-                modelId=self.model_id,
-                body=json.dumps(request_body)
+            loop = asyncio.get_running_loop()
+            response_body = await loop.run_in_executor(
+                _llm_executor,
+                partial(self._invoke_model, request_body)
             )
             
-            # 解析响应
-            response_body = json.loads(response['body'].read().decode('utf-8'))
-            logger.debug(f"收到Bedrock响应，解析响应内容")
-            
             # 解析模型特定的响应格式
             if 'content' in response_body and isinstance(response_body['content'], list):
                 # Claude 3模型响应格式
@@ -222,31 +740,51 @@ class BedrockProvider(LLMProvider):
                     if content_block.get('type') == 'text':
                         text += content_block.get('text', '')
                 
-                logger.info(f"生成响应成功，文本长度={len(text)}")
-                return LLMResponse(text=text, metadata=response_body)
+                usage = extract_usage(response_body.get('usage'))
+                LLM_REQUESTS.inc(model=self.model_id, outcome="success")
+                record_usage_metrics(self.model_id, usage)
+                log_event(logger, "llm.generate.done", model_id=self.model_id, text_chars=len(text), **usage)
+                return LLMResponse(text=text, metadata={**response_body, "usage": usage})
             else:
                 # 兜底，直接返回原始响应
                 text = response_body.get('completion', str(response_body))
-                logger.info(f"生成响应成功(兜底模式)，文本长度={len(text)}")
+                log_event(logger, "llm.generate.done", model_id=self.model_id, text_chars=len(text), fallback=True)
                 return LLMResponse(
                     text=text,
                     metadata=response_body
                 )
         except Exception as e:
+            throttled = is_throttling_error(e)
+            LLM_REQUESTS.inc(model=self.model_id, outcome="throttled" if throttled else "error")
             logger.error(f"Bedrock API调用失败: {str(e)}")
-            return LLMResponse(text=f"错误: {str(e)}", metadata={})
+            return LLMResponse(text=f"错误: {str(e)}", metadata={"throttled": throttled})
+    
+    def _invoke_model(self, request_body: Dict[str, Any]) -> Dict[str, Any]:
+        """同步调用Bedrock API并解析响应体（在工作线程中执行）"""
+        response = self.client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps(request_body)
+        )
+        return json.loads(response['body'].read().decode('utf-8'))
     
     def _prepare_request_body(self, prompt: str, conversation_history: List[Dict[str, str]] = None, **kwargs) -> Dict[str, Any]:
-        """准备请求正文"""
+        """
+        准备请求正文
+        
+        提示词作为system块发送；启用提示词缓存且模型支持时，在system块和上一轮对话末尾设置缓存断点，
+        使静态提示词和已有历史作为稳定前缀被Bedrock缓存，后续轮次只需处理新增消息
+        """
         logger.debug("准备Bedrock请求体")
+        prompt_caching = kwargs.get('prompt_caching', LLM_PROMPT_CACHING) and supports_prompt_caching(self.model_id)
         # Claude 3模型的消息格式
         messages = []
         
-        # 添加系统提示作为特殊的用户消息（Claude流式API不支持system角色）
-        messages.append({
-            "role": "user",
-            "content": [{"type": "text", "text": prompt}]
-        })
+        # messages必须以用户消息开头
+        if not conversation_history or conversation_history[0].get('role') != 'user':
+            messages.append({
+                "role": "user",
+                "content": [{"type": "text", "text": CONVERSATION_START_MESSAGE}]
+            })
         
         # 添加历史消息
         if conversation_history:
@@ -265,10 +803,26 @@ class BedrockProvider(LLMProvider):
         max_tokens = kwargs.get('max_tokens', 4096)
         temperature = kwargs.get('temperature', 0.7)
         
+        system_blocks = [{"type": "text", "text": prompt}]
+        if prompt_caching:
+            system_blocks[0]["cache_control"] = {"type": "ephemeral"}
+            # 最后一条消息之前的历史在下一轮中保持不变，作为第二个缓存断点
+            if len(messages) >= 2:
+                messages[-2]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+        
+        # 较早对话的滚动摘要放在静态提示词之后，摘要更新时不影响提示词本身的缓存
+        conversation_summary = kwargs.get('conversation_summary')
+        if conversation_summary:
+            system_blocks.append({
+                "type": "text",
+                "text": f"以下是此前对话的摘要：\n{conversation_summary}"
+            })
+        
         request_body = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": max_tokens,
             "temperature": temperature,
+            "system": system_blocks,
             "messages": messages
         }
         
@@ -322,22 +876,40 @@ class OpenAIProvider(LLMProvider):
 class LLMFactory:
     """LLM工厂类，负责创建不同的LLM提供商实例"""
     
-    @staticmethod
-    def create_provider(provider_type: str = "bedrock", **kwargs) -> LLMProvider:
+    # 额外注册的提供商: 名称 -> 创建函数
+    _registry: Dict[str, Callable[..., LLMProvider]] = {}
+    
+    @classmethod
+    def register_provider(cls, provider_type: str, factory: Callable[..., LLMProvider]) -> None:
+        """
+        注册LLM提供商，注册后可通过LLM_PROVIDER环境变量或create_provider使用
+        
+        Args:
+            provider_type: 提供商类型名称
+            factory: 创建函数，接收create_provider的关键字参数，返回提供商实例
+        """
+        cls._registry[provider_type.lower()] = factory
+        logger.info(f"注册LLM提供商: provider_type={provider_type}")
+    
+    @classmethod
+    def create_provider(cls, provider_type: Optional[str] = None, **kwargs) -> LLMProvider:
         """
         创建LLM提供商实例
         
         Args:
-            provider_type: 提供商类型，如"bedrock"、"openai"等
+            provider_type: 提供商类型，如"bedrock"、"openai"等，默认读取LLM_PROVIDER环境变量
             **kwargs: 其他初始化参数
             
         Returns:
             LLM提供商实例
         """
+        provider_type = provider_type or os.environ.get("LLM_PROVIDER", "bedrock")
         logger.info(f"创建LLM提供商: provider_type={provider_type}")
         
         try:
-            if provider_type.lower() == "bedrock":
+            if provider_type.lower() in cls._registry:
+                return cls._registry[provider_type.lower()](**kwargs)
+            elif provider_type.lower() == "bedrock":
                 model_id = kwargs.get('model_id', "anthropic.claude-3-sonnet-20240229-v1:0")
                 region_name = kwargs.get('region_name', "us-west-2")
                 logger.info(f"创建BedrockProvider: model_id={model_id}, region={region_name}")
@@ -357,19 +929,34 @@ class LLMFactory:
             raise
 
 
-# 默认LLM服务实例，使用环境变量进行配置
-try:
-    provider_type = os.environ.get("LLM_PROVIDER", "bedrock")
-    model_id = os.environ.get("LLM_MODEL_ID", "anthropic.claude-3-7-sonnet-20250219-v1:0")
-    region_name = os.environ.get("AWS_REGION", "us-west-2")
+_default_provider: Optional[LLMProvider] = None
+
+
+def get_default_provider() -> LLMProvider:
+    """
+    获取默认LLM服务实例，首次调用时按环境变量创建
     
-    logger.info(f"创建默认LLM提供商: provider_type={provider_type}, model_id={model_id}, region={region_name}")
-    default_provider = LLMFactory.create_provider(
-        provider_type=provider_type,
-        model_id=model_id,
-        region_name=region_name
-    )
-except Exception as e:
-    logger.error(f"创建默认LLM提供商失败: {str(e)}")
-    # 在生产环境中可能需要使用备用提供商或者优雅地处理错误
-    raise 
\ No newline at end of file
+    Returns:
+        LLM提供商实例
+    """
+    global _default_provider
+    
+    if _default_provider is None:
+        provider_type = os.environ.get("LLM_PROVIDER", "bedrock")
+        model_id = os.environ.get("LLM_MODEL_ID", "anthropic.claude-3-7-sonnet-20250219-v1:0")
+        region_name = os.environ.get("AWS_REGION", "us-west-2")
+        
+        logger.info(f"创建默认LLM提供商: provider_type={provider_type}, model_id={model_id}, region={region_name}")
+        _default_provider = LLMFactory.create_provider(
+            provider_type=provider_type,
+            model_id=model_id,
+            region_name=region_name
+        )
+    return _default_provider
+
+
+def __getattr__(name: str) -> Any:
+    # 兼容原先在导入时创建的default_provider，改为首次访问时创建
+    if name == "default_provider":
+        return get_default_provider()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,110 @@
+"""
+提示词编译缓存
+按问卷ID和问题集内容指纹缓存渲染好的系统提示词，问题未变化时不再重新渲染
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+from ..metrics import register_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 最多缓存的问卷数量
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "1000"))
+
+# 参与指纹计算的问题字段
+_FINGERPRINT_FIELDS = (
+    "id", "question_text", "question_order", "question_type",
+    "followup_count", "question_objectives", "updated_at"
+)
+
+
+def questions_fingerprint(questions: List[Dict[str, Any]]) -> str:
+    """
+    计算问题集的内容指纹
+
+    Args:
+        questions: 问题列表
+
+    Returns:
+        问题集内容的SHA1摘要
+    """
+    payload = [[q.get(field) for field in _FINGERPRINT_FIELDS] for q in questions]
+    raw = json.dumps(payload, ensure_ascii=False, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    """
+    提示词编译缓存
+
+    每个问卷只保留最新版本的提示词：指纹不一致时重新编译并覆盖旧版本。
+    超出容量时淘汰最久未使用的问卷。
+    """
+
+    def __init__(self, max_entries: int = PROMPT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[str, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compile(
+        self,
+        survey_id: int,
+        questions: List[Dict[str, Any]],
+        compile_prompt: Callable[[List[Dict[str, Any]]], str]
+    ) -> str:
+        """
+        获取问卷的提示词，未命中时调用compile_prompt编译并缓存
+
+        Args:
+            survey_id: 问卷ID
+            questions: 问题列表
+            compile_prompt: 提示词渲染函数
+
+        Returns:
+            提示词
+        """
+        fingerprint = questions_fingerprint(questions)
+        entry = self._entries.get(survey_id)
+        if entry is not None and entry[0] == fingerprint:
+            self._entries.move_to_end(survey_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        prompt = compile_prompt(questions)
+        self._entries[survey_id] = (fingerprint, prompt)
+        self._entries.move_to_end(survey_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        logger.info(f"提示词已编译并缓存: survey_id={survey_id}, 问题数量={len(questions)}, 指纹={fingerprint[:12]}")
+        return prompt
+
+    def invalidate(self, survey_id: int) -> None:
+        """删除问卷的缓存提示词"""
+        self._entries.pop(survey_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+# 进程内共享的提示词缓存
+prompt_cache = PromptCache()
+register_cache("prompt", lambda: (prompt_cache.hits, prompt_cache.misses))
@@ -0,0 +1,119 @@
+"""
+问卷统计缓存
+按问卷ID缓存回答统计，短TTL内的重复查询直接返回缓存结果；
+同一问卷的并发未命中只触发一次数据库查询
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from ..database.schemas import SurveyResponseStats
+from ..metrics import register_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 统计结果有效期(秒)
+SURVEY_STATS_TTL = float(os.environ.get("SURVEY_STATS_TTL", "30"))
+# 最多缓存的问卷数量
+SURVEY_STATS_CACHE_SIZE = int(os.environ.get("SURVEY_STATS_CACHE_SIZE", "10000"))
+
+StatsLoader = Callable[[List[int]], Awaitable[Dict[int, SurveyResponseStats]]]
+
+
+class SurveyStatsCache:
+    """
+    问卷统计缓存
+
+    LRU淘汰，超过TTL的条目视为失效。get_many把所有未命中的问卷合并为一次加载，
+    正在加载中的问卷由后续请求等待同一个结果。
+    """
+
+    def __init__(self, ttl_seconds: float = SURVEY_STATS_TTL, max_entries: int = SURVEY_STATS_CACHE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[float, SurveyResponseStats]]" = OrderedDict()
+        self._pending: Dict[int, "asyncio.Future[SurveyResponseStats]"] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, survey_ids: List[int], loader: StatsLoader) -> Dict[int, SurveyResponseStats]:
+        """
+        获取多个问卷的统计，未命中的问卷通过loader一次性加载
+
+        Args:
+            survey_ids: 问卷ID列表
+            loader: 加载函数，接收未命中的问卷ID列表，返回问卷ID到统计的映射
+
+        Returns:
+            问卷ID到统计的映射
+        """
+        now = time.monotonic()
+        result: Dict[int, SurveyResponseStats] = {}
+        waiting: Dict[int, "asyncio.Future[SurveyResponseStats]"] = {}
+        missing: List[int] = []
+
+        for survey_id in dict.fromkeys(survey_ids):
+            entry = self._entries.get(survey_id)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(survey_id)
+                self.hits += 1
+                result[survey_id] = entry[1]
+            elif survey_id in self._pending:
+                self.hits += 1
+                waiting[survey_id] = self._pending[survey_id]
+            else:
+                self.misses += 1
+                missing.append(survey_id)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {survey_id: loop.create_future() for survey_id in missing}
+            self._pending.update(futures)
+            try:
+                loaded = await loader(missing)
+            except BaseException as e:
+                for future in futures.values():
+                    if future.done():
+                        continue
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+                        # 没有其他等待者时避免"exception was never retrieved"警告
+                        future.exception()
+                raise
+            finally:
+                for survey_id in missing:
+                    self._pending.pop(survey_id, None)
+
+            loaded_at = time.monotonic()
+            for survey_id, future in futures.items():
+                stats = loaded.get(survey_id) or SurveyResponseStats(survey_id=survey_id)
+                self._put(survey_id, stats, loaded_at)
+                future.set_result(stats)
+                result[survey_id] = stats
+
+        for survey_id, future in waiting.items():
+            result[survey_id] = await asyncio.shield(future)
+
+        return result
+
+    def _put(self, survey_id: int, stats: SurveyResponseStats, loaded_at: float) -> None:
+        self._entries[survey_id] = (loaded_at, stats)
+        self._entries.move_to_end(survey_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, survey_id: int) -> None:
+        """使问卷的统计缓存失效"""
+        self._entries.pop(survey_id, None)
+
+
+# 进程内共享的问卷统计缓存
+survey_stats_cache = SurveyStatsCache()
+register_cache("survey_stats", lambda: (survey_stats_cache.hits, survey_stats_cache.misses))
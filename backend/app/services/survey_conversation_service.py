@@ -3,32 +3,38 @@
 负责处理问卷调研对话交互，使用LLM进行问题询问和回答处理
 """
 
-import json
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional, AsyncGenerator, Union, Tuple
-from datetime import datetime, timezone
+import os
+from typing import Dict, List, Any, Optional, AsyncGenerator, Set, Union
+from ..concurrency import gather_with_timeouts
 from ..database.dao import (
     SurveyDAO,
     SurveyQuestionDAO,
     SurveyResponseDAO,
     SurveyResponseConversationDAO
 )
-from ..database.schemas import (
-    SurveyResponseConversation, 
-    SurveyResponseConversationCreate
-)
-from .llm_service import LLMFactory, LLMProvider
+from ..logging_config import log_event, log_payload
+from .llm_service import LLMFactory, LLMPermit, LLMProvider, llm_scheduler, model_id_of
+from .conversation_order import conversation_order_allocator
+from .conversation_writer import ConversationSaveError, conversation_writer
+from .conversation_context import ConversationContext, conversation_context_cache
+from .prompt_cache import prompt_cache
+from .history_manager import HistoryManager
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 加载对话上下文时每次数据库读取的超时时间(秒)
+CONTEXT_READ_TIMEOUT = float(os.environ.get("CONTEXT_READ_TIMEOUT", "10"))
+
+# 客户端断开或模型调用出错时追加在未完成回复末尾的标记
+INTERRUPTED_MARKER = "[已中断]"
 
-def create_iso_timestamp() -> str:
-    """创建标准格式的ISO时间戳"""
-    # 使用UTC时区并确保微秒格式正确
-    dt = datetime.now(timezone.utc)
-    # 格式化为6位微秒的ISO格式
-    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+00:00"
+
+def interrupted_message(partial_text: str) -> str:
+    """未完成的回复加上中断标记"""
+    return f"{partial_text}\n{INTERRUPTED_MARKER}"
 
 
 class SurveyConversationService:
@@ -42,6 +48,9 @@ class SurveyConversationService:
             llm_provider: LLM提供商实例，如果不提供则创建默认实例
         """
         self.llm_provider = llm_provider or LLMFactory.create_provider()
+        self.history_manager = HistoryManager(self.llm_provider)
+        # 客户端断开后仍在后台进行的保存任务
+        self._tasks: Set[asyncio.Task] = set()
         logger.info(f"初始化SurveyConversationService，使用LLM提供商: {type(self.llm_provider).__name__}")
     
     async def get_survey_id_from_response(self, response_id: int) -> Optional[int]:
@@ -83,24 +92,26 @@ class SurveyConversationService:
         logger.info(f"成功获取到{len(result)}个问题")
         
         # 打印详细的问题列表
-        for i, q in enumerate(result):
-            logger.info(f"问题[{i+1}]: {q.get('question_text', '无文本')} (ID: {q.get('id')}, 类型: {q.get('question_type')})")
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, q in enumerate(result):
+                logger.debug(f"问题[{i+1}]: {q.get('question_text', '无文本')} (ID: {q.get('id')}, 类型: {q.get('question_type')})")
         
         return result
     
-    async def get_conversation_history(self, response_id: int) -> List[Dict[str, str]]:
+    async def get_conversation_history(self, response_id: int, after_order: int = 0) -> List[Dict[str, Any]]:
         """
         获取对话历史记录
         
         Args:
             response_id: 回答ID
+            after_order: 只获取顺序号大于该值的对话（之前的对话已折叠进摘要）
             
         Returns:
             对话历史记录列表
         """
         logger.info(f"正在获取response_id={response_id}的对话历史")
         # 获取历史对话
-        conversations = await SurveyResponseConversationDAO.get_by_response_id(response_id)
+        conversations = await SurveyResponseConversationDAO.get_by_response_id(response_id, after_order)
         
         # 转换为LLM所需的对话历史格式
         history = []
@@ -108,23 +119,110 @@ class SurveyConversationService:
             role = "user" if conv.speaker_type == "user" else "assistant"
             history.append({
                 "role": role,
-                "content": conv.message_text
+                "content": conv.message_text,
+                "order": conv.conversation_order
             })
         
         logger.info(f"成功获取到{len(history)}条历史对话")
         
         # 打印详细的对话历史
-        for i, msg in enumerate(history):
-            role = msg.get('role', 'unknown')
-            content = msg.get('content', '')
-            content_preview = content[:100] + "..." if len(content) > 100 else content
-            logger.info(f"对话历史[{i}] - {role}: {content_preview}")
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, msg in enumerate(history):
+                role = msg.get('role', 'unknown')
+                content = msg.get('content', '')
+                content_preview = content[:100] + "..." if len(content) > 100 else content
+                logger.debug(f"对话历史[{i}] - {role}: {content_preview}")
         
         return history
     
-    def _build_prompt(self, questions: List[Dict[str, Any]]) -> str:
+    async def get_conversation_context(self, response_id: int) -> Optional[ConversationContext]:
         """
-        构建提示词
+        获取对话上下文，缓存命中时不访问数据库
+        
+        Args:
+            response_id: 回答ID
+            
+        Returns:
+            对话上下文，回答不存在时返回None
+        """
+        context = conversation_context_cache.get(response_id)
+        if context is not None:
+            logger.debug(f"对话上下文缓存命中: response_id={response_id}")
+            return context
+        
+        response = await asyncio.wait_for(SurveyResponseDAO.get_by_id(response_id), CONTEXT_READ_TIMEOUT)
+        if not response or not response.survey_id:
+            logger.warning(f"找不到response_id={response_id}的记录")
+            return None
+        
+        # 问题列表和对话历史互不依赖，并发读取
+        survey_id = response.survey_id
+        summary_through_order = response.summary_through_order or 0
+        questions, history = await gather_with_timeouts(
+            self.get_survey_questions(survey_id),
+            self._get_persisted_history(response_id, summary_through_order),
+            timeout=CONTEXT_READ_TIMEOUT
+        )
+        prompt = self._build_prompt(survey_id, questions)
+        
+        # 历史已包含全部落库的消息，据此初始化顺序号，保存本轮消息时无需再读数据库
+        last_order = max([m["order"] for m in history] + [summary_through_order])
+        conversation_order_allocator.seed(response_id, last_order + 1)
+        
+        context = ConversationContext(
+            response_id=response_id,
+            survey_id=survey_id,
+            questions=questions,
+            prompt=prompt,
+            history=history,
+            conversation_summary=response.conversation_summary,
+            summary_through_order=summary_through_order
+        )
+        conversation_context_cache.put(context)
+        return context
+    
+    async def _get_persisted_history(self, response_id: int, after_order: int) -> List[Dict[str, Any]]:
+        """
+        先写入写后队列中该回答尚未落库的消息，再从数据库读取对话历史，保证历史完整
+        
+        Args:
+            response_id: 回答ID
+            after_order: 只获取顺序号大于该值的对话
+            
+        Returns:
+            对话历史记录列表
+        """
+        await conversation_writer.flush(response_id)
+        return await self.get_conversation_history(response_id, after_order)
+    
+    def _build_prompt(self, survey_id: int, questions: List[Dict[str, Any]]) -> str:
+        """
+        构建提示词，问题集未变化时直接使用编译缓存
+        
+        Args:
+            survey_id: 问卷ID
+            questions: 问题列表
+            
+        Returns:
+            完整提示词
+        """
+        return prompt_cache.get_or_compile(survey_id, questions, self._render_prompt)
+    
+    @classmethod
+    async def warm_prompt_cache(cls, survey_id: int) -> None:
+        """
+        预热问卷的提示词缓存，在问卷发布时调用
+        
+        Args:
+            survey_id: 问卷ID
+        """
+        questions = [q.dict() for q in await SurveyQuestionDAO.get_by_survey_id(survey_id)]
+        prompt_cache.get_or_compile(survey_id, questions, cls._render_prompt)
+    
+    @staticmethod
+    def _render_prompt(questions: List[Dict[str, Any]]) -> str:
+        """
+        渲染提示词模板
         
         Args:
             questions: 问题列表
@@ -163,81 +261,48 @@ class SurveyConversationService:
         logger.debug(f"提示词预览: {preview}")
         return prompt_template
     
-    async def save_conversation(self, response_id: int, speaker_type: str, message: str) -> SurveyResponseConversation:
+    async def save_conversation(self, response_id: int, speaker_type: str, message: str) -> int:
         """
         保存对话消息
         
+        消息立即追加到内存历史并进入写后队列，由后台批量写入数据库
+        
         Args:
             response_id: 回答ID
             speaker_type: 发言者类型
             message: 消息内容
             
         Returns:
-            保存的对话记录
+            消息的对话顺序号
         """
-        logger.info(f"保存对话消息: response_id={response_id}, speaker_type={speaker_type}, 消息长度={len(message)}")
-        # 获取现有对话，确定顺序
-        existing_conversations = await SurveyResponseConversationDAO.get_by_response_id(response_id)
-        conversation_order = len(existing_conversations) + 1
+        conversation_order = await conversation_writer.enqueue(response_id, speaker_type, message)
+        logger.info(f"对话消息已入队: response_id={response_id}, speaker_type={speaker_type}, order={conversation_order}, 消息长度={len(message)}")
+        return conversation_order
+    
+    def _save_interrupted(self, response_id: int, partial_text: str) -> None:
+        """
+        在后台保存被中断的回复，尚未生成任何文本时不保存
         
-        try:
-            # 创建对话记录
-            conversation_data = SurveyResponseConversationCreate(
-                survey_response_id=response_id,
-                speaker_type=speaker_type,
-                message_text=message,
-                conversation_order=conversation_order
-            )
-            
-            # 保存到数据库
-            result = await SurveyResponseConversationDAO.create(conversation_data)
-            logger.info(f"对话消息已保存: id={result.id}, order={result.conversation_order}")
-            return result
+        断开时所在的任务已被取消，保存放到独立任务中执行，不受取消影响
         
-        except Exception as e:
-            logger.error(f"保存对话消息失败: {str(e)}")
-            # 重试一次，但使用标准格式的时间戳
-            try:
-                logger.info("使用标准时间格式重试保存")
-                # 手动创建数据字典
-                data = {
-                    'survey_response_id': response_id,
-                    'speaker_type': speaker_type,
-                    'message_text': message,
-                    'conversation_order': conversation_order,
-                    'created_at': create_iso_timestamp(),
-                    'updated_at': create_iso_timestamp()
-                }
-                
-                # 直接使用DAO插入
-                from ..database.config import get_supabase
-                client = get_supabase()
-                response = client.table('cu_survey_response_conversations').insert(data).execute()
-                
-                if response.data:
-                    logger.info(f"重试保存成功，id={response.data[0]['id']}")
-                    # 使用DAO的格式化函数处理结果
-                    from ..database.dao.utils import format_timestamp
-                    return SurveyResponseConversation(**format_timestamp(response.data[0]))
-                else:
-                    logger.error("重试保存失败，无响应数据")
-                    raise ValueError("无法保存对话记录")
-            except Exception as retry_error:
-                logger.error(f"重试保存也失败: {str(retry_error)}")
-                # 创建一个基本的本地对象作为返回值
-                return SurveyResponseConversation(
-                    id=-1,  # 使用-1表示这是一个本地对象
-                    survey_response_id=response_id,
-                    speaker_type=speaker_type,
-                    message_text=message,
-                    conversation_order=conversation_order,
-                    created_at=datetime.now(),
-                    updated_at=datetime.now()
-                )
+        Args:
+            response_id: 回答ID
+            partial_text: 中断前已生成的文本
+        """
+        if not partial_text:
+            return
+        task = asyncio.ensure_future(self.save_conversation(response_id, "assistant", interrupted_message(partial_text)))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_save_interrupted_done)
+    
+    def _on_save_interrupted_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"保存中断的回复失败: {str(task.exception())}")
     
     def log_conversation_context(self, response_id: int, survey_id: int, questions: List[Dict[str, Any]], history: List[Dict[str, str]], prompt: str, user_message: str = "") -> None:
         """
-        记录对话上下文的完整信息
+        记录对话上下文：摘要信息总是记录，完整的问题、历史和提示词按采样率记录
         
         Args:
             response_id: 回答ID
@@ -247,48 +312,51 @@ class SurveyConversationService:
             prompt: 提示词
             user_message: 用户消息
         """
-        logger.info("================== 对话上下文详细信息 ==================")
-        logger.info(f"response_id: {response_id}, survey_id: {survey_id}")
-        logger.info(f"问题数量: {len(questions)}")
-        logger.info(f"对话历史数量: {len(history)}")
-        logger.info(f"当前用户消息: {user_message if user_message else '无(首次对话)'}")
-        logger.info(f"提示词长度: {len(prompt)} 字符")
-        
-        # 输出完整问题列表和提示词到日志文件
-        try:
-            # 创建完整的上下文数据
-            context_data = {
-                "metadata": {
-                    "timestamp": datetime.now().isoformat(),
-                    "response_id": response_id,
-                    "survey_id": survey_id
-                },
+        log_event(
+            logger, "conversation.context",
+            response_id=response_id,
+            survey_id=survey_id,
+            questions=len(questions),
+            history_messages=len(history),
+            user_message_chars=len(user_message),
+            prompt_chars=len(prompt)
+        )
+        log_payload(
+            logger, "conversation.context.payload",
+            lambda: {
                 "questions": questions,
                 "history": history,
                 "user_message": user_message,
                 "prompt": prompt
-            }
-            
-            # 转换为JSON字符串并记录
-            context_json = json.dumps(context_data, ensure_ascii=False, indent=2)
-            logger.info(f"完整对话上下文JSON:\n{context_json}")
-        except Exception as e:
-            logger.error(f"记录上下文JSON失败: {str(e)}")
-            # 仍然单独记录最重要的信息
-            logger.info(f"完整提示词:\n{prompt}")
-        
-        logger.info("=====================================================")
+            },
+            response_id=response_id,
+            survey_id=survey_id
+        )
+    
+    @property
+    def llm_model_id(self) -> str:
+        """LLM调度使用的模型标识"""
+        return model_id_of(self.llm_provider)
     
-    async def process_conversation(self, response_id: int, user_message: str = "") -> AsyncGenerator[str, None]:
+    async def process_conversation(
+        self,
+        response_id: int,
+        user_message: str = "",
+        llm_permit: Optional[LLMPermit] = None
+    ) -> AsyncGenerator[str, None]:
         """
         处理调查问卷对话，生成LLM响应流
         
         Args:
             response_id: 回答ID
             user_message: 用户消息
+            llm_permit: 调用方已获取的LLM调用许可，不提供时在调用模型前排队获取
             
         Returns:
             LLM响应流
+            
+        Raises:
+            LLMOverloadedError: 排队获取许可时队列已满或超时，此时用户消息不保存
         """
         logger.info(f"开始处理对话: response_id={response_id}, 用户消息长度={len(user_message) if user_message else 0}")
         
@@ -298,26 +366,36 @@ class SurveyConversationService:
             yield validation_result
             return
             
-        survey_id, response = validation_result
+        context = validation_result
         
-        # 如果有用户消息，先保存用户消息
+        # 用户消息只追加到内存历史并进入写后队列，随即开始调用模型，
+        # 写入数据库与流式输出并行进行，在本轮结束前确认落库
+        # 先获取LLM调用许可再保存用户消息，调度器拒绝时不留下没有回复的用户消息，客户端重试也不会重复保存
         if user_message:
+            if llm_permit is None:
+                llm_permit = await llm_scheduler.acquire(self.llm_model_id)
             logger.info("保存用户消息")
-            await self.save_conversation(response_id, "user", user_message)
+            try:
+                await self.save_conversation(response_id, "user", user_message)
+            except BaseException:
+                llm_permit.release()
+                raise
         
         # 处理通用的对话逻辑
-        async for text_chunk in self._process_conversation_common(
-            response_id=response_id,
-            survey_id=survey_id
-        ):
+        async for text_chunk in self._process_conversation_common(context, llm_permit):
             yield text_chunk
 
-    async def process_first_conversation(self, response_id: int) -> AsyncGenerator[str, None]:
+    async def process_first_conversation(
+        self,
+        response_id: int,
+        llm_permit: Optional[LLMPermit] = None
+    ) -> AsyncGenerator[str, None]:
         """
         处理首次调查问卷对话，确保第一条消息是用户角色
         
         Args:
             response_id: 回答ID
+            llm_permit: 调用方已获取的LLM调用许可，不提供时在调用模型前排队获取
             
         Returns:
             LLM响应流
@@ -330,106 +408,134 @@ class SurveyConversationService:
             yield validation_result
             return
             
-        survey_id, response = validation_result
+        context = validation_result
         
         # 检查是否已有对话历史
-        existing_conversations = await SurveyResponseConversationDAO.get_by_response_id(response_id)
-        if existing_conversations:
-            logger.warning(f"该回答已有{len(existing_conversations)}条对话历史，非首次对话")
+        if context.has_messages:
+            logger.warning(f"该回答已有{len(context.history)}条对话历史，非首次对话")
             # 复用普通对话处理逻辑
-            async for text_chunk in self.process_conversation(response_id, ""):
+            async for text_chunk in self.process_conversation(response_id, "", llm_permit):
                 yield text_chunk
             return
         
         # 处理通用的对话逻辑
-        async for text_chunk in self._process_conversation_common(
-            response_id=response_id,
-            survey_id=survey_id
-        ):
+        async for text_chunk in self._process_conversation_common(context, llm_permit):
             yield text_chunk
             
-    async def _validate_response_id(self, response_id: int) -> Union[Tuple[int, Any], str]:
+    async def _validate_response_id(self, response_id: int) -> Union[ConversationContext, str]:
         """
-        验证回答ID并获取相关信息
+        验证回答ID并获取对话上下文
         
         Args:
             response_id: 回答ID
             
         Returns:
-            成功时返回(survey_id, response)元组，失败时返回错误消息
+            成功时返回对话上下文，失败时返回错误消息
         """
-        # 验证response_id存在
-        response = await SurveyResponseDAO.get_by_id(response_id)
-        if not response:
+        try:
+            context = await self.get_conversation_context(response_id)
+        except asyncio.TimeoutError:
+            logger.error(f"加载对话上下文超时: response_id={response_id}")
+            return "错误: 加载对话上下文超时，请稍后重试"
+        if not context:
             logger.error(f"无效的回答ID: {response_id}")
             return "错误: 无效的回答ID"
-        
-        # 获取问卷ID
-        survey_id = await self.get_survey_id_from_response(response_id)
-        if not survey_id:
-            logger.error(f"找不到对应的问卷，response_id={response_id}")
-            return "错误: 找不到对应的问卷"
             
-        return (survey_id, response)
+        return context
             
     async def _process_conversation_common(
         self, 
-        response_id: int, 
-        survey_id: int
+        context: ConversationContext,
+        llm_permit: Optional[LLMPermit] = None
     ) -> AsyncGenerator[str, None]:
         """
         处理对话的通用逻辑
         
         Args:
-            response_id: 回答ID
-            survey_id: 问卷ID
+            context: 对话上下文
+            llm_permit: LLM调用许可，不提供时排队获取；模型调用结束后释放
         Returns:
             LLM响应流
+            
+        Raises:
+            LLMOverloadedError: 排队获取许可时队列已满或超时
+            LLMServiceError: 模型调用失败，错误不作为回复保存
+            ConversationSaveError: 本轮对话消息未能写入数据库
         """
-        # 获取问题列表
-        questions = await self.get_survey_questions(survey_id)
-        logger.info(f"获取到{len(questions)}个问题")
-        
-        # 获取对话历史
-        conversation_history = await self.get_conversation_history(response_id)
-        
-        # 构建提示词
-        prompt = self._build_prompt(questions)
+        response_id = context.response_id
+        prompt = context.prompt
+        # 按token预算截取最近的对话，较早的对话由滚动摘要代替
+        conversation_summary, conversation_history = self.history_manager.build_window(context)
         
         # 记录完整上下文信息
         self.log_conversation_context(
             response_id=response_id,
-            survey_id=survey_id,
-            questions=questions,
+            survey_id=context.survey_id,
+            questions=context.questions,
             history=conversation_history,
             prompt=prompt
         )
         
-        # 调用LLM生成响应
+        # 调用LLM生成响应，并发受调度器限制
+        if llm_permit is None:
+            llm_permit = await llm_scheduler.acquire(self.llm_model_id)
         logger.info("开始调用LLM生成响应")
         response_text = ""
         chunk_count = 0
         
+        failure: Optional[Exception] = None
+        response_metadata: Dict[str, Any] = {}
+        llm_stream = self.llm_provider.generate_stream(
+            prompt,
+            conversation_history,
+            conversation_summary=conversation_summary,
+            response_metadata=response_metadata
+        )
         try:
-            async for text_chunk in self.llm_provider.generate_stream(prompt, conversation_history):
+            async for text_chunk in llm_stream:
                 chunk_count += 1
                 response_text += text_chunk
                 if chunk_count % 10 == 0:  # 每10个片段记录一次日志
                     logger.debug(f"已接收{chunk_count}个文本片段，当前总长度={len(response_text)}")
                 yield text_chunk
             
-            logger.info(f"LLM响应完成，共{chunk_count}个文本片段，总长度={len(response_text)}")
+            logger.info(f"LLM响应完成，共{chunk_count}个文本片段，总长度={len(response_text)}，token用量={response_metadata.get('usage')}")
             
             # 保存LLM响应
             logger.info("保存LLM响应")
             await self.save_conversation(response_id, "assistant", response_text)
             
+            # 对话历史超出预算时在后台生成滚动摘要
+            self.history_manager.schedule_summarization(context)
+            
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开：已生成的部分回复加上中断标记保存，尚未生成文本时不保存
+            logger.info(f"客户端断开，LLM响应中断: response_id={response_id}，已生成{len(response_text)}个字符")
+            self._save_interrupted(response_id, response_text)
+            raise
         except Exception as e:
-            error_msg = f"生成LLM响应出错: {str(e)}"
-            logger.error(error_msg)
-            yield f"[错误] {error_msg}"
-            # 尝试保存错误信息到对话历史
-            try:
-                await self.save_conversation(response_id, "assistant", f"[系统] 生成回答时出错: {str(e)}")
-            except Exception as save_error:
-                logger.error(f"保存错误信息也失败: {str(save_error)}") 
\ No newline at end of file
+            # 错误信息不作为回复保存：与客户端断开时一样，保存已生成的部分回复和中断标记，
+            # 尚未生成任何文本时不保存，单独的中断标记不进入之后的提示词；错误交给调用方，作为SSE错误事件发送
+            logger.error(f"生成LLM响应出错: {str(e)}")
+            failure = e
+            if response_text:
+                try:
+                    await self.save_conversation(response_id, "assistant", interrupted_message(response_text))
+                except Exception as save_error:
+                    logger.error(f"保存中断的回复失败: {str(save_error)}")
+        finally:
+            # 关闭上游流，断开时Bedrock连接随之关闭，停止生成
+            await llm_stream.aclose()
+            # 模型调用结束即归还许可，限流情况反馈给调度器
+            llm_permit.release(
+                throttled=response_metadata.get("throttled", False) or getattr(failure, "throttled", False)
+            )
+        
+        # 本轮的用户消息和回复在流式输出期间已在后台写入，结束前确认全部落库
+        if not await conversation_writer.flush(response_id):
+            logger.error(f"本轮对话消息写入数据库失败: response_id={response_id}")
+            if failure is None:
+                # 作为SSE错误事件发送，不与回复文本混在一起
+                raise ConversationSaveError("对话记录保存失败，请稍后重试")
+        if failure is not None:
+            raise failure
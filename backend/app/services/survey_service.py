@@ -3,7 +3,8 @@
 负责处理业务逻辑，调用DAO层进行数据操作
 """
 
-from typing import List, Dict, Any, Optional, Union
+import logging
+from typing import List, Dict, Any, Optional, Tuple, Union
 from ..database.dao import (
     SurveyDAO, 
     SurveyQuestionDAO, 
@@ -15,8 +16,14 @@ from ..database.schemas import (
     SurveyQuestion, SurveyQuestionCreate, SurveyQuestionUpdate,
     SurveyResponse, SurveyResponseCreate, SurveyResponseUpdate,
     SurveyResponseConversation, SurveyResponseConversationCreate,
-    SurveyWithQuestions, SurveyResponseWithConversations
+    SurveyWithQuestions, SurveyResponseWithConversations, SurveyResponseStats
 )
+from .stats_cache import survey_stats_cache
+from .survey_conversation_service import SurveyConversationService
+from .conversation_writer import conversation_writer
+
+# 配置日志
+logger = logging.getLogger(__name__)
 
 
 class SurveyService:
@@ -38,16 +45,35 @@ class SurveyService:
         limit: int = 100,
         offset: int = 0,
         status: Optional[str] = None,
-        user_id: Optional[str] = None
-    ) -> List[Survey]:
-        """获取所有问卷列表"""
-        return await SurveyDAO.get_all(limit, offset, status, user_id)
+        user_id: Optional[str] = None,
+        raw: bool = False
+    ) -> Union[List[Survey], List[Dict[str, Any]]]:
+        """获取所有问卷列表，raw为True时返回字典"""
+        return await SurveyDAO.get_all(limit, offset, status, user_id, raw)
+    
+    @staticmethod
+    async def get_surveys_page(
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        user_id: Optional[str] = None,
+        raw: bool = False
+    ) -> Tuple[Union[List[Survey], List[Dict[str, Any]]], Optional[str]]:
+        """游标分页获取问卷列表，返回(问卷列表, 下一页游标)，raw为True时问卷为字典"""
+        return await SurveyDAO.get_page(limit, cursor, status, user_id, raw)
     
     @staticmethod
     async def update_survey(survey_id: int, survey_data: Dict[str, Any]) -> Optional[Survey]:
         """更新问卷信息"""
         survey_update = SurveyUpdate(**survey_data)
-        return await SurveyDAO.update(survey_id, survey_update)
+        survey = await SurveyDAO.update(survey_id, survey_update)
+        # 问卷发布时预热提示词缓存，首批答题者无需等待提示词编译
+        if survey and survey_update.status == "published":
+            try:
+                await SurveyConversationService.warm_prompt_cache(survey_id)
+            except Exception as e:
+                logger.warning(f"预热提示词缓存失败: survey_id={survey_id}, 错误: {str(e)}")
+        return survey
     
     @staticmethod
     async def delete_survey(survey_id: int) -> bool:
@@ -115,6 +141,29 @@ class SurveyResponseService:
         """获取问卷的所有回答"""
         return await SurveyResponseDAO.get_by_survey_id(survey_id, limit, offset, status)
     
+    @staticmethod
+    async def get_responses_page(
+        survey_id: int,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        raw: bool = False
+    ) -> Tuple[Union[List[SurveyResponse], List[Dict[str, Any]]], Optional[str]]:
+        """游标分页获取问卷的回答，返回(回答列表, 下一页游标)，raw为True时回答为字典"""
+        return await SurveyResponseDAO.get_page_by_survey_id(survey_id, limit, cursor, status, raw)
+    
+    @staticmethod
+    async def get_survey_stats(survey_id: int) -> SurveyResponseStats:
+        """获取问卷的回答统计（数据库聚合，短时间缓存）"""
+        stats = await survey_stats_cache.get_many([survey_id], SurveyResponseDAO.get_stats)
+        return stats[survey_id]
+    
+    @staticmethod
+    async def get_surveys_stats(survey_ids: List[int]) -> List[SurveyResponseStats]:
+        """批量获取多个问卷的回答统计，按传入顺序返回"""
+        stats = await survey_stats_cache.get_many(survey_ids, SurveyResponseDAO.get_stats)
+        return [stats[survey_id] for survey_id in dict.fromkeys(survey_ids)]
+    
     @staticmethod
     async def update_response(response_id: int, response_data: Dict[str, Any]) -> Optional[SurveyResponse]:
         """更新问卷回答信息"""
@@ -128,7 +177,8 @@ class SurveyResponseService:
     
     @staticmethod
     async def get_response_with_conversations(response_id: int) -> Optional[SurveyResponseWithConversations]:
-        """获取问卷回答及其所有对话"""
+        """获取问卷回答及其所有对话，先写入写后队列中该回答尚未落库的消息"""
+        await conversation_writer.flush(response_id)
         return await SurveyResponseDAO.get_with_conversations(response_id)
     
     @staticmethod
@@ -0,0 +1,137 @@
+"""
+跨worker的对话轮次互斥
+进程内的并发请求由生成登记表去重和排队；多worker部署时再通过数据库中的租约行，
+保证同一回答同一时间只在一个worker上生成回复。默认关闭，通过CHAT_TURN_LEASE开启
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import AsyncGenerator, AsyncIterator, Optional
+
+from ..database.async_client import APIError
+from ..database.dao import SurveyResponseDAO
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 是否启用跨worker租约（需要先执行migrations/006_response_turn_leases.sql）
+CHAT_TURN_LEASE = os.environ.get("CHAT_TURN_LEASE", "false").lower() == "true"
+# 租约有效期(秒)，持有期间每隔三分之一有效期续约一次
+CHAT_TURN_LEASE_TTL = int(os.environ.get("CHAT_TURN_LEASE_TTL", "60"))
+# 租约被其他轮次占用时最多等待的时间(秒)
+CHAT_TURN_LEASE_WAIT = float(os.environ.get("CHAT_TURN_LEASE_WAIT", "30"))
+# 等待期间重试获取租约的间隔(秒)
+CHAT_TURN_LEASE_POLL_INTERVAL = float(os.environ.get("CHAT_TURN_LEASE_POLL_INTERVAL", "0.5"))
+
+# PostgREST错误码：数据库函数不存在
+FUNCTION_NOT_FOUND = "PGRST202"
+
+# 本进程的标识，与每轮的随机后缀组成租约持有者
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class TurnLease:
+    """对话轮次租约"""
+
+    def __init__(
+        self,
+        enabled: bool = CHAT_TURN_LEASE,
+        ttl: int = CHAT_TURN_LEASE_TTL,
+        wait: float = CHAT_TURN_LEASE_WAIT,
+        poll_interval: float = CHAT_TURN_LEASE_POLL_INTERVAL
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    async def run_exclusive(
+        self,
+        response_id: int,
+        turn_key: str,
+        chunks: AsyncIterator[str]
+    ) -> AsyncGenerator[str, None]:
+        """
+        持有租约期间输出chunks，结束或取消时释放租约
+
+        其他worker正在处理相同的轮次时直接返回提示，不重复调用模型；
+        处理的是另一轮时等待其结束，超过等待时间仍未获得租约时返回提示。
+        租约函数未部署或数据库出错时不做互斥，照常处理。
+
+        Args:
+            response_id: 回答ID
+            turn_key: 本轮对话的标识
+            chunks: 本轮对话的文本片段
+
+        Returns:
+            文本片段
+        """
+        if not self.enabled:
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        holder = f"{_WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        error = await self._acquire(response_id, holder, turn_key)
+        if error:
+            yield error
+            return
+
+        heartbeat = asyncio.ensure_future(self._renew(response_id, holder, turn_key))
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            heartbeat.cancel()
+            try:
+                await SurveyResponseDAO.release_turn_lease(response_id, holder)
+            except Exception as e:
+                # 释放失败时租约到期后自动失效
+                logger.warning(f"释放对话轮次租约失败: response_id={response_id}: {str(e)}")
+
+    async def _acquire(self, response_id: int, holder: str, turn_key: str) -> Optional[str]:
+        """获取租约，成功或放弃互斥时返回None，否则返回给客户端的提示"""
+        deadline = asyncio.get_running_loop().time() + self.wait
+        while True:
+            try:
+                acquired, current_turn_key = await SurveyResponseDAO.acquire_turn_lease(
+                    response_id, holder, turn_key, self.ttl
+                )
+            except APIError as e:
+                if e.code == FUNCTION_NOT_FOUND:
+                    self.enabled = False
+                    logger.warning("数据库函数acquire_response_turn_lease不存在，关闭跨worker对话互斥")
+                else:
+                    logger.error(f"获取对话轮次租约失败，本轮不做跨worker互斥: {str(e)}")
+                return None
+            except Exception as e:
+                logger.error(f"获取对话轮次租约失败，本轮不做跨worker互斥: {str(e)}")
+                return None
+
+            if acquired:
+                return None
+            if current_turn_key == turn_key:
+                logger.info(f"相同的对话轮次正在其他worker上处理: response_id={response_id}")
+                return "[错误] 相同的消息正在处理中，请勿重复提交"
+            if asyncio.get_running_loop().time() >= deadline:
+                logger.warning(f"等待对话轮次租约超时: response_id={response_id}")
+                return "[错误] 上一轮对话仍在处理中，请稍后重试"
+            await asyncio.sleep(self.poll_interval)
+
+    async def _renew(self, response_id: int, holder: str, turn_key: str) -> None:
+        """持有期间定期续约"""
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                acquired, _ = await SurveyResponseDAO.acquire_turn_lease(response_id, holder, turn_key, self.ttl)
+                if not acquired:
+                    logger.warning(f"对话轮次租约已被其他worker取得: response_id={response_id}")
+            except Exception as e:
+                logger.warning(f"续约对话轮次租约失败: response_id={response_id}: {str(e)}")
+
+
+# 进程内共享的对话轮次租约
+turn_lease = TurnLease()
@@ -0,0 +1,4 @@
+"""
+基准测试
+使用本地的假LLM提供商和内存PostgREST服务驱动FastAPI应用，测量吞吐和延迟
+"""
@@ -0,0 +1,394 @@
+"""
+基准测试用的本地替身
+FakeLLMProvider按配置的首字延迟和输出速度流式返回文本；
+InMemoryPostgREST以httpx传输层的形式实现PostgREST的常用查询语法，数据保存在内存中
+"""
+
+import asyncio
+import datetime
+import itertools
+import json
+import random
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import httpx
+
+from app.services.llm_service import LLMProvider, LLMResponse
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    假LLM提供商
+
+    首个片段在ttft秒(附带jitter比例的随机抖动)后返回，此后按tokens_per_second的速度
+    逐个返回output_tokens个片段，每个片段视为1个token
+    """
+
+    def __init__(
+        self,
+        ttft: float = 0.3,
+        tokens_per_second: float = 80.0,
+        output_tokens: int = 60,
+        jitter: float = 0.1,
+        **kwargs: Any
+    ):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+
+    def _delay(self, seconds: float) -> float:
+        if self.jitter <= 0:
+            return seconds
+        return max(0.0, seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def generate_stream(self, prompt: str, conversation_history: List[Dict[str, str]] = None, **kwargs) -> Any:
+        response_metadata = kwargs.get("response_metadata")
+        await asyncio.sleep(self._delay(self.ttft))
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i in range(self.output_tokens):
+            if i:
+                await asyncio.sleep(interval)
+            yield "字"
+        if response_metadata is not None:
+            response_metadata["usage"] = {
+                "input_tokens": len(prompt) // 4,
+                "output_tokens": self.output_tokens,
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0
+            }
+
+    async def generate(self, prompt: str, conversation_history: List[Dict[str, str]] = None, **kwargs) -> LLMResponse:
+        await asyncio.sleep(self._delay(self.ttft + self.output_tokens / max(self.tokens_per_second, 1e-9)))
+        return LLMResponse(text="字" * self.output_tokens, metadata={})
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _coerce(value: str) -> Any:
+    """把查询参数中的值转换为可比较的Python值"""
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        # 加引号的值与未加引号时一样按列类型比较
+        value = value[1:-1].replace('\\"', '"')
+    if value == "null":
+        return None
+    if value in ("true", "false"):
+        return value == "true"
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _compare(left: Any, right: Any) -> Tuple[Any, Any]:
+    """使两个值可以比较：类型不一致时都按字符串比较"""
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left, right
+    return str(left), str(right)
+
+
+class InMemoryPostgREST:
+    """
+    内存PostgREST服务
+
+    支持select列、eq/neq/gt/gte/lt/lte/is/in过滤、order、limit/offset、
+    Prefer: count=exact与HEAD计数、insert/upsert(merge/ignore-duplicates)/update/delete，
+    register_unique登记的唯一约束，以及通过register_rpc注册的RPC函数；
+    select中的嵌入资源(alias:table(*))按register_foreign_key登记的外键关联，
+    支持alias.order/alias.limit
+    """
+
+    _RESERVED = {"select", "order", "limit", "offset", "columns", "on_conflict"}
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency: 每个请求的模拟往返延迟(秒)
+        """
+        self.latency = latency
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.rpcs: Dict[str, Callable[["InMemoryPostgREST", Dict[str, Any]], Any]] = {}
+        self.request_count = 0
+        self._ids = itertools.count(1)
+        # (子表, 父表) -> 外键列
+        self.foreign_keys: Dict[Tuple[str, str], str] = {}
+        # 表 -> 唯一约束列组
+        self.unique_keys: Dict[str, List[Tuple[str, ...]]] = {}
+        self.register_unique("cu_survey_response_conversations", "survey_response_id", "conversation_order")
+        self.register_unique("cu_survey_response_conversations", "client_message_id")
+        self.register_foreign_key("cu_survey_questions", "survey_id", "cu_survey")
+        self.register_foreign_key("cu_survey_responses", "survey_id", "cu_survey")
+        self.register_foreign_key("cu_survey_response_conversations", "survey_response_id", "cu_survey_responses")
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        """获取表的行列表（不存在时创建空表）"""
+        return self.tables.setdefault(table, [])
+
+    def insert_row(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        """直接插入一行，自动补充id和时间戳（不检查唯一约束）"""
+        row = self._new_row(row)
+        self.rows(table).append(row)
+        return row
+
+    def _new_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(row)
+        row.setdefault("id", next(self._ids))
+        now = _now()
+        row.setdefault("created_at", now)
+        row.setdefault("updated_at", now)
+        return row
+
+    def register_unique(self, table: str, *columns: str) -> None:
+        """登记唯一约束，通过接口插入违反约束的行时返回23505错误"""
+        self.unique_keys.setdefault(table, []).append(tuple(columns))
+
+    def _unique_violation(self, table: str, item: Dict[str, Any], rows: List[Dict[str, Any]]) -> Optional[str]:
+        """返回item违反的唯一约束列，值为空的约束不参与比较"""
+        for columns in [("id",)] + self.unique_keys.get(table, []):
+            if any(item.get(c) is None for c in columns):
+                continue
+            if any(all(r.get(c) == item[c] for c in columns) for r in rows):
+                return ",".join(columns)
+        return None
+
+    def register_rpc(self, name: str, func: Callable[["InMemoryPostgREST", Dict[str, Any]], Any]) -> None:
+        """注册RPC函数，func接收(服务实例, 参数)并返回响应数据"""
+        self.rpcs[name] = func
+
+    def register_foreign_key(self, child_table: str, column: str, parent_table: str) -> None:
+        """登记外键，用于解析嵌入查询"""
+        self.foreign_keys[(child_table, parent_table)] = column
+
+    def transport(self) -> httpx.MockTransport:
+        """创建指向本服务的httpx传输层（每次请求时查找handle，便于测试中替换）"""
+        return httpx.MockTransport(lambda request: self.handle(request))
+
+    @staticmethod
+    def _split_top_level(text: str) -> List[str]:
+        """按顶层逗号切分逻辑条件，忽略括号和双引号内的逗号"""
+        parts, depth, quoted, current = [], 0, False, []
+        for i, ch in enumerate(text):
+            if ch == '"' and (i == 0 or text[i - 1] != "\\"):
+                quoted = not quoted
+            elif not quoted and ch == "(":
+                depth += 1
+            elif not quoted and ch == ")":
+                depth -= 1
+            elif not quoted and ch == "," and depth == 0:
+                parts.append("".join(current))
+                current = []
+                continue
+            current.append(ch)
+        if current:
+            parts.append("".join(current))
+        return parts
+
+    @staticmethod
+    def _condition(column: str, value: str) -> Callable[[Dict[str, Any]], bool]:
+        """把 "op.value" 形式的条件转换为行判断函数"""
+        negate = value.startswith("not.")
+        if negate:
+            value = value[4:]
+        op, raw = value.split(".", 1)
+
+        def check(row: Dict[str, Any]) -> bool:
+            current = row.get(column)
+            if op == "in":
+                candidates = [_coerce(v) for v in raw.strip("()").split(",") if v]
+                result = any(_compare(current, c)[0] == _compare(current, c)[1] for c in candidates)
+            elif op == "is":
+                result = current is _coerce(raw)
+            elif current is None:
+                result = False
+            else:
+                left, right = _compare(current, _coerce(raw))
+                result = {
+                    "eq": left == right,
+                    "neq": left != right,
+                    "gt": left > right,
+                    "gte": left >= right,
+                    "lt": left < right,
+                    "lte": left <= right,
+                }[op]
+            return result != negate
+
+        return check
+
+    def _logic(self, operator: str, text: str) -> Callable[[Dict[str, Any]], bool]:
+        """解析 or(...) / and(...) 逻辑条件"""
+        checks = []
+        for part in self._split_top_level(text[1:-1]):
+            if part.startswith(("or(", "and(")):
+                name, rest = part.split("(", 1)
+                checks.append(self._logic(name, "(" + rest))
+            else:
+                column, value = part.split(".", 1)
+                checks.append(self._condition(column, value))
+        combine = any if operator == "or" else all
+        return lambda row: combine(check(row) for check in checks)
+
+    def _matcher(self, params: List[Tuple[str, str]]) -> Callable[[Dict[str, Any]], bool]:
+        checks = []
+        for key, value in params:
+            if key in ("or", "and"):
+                checks.append(self._logic(key, value))
+            elif key not in self._RESERVED and "." not in key and "." in value:
+                checks.append(self._condition(key, value))
+        return lambda row: all(check(row) for check in checks)
+
+    @staticmethod
+    def _order(rows: List[Dict[str, Any]], spec: str) -> List[Dict[str, Any]]:
+        for part in reversed(spec.split(",")):
+            pieces = part.split(".")
+            column = pieces[0]
+            desc = "desc" in pieces[1:]
+            present = [r for r in rows if r.get(column) is not None]
+            missing = [r for r in rows if r.get(column) is None]
+            present.sort(key=lambda r: r[column], reverse=desc)
+            nullsfirst = "nullsfirst" in pieces[1:] or (desc and "nullslast" not in pieces[1:])
+            rows = missing + present if nullsfirst else present + missing
+        return rows
+
+    def _project(
+        self,
+        table: str,
+        rows: List[Dict[str, Any]],
+        select: str,
+        query: Dict[str, str]
+    ) -> List[Dict[str, Any]]:
+        columns, embeds = [], []
+        for part in self._split_top_level(select or "*"):
+            part = part.strip()
+            if "(" in part:
+                head, inner = part[:-1].split("(", 1)
+                alias, _, target = head.rpartition(":")
+                embeds.append((alias or target, target, inner))
+            else:
+                columns.append(part)
+
+        result = []
+        for row in rows:
+            if "*" in columns:
+                item = dict(row)
+            else:
+                item = {c: row.get(c) for c in columns}
+            for alias, target, inner in embeds:
+                item[alias] = self._embed(table, row, alias, target, inner, query)
+            result.append(item)
+        return result
+
+    def _embed(
+        self,
+        table: str,
+        row: Dict[str, Any],
+        alias: str,
+        target: str,
+        select: str,
+        query: Dict[str, str]
+    ) -> Any:
+        """按外键解析一行的嵌入资源：子表返回列表，父表返回单个对象"""
+        if (target, table) in self.foreign_keys:
+            column = self.foreign_keys[(target, table)]
+            children = [r for r in self.rows(target) if r.get(column) == row.get("id")]
+            if f"{alias}.order" in query:
+                children = self._order(children, query[f"{alias}.order"])
+            offset = int(query.get(f"{alias}.offset", 0))
+            end = offset + int(query[f"{alias}.limit"]) if f"{alias}.limit" in query else None
+            return self._project(target, children[offset:end], select, {})
+        if (table, target) in self.foreign_keys:
+            column = self.foreign_keys[(table, target)]
+            parents = [r for r in self.rows(target) if r.get("id") == row.get(column)]
+            projected = self._project(target, parents, select, {})
+            return projected[0] if projected else None
+        raise ValueError(f"no relationship between {table} and {target}")
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """处理一个PostgREST请求"""
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        path = request.url.path.split("/rest/v1/", 1)[-1]
+        params = parse_qsl(request.url.query.decode(), keep_blank_values=True)
+        query = dict(params)
+        prefer = request.headers.get("prefer", "")
+        body = json.loads(request.content) if request.content else None
+
+        if path.startswith("rpc/"):
+            name = path[4:]
+            if name not in self.rpcs:
+                return httpx.Response(404, json={"message": f"function {name} not found", "code": "PGRST202"})
+            return httpx.Response(200, json=self.rpcs[name](self, body or {}))
+
+        rows = self.rows(path)
+        match = self._matcher(params)
+
+        if request.method in ("GET", "HEAD"):
+            result = [r for r in rows if match(r)]
+            total = len(result)
+            if "order" in query:
+                result = self._order(result, query["order"])
+            offset = int(query.get("offset", 0))
+            end = offset + int(query["limit"]) if "limit" in query else None
+            try:
+                result = self._project(path, result[offset:end], query.get("select", "*"), query)
+            except ValueError as e:
+                return httpx.Response(400, json={"message": str(e), "code": "PGRST200"})
+            headers = {}
+            if "count=exact" in prefer:
+                headers["content-range"] = f"{offset}-{offset + len(result) - 1}/{total}" if result else f"*/{total}"
+            if request.method == "HEAD":
+                return httpx.Response(200, headers=headers)
+            return httpx.Response(200, json=result, headers=headers)
+
+        if request.method == "POST":
+            # 整条语句要么全部生效，要么因唯一约束冲突全部不生效
+            items = body if isinstance(body, list) else [body]
+            merge = "resolution=merge-duplicates" in prefer
+            ignore = "resolution=ignore-duplicates" in prefer
+            conflict = tuple(query.get("on_conflict", "id").split(","))
+            staged: List[Dict[str, Any]] = []
+            merges: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+            for item in items:
+                existing = None
+                if (merge or ignore) and all(item.get(c) is not None for c in conflict):
+                    existing = next(
+                        (r for r in rows + staged if all(r.get(c) == item[c] for c in conflict)), None
+                    )
+                if existing is not None:
+                    if merge:
+                        merges.append((existing, item))
+                    continue
+                row = self._new_row(item)
+                violated = self._unique_violation(path, row, rows + staged)
+                if violated:
+                    return httpx.Response(409, json={
+                        "message": f"duplicate key value violates unique constraint ({violated})", "code": "23505"
+                    })
+                staged.append(row)
+            for existing, item in merges:
+                existing.update(item)
+            rows.extend(staged)
+            return httpx.Response(201, json=[existing for existing, _ in merges] + staged)
+
+        if request.method == "PATCH":
+            updated = []
+            for row in rows:
+                if match(row):
+                    row.update(body or {})
+                    updated.append(row)
+            return httpx.Response(200, json=updated)
+
+        if request.method == "DELETE":
+            deleted = [r for r in rows if match(r)]
+            self.tables[path] = [r for r in rows if not match(r)]
+            return httpx.Response(200, json=deleted)
+
+        return httpx.Response(405, json={"message": f"unsupported method {request.method}"})
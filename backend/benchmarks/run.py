@@ -0,0 +1,348 @@
+"""
+基准测试入口
+在后台线程中用uvicorn启动应用(LLM和Supabase替换为本地假服务)，
+并发驱动 /chat、/first_chat 和 /surveys 请求，统计p50/p95/p99延迟、首字延迟(TTFT)和RPS
+
+用法(在backend目录下):
+  python -m benchmarks.run
+  python -m benchmarks.run --scenarios chat --concurrency 50 --requests 500
+  python -m benchmarks.run --save benchmarks/baselines/default.json
+  python -m benchmarks.run --compare benchmarks/baselines/default.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+# 必须在导入应用模块之前设置
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+import uvicorn
+
+from app.database import set_supabase
+from app.database.async_client import AsyncSupabaseClient
+from app.services.llm_service import LLMFactory
+
+from .fakes import FakeLLMProvider, InMemoryPostgREST
+
+SCENARIOS = ("first_chat", "chat", "surveys")
+
+# 与基线比较的指标: (指标路径, 越大越好)
+COMPARED_METRICS = (
+    (("rps", ), True),
+    (("latency_ms", "p95"), False),
+    (("ttft_ms", "p95"), False),
+)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """把秒为单位的样本汇总为毫秒百分位"""
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "max": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+class ServerThread(threading.Thread):
+    """在后台线程的独立事件循环中运行uvicorn"""
+
+    def __init__(self, app: Any):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        config = uvicorn.Config(app, log_level="warning", lifespan="on", timeout_keep_alive=30)
+        self.server = uvicorn.Server(config)
+        # 信号由主线程处理
+        self.server.install_signal_handlers = lambda: None
+
+    def run(self) -> None:
+        asyncio.run(self.server.serve(sockets=[self.sock]))
+
+    def wait_started(self, timeout: float = 10.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.is_alive():
+                raise RuntimeError("基准测试服务启动失败")
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.join(timeout=10)
+
+
+class Fixture:
+    """预置数据：一个已发布的问卷及其问题，按需创建回答记录"""
+
+    def __init__(self, db: InMemoryPostgREST, question_count: int, survey_count: int):
+        self.db = db
+        self.survey_ids = []
+        for i in range(survey_count):
+            survey = db.insert_row("cu_survey", {
+                "title": f"基准问卷{i + 1}",
+                "description": "基准测试数据",
+                "status": "published",
+                "language": "zh",
+                "user_id": "bench",
+            })
+            self.survey_ids.append(survey["id"])
+            for order in range(1, question_count + 1):
+                db.insert_row("cu_survey_questions", {
+                    "survey_id": survey["id"],
+                    "question_text": f"问题{order}：请谈谈你对这个方面的看法？",
+                    "question_order": order,
+                    "question_type": "text",
+                    "followup_count": 1,
+                    "question_objectives": "了解受访者的真实体验",
+                })
+
+    def new_response(self) -> int:
+        row = self.db.insert_row("cu_survey_responses", {
+            "survey_id": self.survey_ids[0],
+            "respondent_identifier": "bench",
+            "status": "pending",
+            "conversation_summary": None,
+            "summary_through_order": 0,
+        })
+        return row["id"]
+
+
+async def sse_request(client: httpx.AsyncClient, path: str, payload: Dict[str, Any]) -> Optional[float]:
+    """
+    发送SSE请求并读完整个流
+
+    Returns:
+        首个数据事件的到达时间(perf_counter)，流中没有数据时返回None
+    """
+    first_event = None
+    async with client.stream("POST", path, json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            if line.strip() == "data: [DONE]":
+                break
+            if first_event is None:
+                first_event = time.perf_counter()
+    return first_event
+
+
+def make_request_fn(scenario: str, fixture: Fixture, worker_id: int) -> Callable[[httpx.AsyncClient, int], Any]:
+    """创建单个worker的请求函数，返回TTFT时间点或None"""
+    if scenario == "first_chat":
+        async def first_chat(client: httpx.AsyncClient, i: int) -> Optional[float]:
+            response_id = fixture.new_response()
+            return await sse_request(client, "/api/v1/survey-conversations/first_chat", {"response_id": response_id})
+        return first_chat
+
+    if scenario == "chat":
+        # 每个worker固定使用一个回答，模拟一名受访者连续作答
+        response_id = fixture.new_response()
+
+        async def chat(client: httpx.AsyncClient, i: int) -> Optional[float]:
+            message = f"这是第{i}轮的回答，我觉得整体体验还不错，但也有一些可以改进的地方。"
+            return await sse_request(
+                client, "/api/v1/survey-conversations/chat",
+                {"response_id": response_id, "message": message}
+            )
+        return chat
+
+    async def surveys(client: httpx.AsyncClient, i: int) -> None:
+        if i % 2 == 0:
+            response = await client.get("/api/v1/surveys/", params={"limit": 50})
+        else:
+            survey_id = fixture.survey_ids[i % len(fixture.survey_ids)]
+            response = await client.get(f"/api/v1/surveys/{survey_id}/with-questions")
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        return None
+    return surveys
+
+
+async def run_scenario(
+    base_url: str,
+    scenario: str,
+    fixture: Fixture,
+    concurrency: int,
+    total_requests: int
+) -> Dict[str, Any]:
+    """以固定并发数发送total_requests个请求并汇总结果"""
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors: List[str] = []
+    counter = iter(range(total_requests))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def worker(worker_id: int) -> None:
+            request_fn = make_request_fn(scenario, fixture, worker_id)
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    first_event = await request_fn(client, i)
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if first_event is not None:
+                    ttfts.append(first_event - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    result = {
+        "requests": total_requests,
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": summarize(latencies),
+    }
+    if ttfts:
+        result["ttft_ms"] = summarize(ttfts)
+    if errors:
+        result["sample_errors"] = sorted(set(errors))[:5]
+    return result
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线比较，返回退化的指标描述"""
+    regressions = []
+    for scenario, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            now, before = current, previous
+            for key in path:
+                now = now.get(key) if isinstance(now, dict) else None
+                before = before.get(key) if isinstance(before, dict) else None
+            if not now or not before:
+                continue
+            change = (now - before) / before
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            name = f"{scenario}.{'.'.join(path)}"
+            print(f"  {name:<28} 基线={before:<10} 当前={now:<10} 变化={change:+.1%}{'  <-- 退化' if regressed else ''}")
+            if regressed:
+                regressions.append(name)
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Curio后端基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景: first_chat,chat,surveys")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发请求数")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求总数")
+    parser.add_argument("--ttft", type=float, default=0.3, help="假LLM首字延迟(秒)")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="假LLM输出速度(token/秒)")
+    parser.add_argument("--output-tokens", type=int, default=60, help="假LLM每次输出的token数")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="内存PostgREST每个请求的模拟延迟(秒)")
+    parser.add_argument("--questions", type=int, default=8, help="问卷的问题数量")
+    parser.add_argument("--surveys", type=int, default=50, help="预置的问卷数量")
+    parser.add_argument("--save", help="把结果写入JSON基线文件")
+    parser.add_argument("--compare", help="与JSON基线文件比较，出现退化时以非零状态退出")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="比较基线时允许的相对变化")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"未知场景: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    llm_settings = {
+        "ttft": args.ttft,
+        "tokens_per_second": args.tokens_per_second,
+        "output_tokens": args.output_tokens,
+    }
+    LLMFactory.register_provider("fake", lambda **kwargs: FakeLLMProvider(**llm_settings))
+
+    db = InMemoryPostgREST(latency=args.db_latency)
+    set_supabase(AsyncSupabaseClient("http://postgrest.local", "bench-key", transport=db.transport()))
+    fixture = Fixture(db, args.questions, args.surveys)
+
+    from app.main import app
+
+    server = ServerThread(app)
+    server.start()
+    server.wait_started()
+    base_url = f"http://127.0.0.1:{server.port}"
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "db_latency_s": args.db_latency,
+            "llm": llm_settings,
+        },
+        "scenarios": {},
+    }
+    try:
+        for scenario in scenarios:
+            db_requests = db.request_count
+            result = asyncio.run(run_scenario(base_url, scenario, fixture, args.concurrency, args.requests))
+            result["db_requests_per_request"] = round((db.request_count - db_requests) / max(args.requests, 1), 2)
+            report["scenarios"][scenario] = result
+            ttft = result.get("ttft_ms", {}).get("p50")
+            print(
+                f"{scenario:<11} rps={result['rps']:<8} "
+                f"p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms "
+                f"p99={result['latency_ms']['p99']}ms"
+                + (f" ttft_p50={ttft}ms" if ttft is not None else "")
+                + f" errors={result['errors']}"
+            )
+    finally:
+        server.stop()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"结果已保存: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"与基线比较: {args.compare} (容差 {args.tolerance:.0%})")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"性能退化: {', '.join(regressions)}")
+            return 1
+        print("未发现性能退化")
+
+    if any(result["errors"] for result in report["scenarios"].values()):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
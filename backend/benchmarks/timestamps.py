@@ -0,0 +1,99 @@
+"""
+时间戳解析微基准
+对比逐行的旧版format_timestamp实现与批量的format_timestamps，
+输入为PostgREST常见的几种时间戳格式
+
+用法(在backend目录下):
+  python -m benchmarks.timestamps
+  python -m benchmarks.timestamps --rows 50000 --repeat 7
+"""
+
+import argparse
+import copy
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+from app.database.dao.utils import format_timestamps
+
+
+def legacy_format_timestamp(data: Dict[str, Any]) -> Dict[str, Any]:
+    """改写前的format_timestamp，仅用于对比"""
+    for field in ("created_at", "updated_at"):
+        if field in data and data[field]:
+            try:
+                timestamp = data[field]
+                if 'Z' in timestamp:
+                    timestamp = timestamp.replace('Z', '+00:00')
+                if '.' in timestamp and '+' in timestamp:
+                    parts = timestamp.split('+')
+                    time_part = parts[0]
+                    zone_part = '+' + parts[1]
+                    if '.' in time_part:
+                        time_parts = time_part.split('.')
+                        if len(time_parts[1]) > 6:
+                            time_parts[1] = time_parts[1][:6]
+                        time_part = '.'.join(time_parts)
+                    timestamp = time_part + zone_part
+                data[field] = datetime.fromisoformat(timestamp)
+            except Exception:
+                data[field] = datetime.now()
+    return data
+
+
+def make_rows(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """生成测试数据，大部分为标准格式，少量为Z后缀和非6位小数"""
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        moment = base + timedelta(seconds=rng.randint(0, 10 ** 8), microseconds=rng.randint(0, 999999))
+        created = moment.isoformat(timespec="microseconds")
+        kind = rng.random()
+        if kind < 0.1:
+            created = created.replace("+00:00", "Z")
+        elif kind < 0.2:
+            created = created[:23] + "+00:00"
+        rows.append({"id": i, "created_at": created, "updated_at": moment.isoformat(timespec="microseconds")})
+    return rows
+
+
+def measure(func: Callable[[List[Dict[str, Any]]], Any], rows: List[Dict[str, Any]], repeat: int) -> List[float]:
+    """每轮使用数据副本，返回每轮耗时(秒)"""
+    timings = []
+    for _ in range(repeat):
+        batch = copy.deepcopy(rows)
+        start = time.perf_counter()
+        func(batch)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="时间戳解析微基准")
+    parser.add_argument("--rows", type=int, default=20000, help="每轮行数")
+    parser.add_argument("--repeat", type=int, default=5, help="轮数")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    # 两种实现的结果必须一致
+    expected = [legacy_format_timestamp(dict(r)) for r in rows[:1000]]
+    actual = format_timestamps([dict(r) for r in rows[:1000]], strict=True)
+    assert expected == actual, "format_timestamps结果与旧实现不一致"
+
+    results = {
+        "legacy": measure(lambda batch: [legacy_format_timestamp(r) for r in batch], rows, args.repeat),
+        "batched": measure(lambda batch: format_timestamps(batch, strict=True), rows, args.repeat),
+    }
+    legacy = statistics.median(results["legacy"])
+    print(f"{'实现':<10}{'中位耗时(ms)':>14}{'每行(µs)':>12}{'加速比':>10}")
+    for name, timings in results.items():
+        median = statistics.median(timings)
+        print(f"{name:<10}{median * 1000:>14.2f}{median / args.rows * 1e6:>12.3f}{legacy / median:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+测试公共夹具
+"""
+
+import pytest
+
+from app.database import set_supabase
+from app.database.async_client import AsyncSupabaseClient
+from benchmarks.fakes import InMemoryPostgREST
+
+
+@pytest.fixture
+def fake_db():
+    """把DAO指向内存PostgREST，测试结束后恢复"""
+    db = InMemoryPostgREST()
+    set_supabase(AsyncSupabaseClient("http://postgrest.test", "test-key", http2=False, transport=db.transport()))
+    yield db
+    set_supabase(None)
+
+
+@pytest.fixture(autouse=True)
+def reset_sse_exit_event():
+    """sse_starlette把退出事件保存在类属性上并绑定到首次使用时的事件循环，每个测试使用新的事件循环"""
+    from sse_starlette.sse import AppStatus
+
+    AppStatus.should_exit_event = None
+    yield
+    AppStatus.should_exit_event = None
@@ -0,0 +1,137 @@
+"""
+BedrockProvider测试：流式读取，以及请求体中的提示词缓存断点
+用假的Bedrock客户端验证工作线程与事件循环之间的交接：片段不重复、不丢失，
+消费者取消时立即关闭阻塞中的响应流
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from app.services import llm_service
+from app.services.llm_service import BedrockProvider
+
+
+def _event(text):
+    chunk = {"type": "content_block_delta", "delta": {"text": text}}
+    return {"chunk": {"bytes": json.dumps(chunk).encode("utf-8")}}
+
+
+class FakeEventStream:
+    """按顺序返回事件的响应流，第block_after个之后的事件要等到close才返回"""
+
+    def __init__(self, texts, block_after=None):
+        self.texts = texts
+        self.block_after = block_after
+        self.released = threading.Event()
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        for i, text in enumerate(self.texts):
+            if self.block_after is not None and i >= self.block_after:
+                self.released.wait(5)
+                if self.closed.is_set():
+                    raise ConnectionError("stream closed")
+            yield _event(text)
+
+    def close(self):
+        self.closed.set()
+        self.released.set()
+
+
+class FakeClient:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def invoke_model_with_response_stream(self, modelId, body):
+        return {"body": self.stream}
+
+
+def _provider(stream):
+    provider = BedrockProvider.__new__(BedrockProvider)
+    provider.model_id = "test-model"
+    provider.region_name = "us-west-2"
+    provider.client = FakeClient(stream)
+    return provider
+
+
+def test_slow_consumer_receives_each_chunk_once(monkeypatch):
+    """队列长期处于满的状态时，每个片段恰好交付一次"""
+    monkeypatch.setattr(llm_service, "LLM_STREAM_QUEUE_SIZE", 2)
+    texts = [str(i) for i in range(200)]
+    provider = _provider(FakeEventStream(texts))
+
+    async def consume():
+        received = []
+        async for text in provider._stream_in_executor({}, {}):
+            received.append(text)
+            if len(received) % 10 == 0:
+                await asyncio.sleep(0.01)
+        return received
+
+    assert asyncio.run(consume()) == texts
+
+
+def test_cancel_closes_blocked_stream():
+    """工作线程阻塞在读取下一个事件时，消费者关闭生成器会立即关闭响应流"""
+    stream = FakeEventStream(["a", "b", "c"], block_after=1)
+    provider = _provider(stream)
+
+    async def consume():
+        chunks = provider._stream_in_executor({}, {})
+        assert await chunks.__anext__() == "a"
+        started = time.perf_counter()
+        await chunks.aclose()
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(consume())
+    assert stream.closed.wait(1)
+    assert elapsed < 1
+
+
+def test_worker_error_is_raised_to_consumer():
+    """工作线程中的异常在消费者一侧重新抛出"""
+
+    class FailingClient:
+        def invoke_model_with_response_stream(self, modelId, body):
+            raise RuntimeError("boom")
+
+    provider = _provider(None)
+    provider.client = FailingClient()
+
+    async def consume():
+        async for _ in provider._stream_in_executor({}, {}):
+            pass
+
+    try:
+        asyncio.run(consume())
+    except RuntimeError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("异常没有传到消费者")
+
+
+def _history():
+    return [{"role": "user", "content": "开始"}, {"role": "assistant", "content": "问题1"}, {"role": "user", "content": "回答"}]
+
+
+def test_unsupported_model_request_has_no_cache_control():
+    """默认的Claude 3 Sonnet不支持提示词缓存，请求体中不能出现cache_control"""
+    provider = _provider(None)
+    provider.model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
+
+    body = provider._prepare_request_body("提示词", _history(), conversation_summary="摘要")
+
+    assert "cache_control" not in json.dumps(body)
+
+
+def test_supported_model_request_sets_cache_breakpoints():
+    provider = _provider(None)
+    provider.model_id = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+
+    body = provider._prepare_request_body("提示词", _history())
+
+    assert body["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert body["messages"][-2]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in json.dumps(body["messages"][-1])
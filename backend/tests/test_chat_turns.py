@@ -0,0 +1,199 @@
+"""
+对话接口测试：排队的轮次不占用LLM调用许可；模型出错时发送SSE错误事件，错误不作为回复保存；
+调度器拒绝时不保存用户消息；对话记录保存失败时发送SSE错误事件
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from app.api import survey_conversation as api_module
+from app.api.sse import GenerationRegistry
+from app.main import app
+from app.services import conversation_writer as writer_module
+from app.services import survey_conversation_service as service_module
+from app.services.conversation_context import ConversationContextCache
+from app.services.conversation_order import ConversationOrderAllocator
+from app.services.conversation_writer import ConversationWriter
+from app.services.llm_service import LLMOverloadedError, LLMProvider, LLMResponse, LLMScheduler, LLMServiceError
+
+TABLE = "cu_survey_response_conversations"
+
+
+class ScriptedProvider(LLMProvider):
+    """先输出一个片段，等gate打开后输出剩余部分；fail为True时随后抛出限流错误，silent为True时不输出第一个片段"""
+
+    model_id = "test-model"
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.silent = False
+        self.gate = None
+        self.calls = 0
+
+    async def generate_stream(self, prompt, conversation_history=None, **kwargs):
+        self.calls += 1
+        if not self.silent:
+            yield "你好"
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            raise LLMServiceError("LLM服务错误: ThrottlingException", throttled=True)
+        yield "！"
+
+    async def generate(self, prompt, conversation_history=None, **kwargs):
+        return LLMResponse(text="", metadata={})
+
+
+@pytest.fixture
+def chat(fake_db, monkeypatch):
+    """对话接口依赖的进程内单例替换为本测试独享的实例"""
+    scheduler = LLMScheduler(max_concurrency=4, model_limits={}, max_queue=8, queue_timeout=1.0, adaptive=True)
+    allocator, cache = ConversationOrderAllocator(), ConversationContextCache()
+    writer = ConversationWriter(interval=0.01)
+    provider = ScriptedProvider()
+    for module in (service_module, writer_module):
+        monkeypatch.setattr(module, "conversation_order_allocator", allocator)
+        monkeypatch.setattr(module, "conversation_context_cache", cache)
+    monkeypatch.setattr(service_module, "conversation_writer", writer)
+    monkeypatch.setattr(service_module, "llm_scheduler", scheduler)
+    monkeypatch.setattr(api_module, "llm_scheduler", scheduler)
+    monkeypatch.setattr(api_module, "generation_registry", GenerationRegistry())
+    monkeypatch.setattr(api_module.survey_conversation_service, "llm_provider", provider)
+
+    survey = fake_db.insert_row("cu_survey", {"title": "S", "status": "published"})
+    fake_db.insert_row("cu_survey_questions", {
+        "survey_id": survey["id"], "question_text": "Q1", "question_order": 1, "question_type": "text"
+    })
+    response_id = fake_db.insert_row("cu_survey_responses", {"survey_id": survey["id"], "status": "pending"})["id"]
+    return response_id, provider, scheduler, writer
+
+
+async def _post(client, response_id, message):
+    response = await client.post(
+        "/api/v1/survey-conversations/chat", json={"response_id": response_id, "message": message}
+    )
+    return response.text
+
+
+def _messages(db, response_id):
+    rows = sorted((r for r in db.rows(TABLE) if r["survey_response_id"] == response_id),
+                  key=lambda r: r["conversation_order"])
+    return [(r["speaker_type"], r["message_text"]) for r in rows]
+
+
+def test_queued_turn_does_not_hold_permit(chat, fake_db):
+    response_id, provider, scheduler, writer = chat
+
+    async def run():
+        provider.gate = asyncio.Event()
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            first = asyncio.ensure_future(_post(client, response_id, "一"))
+            while provider.calls == 0:
+                await asyncio.sleep(0.01)
+            second = asyncio.ensure_future(_post(client, response_id, "二"))
+            await asyncio.sleep(0.05)
+            # 第二轮在回答的锁上排队，此时只有第一轮持有许可
+            active_while_queued = scheduler._active
+            provider.gate.set()
+            bodies = await asyncio.gather(first, second)
+        await writer.close()
+        return active_while_queued, bodies, scheduler._active
+
+    active_while_queued, bodies, active_after = asyncio.run(run())
+    assert active_while_queued == 1
+    assert active_after == 0
+    assert all("data: [DONE]" in body for body in bodies)
+    assert provider.calls == 2
+
+
+def test_model_error_is_sent_as_error_event_and_not_saved(chat, fake_db):
+    response_id, provider, scheduler, writer = chat
+    provider.fail = True
+
+    async def run():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            body = await _post(client, response_id, "你好")
+        await writer.close()
+        return body
+
+    body = asyncio.run(run())
+    events = [event for event in body.split("\r\n\r\n") if event.strip()]
+    assert "data: 你好" in events[0] and "event:" not in events[0]
+    assert "event: error" in events[1]
+    assert "data: LLM服务错误: ThrottlingException" in events[1]
+    assert "data: [DONE]" in events[2]
+
+    # 用户消息和已生成的部分回复（带中断标记）保存，错误信息不作为回复保存
+    assert _messages(fake_db, response_id) == [("user", "你好"), ("assistant", "你好\n[已中断]")]
+    assert scheduler._active == 0
+    assert scheduler.limit_of("test-model") < 4
+
+
+def _events(body):
+    return [event for event in body.split("\r\n\r\n") if event.strip()]
+
+
+def test_model_error_before_any_text_saves_no_interrupted_reply(chat, fake_db):
+    response_id, provider, scheduler, writer = chat
+    provider.fail = provider.silent = True
+
+    async def run():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            body = await _post(client, response_id, "你好")
+        await writer.close()
+        return body
+
+    events = _events(asyncio.run(run()))
+    assert "event: error" in events[0]
+    assert "data: [DONE]" in events[1]
+    # 没有生成任何文本，不保存单独的中断标记
+    assert _messages(fake_db, response_id) == [("user", "你好")]
+
+
+def test_rejected_turn_does_not_save_user_message(chat, fake_db, monkeypatch):
+    response_id, provider, scheduler, writer = chat
+    saturated = LLMScheduler(max_concurrency=1, model_limits={}, max_queue=0, queue_timeout=1.0, adaptive=False)
+    monkeypatch.setattr(service_module, "llm_scheduler", saturated)
+
+    async def run():
+        held = await saturated.acquire("test-model")
+        with pytest.raises(LLMOverloadedError):
+            async for _ in api_module.survey_conversation_service.process_conversation(response_id, "你好"):
+                pass
+        held.release()
+        # 客户端重试成功后只有一条用户消息
+        async for _ in api_module.survey_conversation_service.process_conversation(response_id, "你好"):
+            pass
+        await writer.close()
+        return saturated._active
+
+    assert asyncio.run(run()) == 0
+    assert _messages(fake_db, response_id) == [("user", "你好"), ("assistant", "你好！")]
+
+
+def test_save_failure_is_sent_as_error_event(chat, fake_db):
+    response_id, provider, scheduler, writer = chat
+    writer.max_retries, writer.retry_backoff = 1, 0.01
+    handle = fake_db.handle
+
+    async def failing(request):
+        if request.method == "POST" and TABLE in str(request.url):
+            return httpx.Response(503, json={"message": "unavailable"})
+        return await handle(request)
+
+    fake_db.handle = failing
+
+    async def run():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            body = await _post(client, response_id, "你好")
+        await writer.close()
+        return body
+
+    events = _events(asyncio.run(run()))
+    assert "event:" not in events[0]
+    assert "event: error" in events[-2]
+    assert "data: 对话记录保存失败，请稍后重试" in events[-2]
+    assert "data: [DONE]" in events[-1]
+    assert not any("[错误]" in event for event in events)
@@ -0,0 +1,68 @@
+"""
+gather_with_timeouts测试
+"""
+
+import asyncio
+
+import pytest
+
+from app.concurrency import gather_with_timeouts
+
+
+async def _value(value, delay=0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+async def _fail(message, delay=0.0):
+    await asyncio.sleep(delay)
+    raise RuntimeError(message)
+
+
+def test_no_awaitables_returns_empty_list():
+    assert asyncio.run(gather_with_timeouts()) == []
+    assert asyncio.run(gather_with_timeouts(*[], timeout=1.0)) == []
+
+
+def test_results_keep_argument_order():
+    assert asyncio.run(gather_with_timeouts(_value(1, 0.02), _value(2), _value(3, 0.01))) == [1, 2, 3]
+
+
+def test_failure_cancels_remaining_calls():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(gather_with_timeouts(slow(), _fail("boom")))
+    assert cancelled == [True]
+
+
+def test_per_call_timeout():
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(gather_with_timeouts(_value(1), _value(2, 1.0), timeouts=[None, 0.01]))
+
+
+def test_limit_bounds_concurrent_calls_and_cancels_queued_ones():
+    running = {"now": 0, "max": 0}
+
+    async def tracked(value):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        try:
+            await asyncio.sleep(0.01)
+            return value
+        finally:
+            running["now"] -= 1
+
+    assert asyncio.run(gather_with_timeouts(*(tracked(i) for i in range(10)), limit=3)) == list(range(10))
+    assert running["max"] == 3
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(gather_with_timeouts(_fail("boom"), *(tracked(i) for i in range(10)), limit=2))
+    assert running["now"] == 0
@@ -0,0 +1,203 @@
+"""
+ConversationWriter测试：批量写入、结果不明确的失败后重试、跨进程顺序号冲突、重试不阻塞其他回答、放弃写入后重新同步
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from app.services import conversation_writer as writer_module
+from app.services.conversation_context import ConversationContext, ConversationContextCache
+from app.services.conversation_order import ConversationOrderAllocator
+from app.services.conversation_writer import ConversationWriter
+
+TABLE = "cu_survey_response_conversations"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # 每个测试的内存数据库从id=1开始，顺序号计数器和上下文缓存不能沿用上一个测试的
+    monkeypatch.setattr(writer_module, "conversation_order_allocator", ConversationOrderAllocator())
+    monkeypatch.setattr(writer_module, "conversation_context_cache", ConversationContextCache())
+
+
+def _response(db):
+    survey = db.insert_row("cu_survey", {"title": "S"})
+    return db.insert_row("cu_survey_responses", {"survey_id": survey["id"], "status": "pending"})["id"]
+
+
+def _posts(db):
+    posts = []
+    handle = db.handle
+
+    async def recording(request):
+        if request.method == "POST":
+            posts.append(request)
+        return await handle(request)
+
+    db.handle = recording
+    return posts
+
+
+def _messages(db, response_id):
+    rows = [r for r in db.rows(TABLE) if r["survey_response_id"] == response_id]
+    return sorted((r["conversation_order"], r["message_text"]) for r in rows)
+
+
+def test_messages_from_several_responses_share_one_insert(fake_db):
+    first, second = _response(fake_db), _response(fake_db)
+    posts = _posts(fake_db)
+
+    async def run():
+        writer = ConversationWriter(interval=0.01)
+        orders = [
+            await writer.enqueue(first, "assistant", "a1"),
+            await writer.enqueue(second, "assistant", "b1"),
+            await writer.enqueue(first, "user", "a2"),
+        ]
+        assert await writer.flush()
+        await writer.close()
+        return orders
+
+    assert asyncio.run(run()) == [1, 1, 2]
+    assert len(posts) == 1
+    assert _messages(fake_db, first) == [(1, "a1"), (2, "a2")]
+    assert _messages(fake_db, second) == [(1, "b1")]
+
+
+def test_retry_after_ambiguous_failure_does_not_duplicate(fake_db):
+    """INSERT已提交但客户端超时，重试时跳过已写入的消息"""
+    response_id = _response(fake_db)
+    handle = fake_db.handle
+    calls = {"post": 0}
+
+    async def commit_then_timeout(request):
+        response = await handle(request)
+        if request.method == "POST":
+            calls["post"] += 1
+            if calls["post"] == 1:
+                raise httpx.ReadTimeout("timed out", request=request)
+        return response
+
+    fake_db.handle = commit_then_timeout
+
+    async def run():
+        writer = ConversationWriter(interval=0.01, retry_backoff=0.01)
+        await writer.enqueue(response_id, "assistant", "hello")
+        await writer.enqueue(response_id, "user", "hi")
+        saved = await writer.flush(response_id)
+        await writer.close()
+        return saved
+
+    assert asyncio.run(run())
+    assert calls["post"] == 2
+    assert _messages(fake_db, response_id) == [(1, "hello"), (2, "hi")]
+
+
+def test_order_collision_from_another_writer_renumbers(fake_db):
+    """其他进程占用了顺序号时重新分配，两边的消息都保留且不重复"""
+    response_id = _response(fake_db)
+
+    async def run():
+        writer = ConversationWriter(interval=0.05, retry_backoff=0.01)
+        order = await writer.enqueue(response_id, "assistant", "ours")
+        # 在本进程写入之前，另一个进程写入了同一个顺序号
+        fake_db.insert_row(TABLE, {
+            "survey_response_id": response_id, "speaker_type": "assistant",
+            "message_text": "theirs", "conversation_order": order
+        })
+        saved = await writer.flush(response_id)
+        next_order = await writer.enqueue(response_id, "user", "after")
+        await writer.close()
+        return saved, next_order
+
+    saved, next_order = asyncio.run(run())
+    assert saved
+    assert next_order == 3
+    assert _messages(fake_db, response_id) == [(1, "theirs"), (2, "ours"), (3, "after")]
+
+
+def test_persistent_failure_is_reported_to_flush(fake_db):
+    response_id = _response(fake_db)
+    handle = fake_db.handle
+
+    async def failing(request):
+        if request.method == "POST":
+            return httpx.Response(503, json={"message": "unavailable"})
+        return await handle(request)
+
+    fake_db.handle = failing
+
+    async def run():
+        writer = ConversationWriter(interval=0.01, max_retries=2, retry_backoff=0.01)
+        await writer.enqueue(response_id, "assistant", "lost")
+        saved = await writer.flush(response_id)
+        await writer.close()
+        return saved, writer.pending
+
+    assert asyncio.run(run()) == (False, 0)
+    assert _messages(fake_db, response_id) == []
+
+
+def _failing_for(db, response_id):
+    """包含指定回答消息的INSERT一律返回503，返回原来的请求处理函数"""
+    handle = db.handle
+
+    async def failing(request):
+        if request.method == "POST" and any(
+            row["survey_response_id"] == response_id for row in json.loads(request.content)
+        ):
+            return httpx.Response(503, json={"message": "unavailable"})
+        return await handle(request)
+
+    db.handle = failing
+    return handle
+
+
+def test_permanent_failure_resyncs_orders_and_context(fake_db):
+    response_id = _response(fake_db)
+    handle = _failing_for(fake_db, response_id)
+
+    async def run():
+        writer = ConversationWriter(interval=0.01, max_retries=2, retry_backoff=0.01)
+        writer_module.conversation_context_cache.put(
+            ConversationContext(response_id, 1, questions=[], prompt="", history=[])
+        )
+        first = await writer.enqueue(response_id, "assistant", "lost")
+        saved = await writer.flush(response_id)
+        cached = writer_module.conversation_context_cache.get(response_id)
+        # 未保存的消息不占用顺序号，下一条消息从数据库重新读取
+        fake_db.handle = handle
+        second = await writer.enqueue(response_id, "assistant", "kept")
+        assert await writer.flush(response_id)
+        await writer.close()
+        return first, saved, cached, second
+
+    assert asyncio.run(run()) == (1, False, None, 1)
+    assert _messages(fake_db, response_id) == [(1, "kept")]
+
+
+def test_retry_backoff_does_not_stall_other_responses(fake_db):
+    failing, healthy = _response(fake_db), _response(fake_db)
+    _failing_for(fake_db, failing)
+
+    async def run():
+        writer = ConversationWriter(interval=0.01, max_retries=2, retry_backoff=0.5)
+        await writer.enqueue(failing, "assistant", "lost")
+        await asyncio.sleep(0.05)
+        await writer.enqueue(healthy, "assistant", "kept")
+        started = time.monotonic()
+        saved = await writer.flush(healthy)
+        elapsed = time.monotonic() - started
+        lost = await writer.flush(failing)
+        await writer.close()
+        return saved, elapsed, lost
+
+    saved, elapsed, lost = asyncio.run(run())
+    assert saved and elapsed < 0.3
+    assert not lost
+    assert _messages(fake_db, healthy) == [(1, "kept")]
+    assert _messages(fake_db, failing) == []
@@ -0,0 +1,50 @@
+"""
+访谈记录导出测试：中途出错时写出错误标记并中止传输
+"""
+
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+
+from app.services.export_service import CSV_COLUMNS, EXPORT_ERROR_MARKER, SurveyExportService
+
+
+@pytest.fixture
+def failing_transcripts(monkeypatch):
+    async def iter_transcripts(survey_id, status=None):
+        yield {"id": 1, "status": "completed"}, [{"conversation_order": 1, "speaker_type": "user", "message_text": "hi"}]
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(SurveyExportService, "iter_transcripts", staticmethod(iter_transcripts))
+
+
+def _export(export_format):
+    chunks = []
+
+    async def run():
+        async for chunk in SurveyExportService.stream_export(1, export_format):
+            chunks.append(chunk)
+
+    with pytest.raises(RuntimeError, match="connection reset"):
+        asyncio.run(run())
+    return b"".join(chunks).decode("utf-8")
+
+
+def test_csv_export_error_writes_marker_row_and_aborts(failing_transcripts):
+    rows = list(csv.reader(io.StringIO(_export("csv").lstrip("\ufeff"))))
+
+    assert rows[0] == CSV_COLUMNS
+    assert rows[1][0] == "1"
+    assert rows[-1][0] == EXPORT_ERROR_MARKER
+    assert len(rows[-1]) == len(CSV_COLUMNS)
+    assert "connection reset" in rows[-1][CSV_COLUMNS.index("message_text")]
+
+
+def test_ndjson_export_error_writes_marker_line_and_aborts(failing_transcripts):
+    lines = [json.loads(line) for line in _export("ndjson").splitlines()]
+
+    assert lines[0]["response"]["id"] == 1
+    assert "connection reset" in lines[-1]["error"]
@@ -0,0 +1,136 @@
+"""
+LLMScheduler测试：FIFO排队、队列已满(429)、排队超时(503)、模型之间互不阻塞、取消排队、AIMD调整
+"""
+
+import asyncio
+
+import pytest
+
+from app.services.llm_service import LLMOverloadedError, LLMScheduler
+
+
+def _scheduler(**kwargs):
+    options = dict(
+        max_concurrency=2, model_limits={}, max_queue=8, queue_timeout=1.0, adaptive=False, min_concurrency=1
+    )
+    options.update(kwargs)
+    return LLMScheduler(**options)
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    async def run():
+        scheduler = _scheduler(max_concurrency=1)
+        held = await scheduler.acquire("m")
+        order = []
+
+        async def waiter(tag):
+            permit = await scheduler.acquire("m")
+            order.append(tag)
+            permit.release()
+
+        tasks = [asyncio.ensure_future(waiter(i)) for i in range(5)]
+        await asyncio.sleep(0)
+        depth = scheduler.queue_depth
+        held.release()
+        await asyncio.gather(*tasks)
+        return depth, order, scheduler._active
+
+    assert asyncio.run(run()) == (5, [0, 1, 2, 3, 4], 0)
+
+
+def test_full_queue_is_rejected_with_429():
+    async def run():
+        scheduler = _scheduler(max_concurrency=1, max_queue=1)
+        held = await scheduler.acquire("m")
+        queued = asyncio.ensure_future(scheduler.acquire("m"))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloadedError) as rejected:
+            await scheduler.acquire("m")
+        with pytest.raises(LLMOverloadedError):
+            scheduler.check_queue("m")
+        held.release()
+        (await queued).release()
+        scheduler.check_queue("m")
+        return rejected.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.retry_after > 0
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def run():
+        scheduler = _scheduler(max_concurrency=1, queue_timeout=0.05)
+        held = await scheduler.acquire("m")
+        with pytest.raises(LLMOverloadedError) as timed_out:
+            await scheduler.acquire("m")
+        depth = scheduler.queue_depth
+        held.release()
+        return timed_out.value.status_code, depth, scheduler._active
+
+    assert asyncio.run(run()) == (503, 0, 0)
+
+
+def test_model_at_its_limit_does_not_block_other_models():
+    async def run():
+        scheduler = _scheduler(max_concurrency=4, model_limits={"slow": 1})
+        slow = await scheduler.acquire("slow")
+        queued = asyncio.ensure_future(scheduler.acquire("slow"))
+        await asyncio.sleep(0)
+        other = await asyncio.wait_for(scheduler.acquire("fast"), 0.1)
+        waiting = not queued.done()
+        slow.release()
+        (await queued).release()
+        other.release()
+        return waiting, scheduler._active
+
+    assert asyncio.run(run()) == (True, 0)
+
+
+def test_cancelled_waiter_leaves_queue_and_release_is_idempotent():
+    async def run():
+        scheduler = _scheduler(max_concurrency=1)
+        held = await scheduler.acquire("m")
+        queued = asyncio.ensure_future(scheduler.acquire("m"))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.sleep(0)
+        depth = scheduler.queue_depth
+        held.release()
+        held.release()
+        return depth, scheduler._active, scheduler._model("m").active
+
+    assert asyncio.run(run()) == (0, 0, 0)
+
+
+def test_throttling_decreases_limit_once_per_cooldown_and_recovers():
+    async def run():
+        scheduler = _scheduler(max_concurrency=20, adaptive=True, min_concurrency=2)
+        (await scheduler.acquire("m")).release(throttled=True)
+        decreased = scheduler.limit_of("m")
+        (await scheduler.acquire("m")).release(throttled=True)
+        during_cooldown = scheduler.limit_of("m")
+        for _ in range(200):
+            (await scheduler.acquire("m")).release()
+        return decreased, during_cooldown, scheduler.limit_of("m")
+
+    decreased, during_cooldown, recovered = asyncio.run(run())
+    assert decreased == 14
+    assert during_cooldown == decreased
+    assert recovered == 20
+
+
+def test_model_cap_below_minimum_concurrency_is_a_hard_limit():
+    async def run():
+        scheduler = _scheduler(max_concurrency=8, model_limits={"m": 1}, adaptive=True, min_concurrency=4)
+        first = await scheduler.acquire("m")
+        first.release(throttled=True)
+        held = await scheduler.acquire("m")
+        queued = asyncio.ensure_future(scheduler.acquire("m"))
+        await asyncio.sleep(0.01)
+        waiting = not queued.done()
+        held.release()
+        (await queued).release()
+        return scheduler.limit_of("m"), waiting
+
+    assert asyncio.run(run()) == (1, True)
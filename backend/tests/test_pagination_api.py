@@ -0,0 +1,62 @@
+"""
+列表接口分页测试：默认保持偏移分页，传入cursor或keyset=true时使用游标分页
+"""
+
+import asyncio
+
+import httpx
+
+from app.main import app
+
+
+def _get(path, **params):
+    async def request():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            return await client.get(path, params=params)
+    return asyncio.run(request())
+
+
+def _seed_surveys(db, count):
+    return [db.insert_row("cu_survey", {"title": f"s{i}", "status": "draft"}) for i in range(count)]
+
+
+def test_list_surveys_defaults_to_offset_paging(fake_db):
+    _seed_surveys(fake_db, 3)
+
+    response = _get("/api/v1/surveys/", limit=2)
+
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert "x-next-cursor" not in response.headers
+
+
+def test_list_surveys_keyset_opt_in(fake_db):
+    surveys = _seed_surveys(fake_db, 3)
+
+    first = _get("/api/v1/surveys/", limit=2, keyset="true")
+    cursor = first.headers["x-next-cursor"]
+    second = _get("/api/v1/surveys/", limit=2, cursor=cursor)
+
+    ids = [s["id"] for s in first.json() + second.json()]
+    assert sorted(ids) == sorted(s["id"] for s in surveys)
+    assert "x-next-cursor" not in second.headers
+
+
+def test_table_data_default_shape_unchanged(fake_db):
+    _seed_surveys(fake_db, 3)
+
+    body = _get("/api/v1/tables/cu_survey", limit=2).json()
+
+    assert set(body) == {"data", "count"}
+    assert body["count"] == 2
+
+
+def test_table_data_keyset_returns_next_cursor(fake_db):
+    _seed_surveys(fake_db, 3)
+
+    first = _get("/api/v1/tables/cu_survey", limit=2, keyset="true").json()
+    second = _get("/api/v1/tables/cu_survey", limit=2, cursor=first["next_cursor"]).json()
+
+    assert [r["title"] for r in first["data"] + second["data"]] == ["s0", "s1", "s2"]
+    assert second["next_cursor"] is None
+    assert _get("/api/v1/tables/cu_survey", cursor="bogus").status_code == 400
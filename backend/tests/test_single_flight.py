@@ -0,0 +1,168 @@
+"""
+同一回答的对话轮次去重测试：进程内的生成登记表，以及跨worker的租约
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.api import sse
+from app.api.sse import GenerationRegistry
+from app.api.survey_conversation import make_turn_key
+from app.services.turn_lease import TurnLease
+
+
+@pytest.fixture(autouse=True)
+def no_coalescing(monkeypatch):
+    monkeypatch.setattr(sse, "coalesce", lambda chunks: chunks)
+
+
+async def _texts(items, delay=0.0, log=None, name=None):
+    if log is not None:
+        log.append(f"start:{name}")
+    for item in items:
+        await asyncio.sleep(delay)
+        yield item
+    if log is not None:
+        log.append(f"end:{name}")
+
+
+async def _read(generation):
+    return [data async for _, data in generation.subscribe()]
+
+
+def test_duplicate_turn_joins_running_generation():
+    calls = []
+
+    def make_chunks():
+        calls.append(1)
+        return _texts(["a", "b"], delay=0.01)
+
+    async def run():
+        registry = GenerationRegistry(capacity=16, grace=1.0, retention=1.0)
+        key = make_turn_key("chat", "hello")
+        first, first_joined = registry.start(1, key, make_chunks, "chat")
+        second, second_joined = registry.start(1, key, make_chunks, "chat")
+        results = await asyncio.gather(_read(first), _read(second))
+        return first, second, first_joined, second_joined, results
+
+    first, second, first_joined, second_joined, results = asyncio.run(run())
+    assert second is first
+    assert (first_joined, second_joined) == (False, True)
+    assert calls == [1]
+    assert results == [["a", "b", "[DONE]"], ["a", "b", "[DONE]"]]
+
+
+def test_different_turns_of_one_response_run_in_order():
+    log = []
+
+    async def run():
+        registry = GenerationRegistry(capacity=16, grace=1.0, retention=1.0)
+        first, _ = registry.start(
+            1, make_turn_key("chat", "one"), lambda: _texts(["1"], 0.02, log, "one"), "chat"
+        )
+        second, joined = registry.start(
+            1, make_turn_key("chat", "two"), lambda: _texts(["2"], 0.0, log, "two"), "chat"
+        )
+        other, _ = registry.start(
+            2, make_turn_key("chat", "one"), lambda: _texts(["3"], 0.0, log, "other"), "chat"
+        )
+        await asyncio.gather(_read(first), _read(second), _read(other))
+        return joined, registry
+
+    joined, registry = asyncio.run(run())
+    assert not joined
+    # 第二轮等第一轮结束后才开始；其他回答不受影响
+    assert log.index("end:one") < log.index("start:two")
+    assert log.index("start:other") < log.index("end:one")
+    assert registry.join(1, make_turn_key("chat", "one"), "chat") is None
+
+
+def test_same_message_after_completion_starts_new_turn():
+    async def run():
+        registry = GenerationRegistry(capacity=16, grace=1.0, retention=1.0)
+        key = make_turn_key("chat", "again")
+        first, _ = registry.start(1, key, lambda: _texts(["a"]), "chat")
+        await _read(first)
+        await asyncio.sleep(0)  # 等待生成任务的结束回调
+        second, joined = registry.start(1, key, lambda: _texts(["b"]), "chat")
+        return first, second, joined, await _read(second)
+
+    first, second, joined, events = asyncio.run(run())
+    assert second is not first
+    assert not joined
+    assert events == ["b", "[DONE]"]
+
+
+class FakeLeases:
+    """模拟acquire/release_response_turn_lease数据库函数"""
+
+    def __init__(self):
+        self.leases = {}
+
+    def acquire(self, db, params):
+        lease = self.leases.get(params["p_response_id"])
+        now = time.monotonic()
+        if lease is None or lease["expires"] < now or lease["holder"] == params["p_holder"]:
+            lease = {
+                "holder": params["p_holder"], "turn_key": params["p_turn_key"],
+                "expires": now + params["p_ttl_seconds"]
+            }
+            self.leases[params["p_response_id"]] = lease
+        return [{"acquired": lease["holder"] == params["p_holder"], "current_turn_key": lease["turn_key"]}]
+
+    def release(self, db, params):
+        lease = self.leases.get(params["p_response_id"])
+        if lease is not None and lease["holder"] == params["p_holder"]:
+            del self.leases[params["p_response_id"]]
+        return None
+
+
+@pytest.fixture
+def leases(fake_db):
+    fake = FakeLeases()
+    fake_db.register_rpc("acquire_response_turn_lease", fake.acquire)
+    fake_db.register_rpc("release_response_turn_lease", fake.release)
+    return fake
+
+
+async def _drain(chunks):
+    return "".join([chunk async for chunk in chunks])
+
+
+def test_lease_waits_for_turn_on_other_worker_then_runs(leases):
+    lease = TurnLease(enabled=True, ttl=60, wait=2, poll_interval=0.01)
+    leases.leases[1] = {"holder": "other", "turn_key": "previous", "expires": time.monotonic() + 60}
+
+    async def run():
+        task = asyncio.ensure_future(_drain(lease.run_exclusive(1, "mine", _texts(["ok"]))))
+        await asyncio.sleep(0.05)
+        waiting = not task.done()
+        del leases.leases[1]
+        return waiting, await task
+
+    waiting, text = asyncio.run(run())
+    assert waiting
+    assert text == "ok"
+    assert leases.leases == {}
+
+
+def test_lease_rejects_duplicate_turn_and_times_out(leases):
+    lease = TurnLease(enabled=True, ttl=60, wait=0.05, poll_interval=0.01)
+    leases.leases[1] = {"holder": "other", "turn_key": "same", "expires": time.monotonic() + 60}
+
+    duplicate = asyncio.run(_drain(lease.run_exclusive(1, "same", _texts(["never"]))))
+    timed_out = asyncio.run(_drain(lease.run_exclusive(1, "different", _texts(["never"]))))
+
+    assert "相同的消息正在处理中" in duplicate
+    assert "上一轮对话仍在处理中" in timed_out
+
+
+def test_lease_disables_itself_when_functions_are_missing(fake_db):
+    lease = TurnLease(enabled=True, ttl=60, wait=1, poll_interval=0.01)
+
+    text = asyncio.run(_drain(lease.run_exclusive(1, "turn", _texts(["a", "b"]))))
+
+    assert text == "ab"
+    assert not lease.enabled
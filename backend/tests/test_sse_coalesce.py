@@ -0,0 +1,131 @@
+"""
+coalesce测试：首个片段立即输出，按时间窗口和字节数合并，有界缓冲；
+客户端不读取时生成照常完成，缓存的事件数不超过环形缓冲区容量
+"""
+
+import asyncio
+import functools
+
+import pytest
+
+from app.api import sse
+from app.api.sse import EventsEvictedError, GenerationRegistry, coalesce
+
+
+async def _chunks(items, delay=0.0, produced=None):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        if produced is not None:
+            produced.append(item)
+        yield item
+
+
+async def _collect(chunks, **kwargs):
+    return [text async for text in coalesce(chunks, **kwargs)]
+
+
+def test_first_chunk_is_not_delayed_and_rest_is_merged():
+    items = ["x"] * 100
+
+    events = asyncio.run(_collect(_chunks(items), interval=0.05, max_bytes=10_000))
+
+    assert events[0] == "x"
+    assert "".join(events) == "".join(items)
+    assert len(events) <= 3
+
+
+def test_events_respect_byte_limit():
+    items = ["字"] * 50  # 每个3字节
+
+    events = asyncio.run(_collect(_chunks(items), interval=1.0, max_bytes=12))
+
+    assert "".join(events) == "".join(items)
+    assert all(len(e.encode("utf-8")) <= 12 for e in events)
+    assert len(events) == 1 + 49 // 4 + 1
+
+
+def test_slow_upstream_is_not_held_back():
+    """上游间隔大于时间窗口时，每个片段单独输出，不额外等待"""
+    items = ["a", "b", "c", "d"]
+
+    events = asyncio.run(_collect(_chunks(items, delay=0.03), interval=0.005, max_bytes=10_000))
+
+    assert events == items
+
+
+def test_upstream_error_after_partial_output():
+    async def failing():
+        yield "a"
+        yield "b"
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        received = []
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            async for text in coalesce(failing(), interval=0.01):
+                received.append(text)
+        return received
+
+    assert "".join(asyncio.run(run())) == "ab"
+
+
+def test_slow_consumer_bounds_upstream_reads():
+    """消费方不读取时，后台任务最多读入buffer_chunks个片段后暂停"""
+    produced = []
+
+    async def run():
+        events = coalesce(_chunks(["x"] * 1000, produced=produced), buffer_chunks=8)
+        assert await events.__anext__() == "x"
+        await asyncio.sleep(0.05)
+        count = len(produced)
+        await events.aclose()
+        return count
+
+    assert asyncio.run(run()) <= 8 + 2
+
+
+def test_stalled_client_does_not_block_generation_and_memory_stays_bounded(monkeypatch):
+    """生成与客户端解耦：订阅者停止读取时上游照常读完，缓冲区只保留最近的capacity个事件"""
+    # 每个片段单独成为一个事件
+    monkeypatch.setattr(sse, "coalesce", functools.partial(coalesce, max_bytes=1))
+    produced = []
+
+    async def run():
+        registry = GenerationRegistry(capacity=16, grace=1.0, retention=1.0)
+        generation, _ = registry.start(1, "turn", lambda: _chunks(["x"] * 200, delay=0.001, produced=produced), "chat")
+        stalled = generation.subscribe()
+        first = await stalled.__anext__()
+        for _ in range(300):
+            if generation.done:
+                break
+            await asyncio.sleep(0.01)
+        buffered = len(generation._events)
+        with pytest.raises(EventsEvictedError):
+            await stalled.__anext__()
+        return first, buffered
+
+    first, buffered = asyncio.run(run())
+    assert first == (1, "x")
+    assert len(produced) == 200
+    assert buffered == 16
+
+
+def test_close_stops_upstream():
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                yield "x"
+        finally:
+            closed.set()
+
+    async def run():
+        events = coalesce(endless(), interval=0.01)
+        await events.__anext__()
+        await events.aclose()
+        return closed.is_set()
+
+    assert asyncio.run(run())
@@ -0,0 +1,146 @@
+"""
+生成缓冲区测试：订阅、续传、环形缓冲区覆盖（读取过慢的订阅者收到错误事件）、无人订阅时取消，以及Last-Event-ID续传接口
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from app.api import sse
+from app.api.sse import EventsEvictedError, GenerationRegistry, generation_registry, parse_last_event_id, stream_events
+from app.main import app
+
+
+@pytest.fixture(autouse=True)
+def no_coalescing(monkeypatch):
+    # 每个文本片段对应一个事件，便于断言顺序号
+    monkeypatch.setattr(sse, "coalesce", lambda chunks: chunks)
+
+
+async def _texts(items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+async def _read(generation, after_seq=0):
+    return [event async for event in generation.subscribe(after_seq)]
+
+
+def test_subscribers_receive_all_events_and_resume_after_seq():
+    async def run():
+        registry = GenerationRegistry(capacity=16, grace=1.0, retention=1.0)
+        generation, joined = registry.start(1, "turn", lambda: _texts(["a", "b", "c"], delay=0.01), "chat")
+        live = await _read(generation)
+        resumed = await _read(generation, after_seq=2)
+        return joined, live, resumed
+
+    joined, live, resumed = asyncio.run(run())
+    assert not joined
+    assert live == [(1, "a"), (2, "b"), (3, "c"), (4, "[DONE]")]
+    assert resumed == [(3, "c"), (4, "[DONE]")]
+
+
+def test_evicted_events_cannot_be_resumed():
+    async def run():
+        registry = GenerationRegistry(capacity=3, grace=1.0, retention=1.0)
+        generation, _ = registry.start(1, "turn", lambda: _texts([str(i) for i in range(10)]), "chat")
+        tail = await _read(generation, after_seq=8)
+        with pytest.raises(EventsEvictedError):
+            await _read(generation, after_seq=2)
+        return generation, tail
+
+    generation, tail = asyncio.run(run())
+    assert tail == [(9, "8"), (10, "9"), (11, "[DONE]")]
+    assert generation.can_resume_from(8)
+    assert not generation.can_resume_from(7)
+    assert generation.can_resume_from(11)
+    assert not generation.can_resume_from(12)
+
+
+class _Request:
+    """stream_events只用到client和is_disconnected"""
+
+    client = None
+
+    async def is_disconnected(self):
+        return False
+
+
+def test_slow_subscriber_gets_error_event_when_events_are_evicted():
+    async def run():
+        registry = GenerationRegistry(capacity=3, grace=1.0, retention=1.0)
+        generation, _ = registry.start(1, "turn", lambda: _texts([str(i) for i in range(10)], delay=0.001), "chat")
+        stream = stream_events(_Request(), generation, endpoint="chat")
+        received = [await stream.__anext__()]
+        # 订阅者停止读取期间生成继续进行，缓冲区只保留最近的capacity个事件
+        await asyncio.sleep(0.05)
+        buffered = len(generation._events)
+        received += [event async for event in stream]
+        return buffered, received
+
+    buffered, received = asyncio.run(run())
+    assert buffered == 3
+    assert received[0]["data"] == "0"
+    assert received[-2] == {"event": "error", "data": "连接过慢，部分内容已丢失，请刷新对话"}
+    assert received[-1] == {"data": "[DONE]"}
+    assert not any("[错误]" in event["data"] for event in received)
+
+
+def test_generation_without_subscribers_is_cancelled_after_grace():
+    closed = []
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield "x"
+        finally:
+            closed.append(True)
+
+    async def run():
+        registry = GenerationRegistry(capacity=16, grace=0.05, retention=1.0)
+        generation, _ = registry.start(1, "turn", endless, "chat")
+        await asyncio.sleep(0.2)
+        return generation
+
+    generation = asyncio.run(run())
+    assert generation.done
+    assert closed == [True]
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("abc:12") == ("abc", 12)
+    with pytest.raises(ValueError):
+        parse_last_event_id("abc")
+    with pytest.raises(ValueError):
+        parse_last_event_id("abc:x")
+
+
+def _post_chat(headers):
+    async def request():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            return await client.post(
+                "/api/v1/survey-conversations/chat", json={"response_id": 1, "message": "hi"}, headers=headers
+            )
+    return asyncio.run(request())
+
+
+def test_resume_endpoint_replays_from_last_event_id():
+    async def start():
+        generation, _ = generation_registry.start(1, "resume-test", lambda: _texts(["a", "b", "c"]), "chat")
+        await _read(generation)
+        return generation
+
+    generation = asyncio.run(start())
+    body = _post_chat({"Last-Event-ID": generation.event_id(1)}).text
+
+    assert [line[len("data: "):] for line in body.splitlines() if line.startswith("data: ")] == ["b", "c", "[DONE]"]
+    assert f"id: {generation.event_id(4)}" in body
+
+
+def test_resume_endpoint_rejects_unknown_and_malformed_ids():
+    assert _post_chat({"Last-Event-ID": "unknown:1"}).status_code == 410
+    assert _post_chat({"Last-Event-ID": "garbage"}).status_code == 400
@@ -0,0 +1,101 @@
+"""
+SurveyQuestionDAO重排测试
+"""
+
+import asyncio
+
+import pytest
+
+from app.database.dao import survey_question_dao
+from app.database.dao.survey_question_dao import SurveyQuestionDAO
+
+
+@pytest.fixture(autouse=True)
+def without_reorder_rpc(monkeypatch):
+    # 内存PostgREST没有注册reorder_survey_questions，走回退路径
+    monkeypatch.setattr(survey_question_dao, "_reorder_rpc_retry_at", 0.0)
+
+
+def _seed(db, count=3):
+    survey = db.insert_row("cu_survey", {"title": "S"})
+    questions = [
+        db.insert_row("cu_survey_questions", {
+            "survey_id": survey["id"], "question_text": f"q{i}", "question_order": i
+        })
+        for i in range(1, count + 1)
+    ]
+    return survey, questions
+
+
+def test_fallback_reorders_questions(fake_db):
+    survey, (q1, q2, q3) = _seed(fake_db)
+
+    result = asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [q3["id"], q1["id"], q2["id"]]))
+
+    assert [q.id for q in result] == [q3["id"], q1["id"], q2["id"]]
+    assert [q.question_order for q in result] == [1, 2, 3]
+
+
+def test_fallback_keeps_concurrent_edits(fake_db):
+    """读取问题列表与写回顺序之间对问题内容的修改不会被覆盖"""
+    survey, (q1, q2, q3) = _seed(fake_db)
+    handle = fake_db.handle
+
+    async def edit_after_read(request):
+        response = await handle(request)
+        if request.method == "GET":
+            q2["question_text"] = "edited"
+        return response
+
+    fake_db.handle = edit_after_read
+    asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [q2["id"], q3["id"], q1["id"]]))
+
+    assert q2["question_text"] == "edited"
+    assert (q2["question_order"], q3["question_order"], q1["question_order"]) == (1, 2, 3)
+
+
+def test_fallback_rejects_mismatched_ids(fake_db):
+    survey, (q1, q2, _) = _seed(fake_db)
+
+    with pytest.raises(ValueError):
+        asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [q1["id"], q2["id"]]))
+    with pytest.raises(ValueError):
+        asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [q1["id"], q1["id"], q2["id"]]))
+
+
+def test_rpc_is_probed_again_after_retry_interval(fake_db, monkeypatch):
+    survey, (q1, q2, q3) = _seed(fake_db)
+    posts = []
+    handle = fake_db.handle
+
+    async def recording(request):
+        if request.method == "POST":
+            posts.append(request.url.path)
+        return await handle(request)
+
+    fake_db.handle = recording
+    asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [q2["id"], q1["id"], q3["id"]]))
+    asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [q1["id"], q2["id"], q3["id"]]))
+    assert len(posts) == 1
+    assert survey_question_dao._reorder_rpc_retry_at > 0
+
+    # 迁移执行后，过了重试间隔再次调用数据库函数
+    def reorder(db, params):
+        rows = {q["id"]: q for q in db.rows("cu_survey_questions")}
+        for order, question_id in enumerate(params["p_question_ids"], start=1):
+            rows[question_id]["question_order"] = order
+        return [rows[question_id] for question_id in params["p_question_ids"]]
+
+    fake_db.register_rpc("reorder_survey_questions", reorder)
+    monkeypatch.setattr(survey_question_dao, "_reorder_rpc_retry_at", 0.0)
+    result = asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [q3["id"], q2["id"], q1["id"]]))
+
+    assert [q.id for q in result] == [q3["id"], q2["id"], q1["id"]]
+    assert len(posts) == 2
+    assert survey_question_dao._reorder_rpc_retry_at == 0.0
+
+
+def test_fallback_on_survey_without_questions(fake_db):
+    survey = fake_db.insert_row("cu_survey", {"title": "empty"})
+
+    assert asyncio.run(SurveyQuestionDAO.reorder_questions(survey["id"], [])) == []
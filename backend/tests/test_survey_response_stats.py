@@ -0,0 +1,97 @@
+"""
+SurveyResponseDAO.get_stats测试
+"""
+
+import asyncio
+
+import pytest
+
+from app.database.dao import survey_response_dao
+from app.database.dao.survey_response_dao import SurveyResponseDAO
+
+
+@pytest.fixture(autouse=True)
+def reset_rpc_probe(monkeypatch):
+    monkeypatch.setattr(survey_response_dao, "_stats_rpc_retry_at", 0.0)
+
+
+def _seed(db):
+    survey = db.insert_row("cu_survey", {"title": "S"})
+    for status in ["pending", "pending", "completed", "abandoned", None]:
+        db.insert_row("cu_survey_responses", {"survey_id": survey["id"], "status": status})
+    empty = db.insert_row("cu_survey", {"title": "empty"})
+    return survey["id"], empty["id"]
+
+
+def _record_methods(db):
+    methods = []
+    handle = db.handle
+
+    async def recording(request):
+        methods.append(request.method)
+        return await handle(request)
+
+    db.handle = recording
+    return methods
+
+
+def test_fallback_counts_without_transferring_rows(fake_db):
+    survey_id, empty_id = _seed(fake_db)
+    methods = _record_methods(fake_db)
+
+    stats = asyncio.run(SurveyResponseDAO.get_stats([survey_id, empty_id]))
+
+    assert stats[survey_id].total_responses == 5
+    assert stats[survey_id].status_counts == {"pending": 2, "completed": 1, "unknown": 1, "other": 1}
+    assert stats[survey_id].completed_responses == 1
+    assert stats[survey_id].completion_rate == pytest.approx(0.2)
+    assert stats[empty_id].total_responses == 0
+    assert stats[empty_id].status_counts == {}
+    # 一次探测RPC，其余都是只返回计数的HEAD请求
+    assert methods[0] == "POST"
+    assert set(methods[1:]) == {"HEAD"}
+
+
+def test_rpc_is_probed_again_after_retry_interval(fake_db, monkeypatch):
+    survey_id, _ = _seed(fake_db)
+    methods = _record_methods(fake_db)
+
+    asyncio.run(SurveyResponseDAO.get_stats([survey_id]))
+    asyncio.run(SurveyResponseDAO.get_stats([survey_id]))
+    assert methods.count("POST") == 1
+    assert survey_response_dao._stats_rpc_retry_at > 0
+
+    # 迁移执行后，过了重试间隔再次调用数据库函数
+    fake_db.register_rpc("survey_response_stats", lambda db, params: [{
+        "survey_id": survey_id, "total_responses": 5, "status_counts": {"pending": 2},
+        "completed_responses": 1, "avg_turns": 3.5
+    }])
+    monkeypatch.setattr(survey_response_dao, "_stats_rpc_retry_at", 0.0)
+    stats = asyncio.run(SurveyResponseDAO.get_stats([survey_id]))
+
+    assert stats[survey_id].avg_turns == 3.5
+    assert survey_response_dao._stats_rpc_retry_at == 0.0
+
+
+def test_fallback_bounds_concurrent_count_requests(fake_db, monkeypatch):
+    monkeypatch.setattr(survey_response_dao, "STATS_FALLBACK_CONCURRENCY", 4)
+    survey_ids = [fake_db.insert_row("cu_survey", {"title": f"S{i}"})["id"] for i in range(20)]
+    handle = fake_db.handle
+    in_flight = {"now": 0, "max": 0}
+
+    async def slow_heads(request):
+        if request.method != "HEAD":
+            return await handle(request)
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        try:
+            await asyncio.sleep(0.001)
+            return await handle(request)
+        finally:
+            in_flight["now"] -= 1
+
+    fake_db.handle = slow_heads
+    stats = asyncio.run(SurveyResponseDAO.get_stats(survey_ids))
+
+    assert len(stats) == 20
+    assert in_flight["max"] == 4
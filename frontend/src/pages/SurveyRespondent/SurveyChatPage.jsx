@@ -12,6 +12,9 @@ import { createSurveyResponse, getSurveyResponseById, getSurveyResponseConversat
 
 // 2024-08-23: 定义问题总数，用于计算进度
 const TOTAL_QUESTIONS = 5;
+// 2026-10-18: 流式连接中断后携带Last-Event-ID续传的最大次数，以及每次重试前递增的等待时间
+const MAX_STREAM_RESUME_ATTEMPTS = 3;
+const STREAM_RESUME_DELAY_MS = 1000;
 
 // 2024-09-24: 更新获取或创建responseId的函数，使用 Supabase
 const getOrCreateResponseId = async (surveyId) => {
@@ -151,14 +154,16 @@ function SurveyChatPage() {
   }, [messages, streamingMessage]);
 
   // 2024-09-25: 优化流式响应处理函数，实现打字机效果
-  const handleStreamResponse = async (response) => {
+  // 2026-10-18: reconnect(lastEventId)用于断线续传：fetch发起的POST流不会像EventSource那样自动重连，
+  // 连接在收到[DONE]之前中断时，携带最后收到的事件ID重新请求，服务端只补发之后的事件
+  const handleStreamResponse = async (response, reconnect) => {
     if (!response.ok) {
       throw new Error(`API请求失败: ${response.status} ${response.statusText}`);
     }
     
     // 获取响应的reader
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
+    let reader = response.body.getReader();
+    let decoder = new TextDecoder();
     
     // 开始接收前清空流式消息
     setStreamingMessage('');
@@ -167,10 +172,67 @@ function SurveyChatPage() {
     let buffer = '';
     let messageContent = '';
     let displayedContent = ''; // 跟踪实际显示的内容
+    let eventData = null;      // 正在接收的事件的内容
+    let eventId = null;        // 正在接收的事件的ID
+    let eventType = null;      // 正在接收的事件的类型，error表示生成出错
+    let streamError = null;    // 服务端发来的错误信息，不作为回复内容显示
+    let lastEventId = null;    // 最后完整收到的事件ID，续传时作为Last-Event-ID
+    let receivedDone = false;  // 是否收到[DONE]，收到之前连接结束视为中断
+    let resumeAttempts = 0;    // 本次中断后已尝试续传的次数
+    let receivedSinceResume = true;
+    
+    // 连接中断后尝试续传，成功时返回新的reader，无法续传时返回null
+    const resume = async () => {
+      while (reconnect && lastEventId && resumeAttempts < MAX_STREAM_RESUME_ATTEMPTS) {
+        resumeAttempts += 1;
+        await new Promise(resolve => setTimeout(resolve, STREAM_RESUME_DELAY_MS * resumeAttempts));
+        console.warn(`流式连接中断，第${resumeAttempts}次续传，Last-Event-ID: ${lastEventId}`);
+        try {
+          const resumed = await reconnect(lastEventId);
+          if (!resumed.ok) {
+            // 400/410：缓冲区已过期或ID无效，无法续传
+            console.error(`续传失败: ${resumed.status} ${resumed.statusText}`);
+            return null;
+          }
+          // 丢弃中断连接上不完整的事件
+          buffer = '';
+          decoder = new TextDecoder();
+          eventData = null;
+          eventId = null;
+          eventType = null;
+          receivedSinceResume = false;
+          return resumed.body.getReader();
+        } catch (resumeError) {
+          console.error('续传请求失败:', resumeError);
+        }
+      }
+      return null;
+    };
     
     try {
       while (true) {
-        const { value, done } = await reader.read();
+        let result;
+        try {
+          result = await reader.read();
+        } catch (readError) {
+          // 网络中断
+          const resumedReader = await resume();
+          if (!resumedReader) {
+            throw readError;
+          }
+          reader = resumedReader;
+          continue;
+        }
+        const { value, done } = result;
+        
+        // 未收到[DONE]就结束：连接被中途关闭。续传后一个事件都没收到就结束说明生成已经结束，不再重试
+        if (done && !receivedDone && receivedSinceResume) {
+          const resumedReader = await resume();
+          if (resumedReader) {
+            reader = resumedReader;
+            continue;
+          }
+        }
         
         // 流结束处理
         if (done) {
@@ -194,6 +256,10 @@ function SurveyChatPage() {
             setIsLoading(false);
           }, 500);
           
+          if (streamError) {
+            setError(streamError);
+          }
+          
           break;
         }
         
@@ -208,23 +274,46 @@ function SurveyChatPage() {
         
         let newContent = '';
         
-        // 处理完整的行
+        // 处理完整的行，空行表示一个事件结束，事件的内容和ID在事件完整收到后才生效，
+        // 避免连接恰好在ID行之后中断时，续传跳过了没收到内容的事件
         for (const line of lines) {
           const trimmedLine = line.trim();
-          if (trimmedLine.startsWith('data:')) {
-            const data = trimmedLine.substring(5).trim();
-            
-            // 检查是否是完成标记
-            if (data === '[DONE]') {
-              console.log('收到 [DONE] 标记');
-              continue;
+          if (!trimmedLine) {
+            if (eventData !== null) {
+              // 检查是否是完成标记
+              if (eventData === '[DONE]') {
+                console.log('收到 [DONE] 标记');
+                receivedDone = true;
+              } else if (eventType === 'error') {
+                // 生成出错：错误信息单独提示，不拼进回复
+                console.error('服务端生成出错:', eventData);
+                streamError = eventData;
+              } else {
+                // 添加到新内容
+                newContent += eventData;
+              }
             }
-            
-            // 添加到新内容
-            newContent += data;
-          } else if (trimmedLine && !trimmedLine.startsWith('event:')) {
-            // 处理非空、非data开头、非event开头的行
-            newContent += trimmedLine;
+            if (eventId !== null) {
+              // 记录事件ID，连接中断后据此续传
+              lastEventId = eventId;
+              receivedSinceResume = true;
+              resumeAttempts = 0;
+            }
+            eventData = null;
+            eventId = null;
+            eventType = null;
+          } else if (trimmedLine.startsWith('id:')) {
+            eventId = trimmedLine.substring(3).trim();
+          } else if (trimmedLine.startsWith('event:')) {
+            eventType = trimmedLine.substring(6).trim();
+          } else if (trimmedLine.startsWith('data:')) {
+            eventData = (eventData || '') + trimmedLine.substring(5).trim();
+          } else if (
+            !trimmedLine.startsWith('retry:') &&
+            !trimmedLine.startsWith(':')
+          ) {
+            // 处理非data/event/id/retry开头、非注释（心跳）的行
+            eventData = (eventData || '') + trimmedLine;
           }
         }
         
@@ -350,7 +439,7 @@ function SurveyChatPage() {
           
           // 调用API开始对话
           const response = await startSurveyChat(responseId);
-          await handleStreamResponse(response);
+          await handleStreamResponse(response, (lastEventId) => startSurveyChat(responseId, lastEventId));
         } catch (err) {
           console.error('初始化对话失败:', err);
           setError('无法开始对话。请刷新页面重试。');
@@ -383,7 +472,7 @@ function SurveyChatPage() {
         
         // 调用API发送消息
         const response = await sendSurveyMessage(responseId, text);
-        await handleStreamResponse(response);
+        await handleStreamResponse(response, (lastEventId) => sendSurveyMessage(responseId, text, lastEventId));
       } catch (err) {
         console.error('发送消息失败:', err);
         setIsLoading(false);
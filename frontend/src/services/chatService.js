@@ -1,7 +1,18 @@
 // 2024-04-25: 新增聊天服务文件，从surveyService.js分离出聊天相关功能
 
+// 2026-10-18: 断线重连时携带收到的最后一个事件ID，服务端从缓冲区续传而不重新生成
+const streamHeaders = (lastEventId) => {
+  const headers = {
+    'Content-Type': 'application/json',
+  };
+  if (lastEventId) {
+    headers['Last-Event-ID'] = lastEventId;
+  }
+  return headers;
+};
+
 // 2024-04-26: 开始问卷对话，调用first_chat接口
-export const startSurveyChat = async (responseId) => {
+export const startSurveyChat = async (responseId, lastEventId = null) => {
   console.log(`startSurveyChat 被调用，Response ID: ${responseId}`);
   
   // 2024-04-26: 使用环境变量，不硬编码API地址
@@ -13,9 +24,7 @@ export const startSurveyChat = async (responseId) => {
   // 使用fetch API发送POST请求，指定响应类型为流式
   const response = await fetch(apiUrl, {
     method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-    },
+    headers: streamHeaders(lastEventId),
     body: JSON.stringify({ response_id: numericResponseId }),
   });
 
@@ -23,7 +32,7 @@ export const startSurveyChat = async (responseId) => {
 };
 
 // 2024-04-25: 发送消息给LLM，调用chat接口
-export const sendSurveyMessage = async (responseId, message) => {
+export const sendSurveyMessage = async (responseId, message, lastEventId = null) => {
   console.log(`sendSurveyMessage 被调用，Response ID: ${responseId}, 消息: ${message}`);
   
   // 2024-04-26: 使用环境变量，不硬编码API地址
@@ -35,9 +44,7 @@ export const sendSurveyMessage = async (responseId, message) => {
   // 使用fetch API发送POST请求，指定响应类型为流式
   const response = await fetch(apiUrl, {
     method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-    },
+    headers: streamHeaders(lastEventId),
     body: JSON.stringify({
       response_id: numericResponseId,
       message: message,